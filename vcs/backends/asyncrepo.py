@@ -0,0 +1,169 @@
+# -*- coding: utf-8 -*-
+"""
+    vcs.backends.asyncrepo
+    ~~~~~~~~~~~~~~~~~~~~~~
+
+    Non blocking facade for repositories and changesets.
+
+    :created_on: Oct 17, 2026
+    :copyright: (c) 2010-2011 by Marcin Kuzminski, Lukasz Balcerzak.
+"""
+from __future__ import with_statement
+
+import threading
+from multiprocessing.pool import ThreadPool
+
+from vcs.conf import settings
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_default_pool():
+    """
+    Returns process wide ``ThreadPool`` with ``ASYNC_WORKERS`` threads,
+    shared by all facades created without explicit pool.
+    """
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ThreadPool(settings.ASYNC_WORKERS)
+        return _pool
+
+
+class AsyncBase(object):
+    """
+    Runs calls of wrapped object at bounded pool of worker threads. Each
+    method returns ``multiprocessing.pool.AsyncResult`` at once; its
+    ``get`` method returns the value (or raises exception) of the call.
+
+    Calls made through facades of the same repository are serialized, as
+    repository objects are not meant to be used by many threads at once.
+    """
+
+    def __init__(self, obj, pool=None, lock=None):
+        self._obj = obj
+        self.pool = pool or get_default_pool()
+        self._lock = lock or threading.RLock()
+
+    def _submit(self, func, *args, **kwargs):
+        return self.pool.apply_async(self._run, (func, args, kwargs))
+
+    def _run(self, func, args, kwargs):
+        with self._lock:
+            return func(*args, **kwargs)
+
+    def _wrap_changeset(self, changeset):
+        return AsyncChangeset(changeset, pool=self.pool, lock=self._lock)
+
+    def call(self, name, *args, **kwargs):
+        """
+        Calls method of wrapped object with given ``name`` and arguments.
+        """
+        return self._submit(lambda: getattr(self._obj, name)(*args, **kwargs))
+
+    def get_attribute(self, name):
+        """
+        Retrieves attribute (i.e. lazy property) with given ``name`` of
+        wrapped object.
+        """
+        return self._submit(getattr, self._obj, name)
+
+
+class AsyncRepository(AsyncBase):
+    """
+    Non blocking facade of a repository::
+
+        >>> repo = AsyncRepository(get_repo('/path/to/repo'))
+        >>> result = repo.get_changesets(start=0, end=10)
+        >>> changesets = result.get(timeout=30)
+        >>> content = changesets[0].get_file_content('setup.py').get()
+
+    Changesets are returned wrapped with ``AsyncChangeset``.
+    """
+
+    @property
+    def repository(self):
+        return self._obj
+
+    def get_changeset(self, revision=None):
+        return self._submit(lambda: self._wrap_changeset(
+            self._obj.get_changeset(revision)))
+
+    def get_changesets(self, *args, **kwargs):
+        """
+        Same as ``get_changesets`` of repository but result is a list.
+        """
+        return self._submit(lambda: [self._wrap_changeset(changeset)
+            for changeset in self._obj.get_changesets(*args, **kwargs)])
+
+    def get_changesets_bulk(self, revisions):
+        return self._submit(lambda: [self._wrap_changeset(changeset)
+            for changeset in self._obj.get_changesets_bulk(revisions)])
+
+    def get_diff(self, *args, **kwargs):
+        return self._submit(self._obj.get_diff, *args, **kwargs)
+
+    def count(self):
+        return self._submit(self._obj.count)
+
+    def run_git_command(self, cmd):
+        return self._submit(self._obj.run_git_command, cmd)
+
+
+class AsyncChangeset(AsyncBase):
+    """
+    Non blocking facade of a changeset. Identity attributes (``raw_id``,
+    ``short_id`` and ``revision``) are available directly, everything else
+    is retrieved with methods returning ``AsyncResult``.
+    """
+
+    def __init__(self, changeset, pool=None, lock=None):
+        super(AsyncChangeset, self).__init__(changeset, pool, lock)
+        self.raw_id = changeset.raw_id
+        self.short_id = changeset.short_id
+        self.revision = changeset.revision
+
+    def __repr__(self):
+        return '<AsyncChangeset %s>' % self._obj
+
+    @property
+    def changeset(self):
+        return self._obj
+
+    def get_file_content(self, path):
+        return self._submit(self._obj.get_file_content, path)
+
+    def get_file_size(self, path):
+        return self._submit(self._obj.get_file_size, path)
+
+    def get_file_history(self, path, limit=None):
+        return self._submit(lambda: [self._wrap_changeset(changeset)
+            for changeset in self._obj.get_file_history(path, limit)])
+
+    def get_file_annotate(self, path):
+        """
+        Same as ``get_file_annotate`` of changeset but result is a list of
+        (line number, changeset id, changeset callable, line) tuples.
+        """
+        return self._submit(lambda: list(self._obj.get_file_annotate(path)))
+
+    def get_nodes(self, path):
+        return self._submit(self._obj.get_nodes, path)
+
+    def get_node(self, path):
+        return self._submit(self._obj.get_node, path)
+
+    def get_parents(self):
+        return self._submit(lambda: [self._wrap_changeset(changeset)
+            for changeset in self._obj.parents])
+
+    def get_children(self):
+        return self._submit(lambda: [self._wrap_changeset(changeset)
+            for changeset in self._obj.children])
+
+    def get_diff(self, ignore_whitespace=True, context=3):
+        """
+        Returns result of ``diff`` method of the changeset.
+        """
+        return self._submit(self._obj.diff, ignore_whitespace, context)
@@ -9,18 +9,28 @@
     :copyright: (c) 2010-2011 by Marcin Kuzminski, Lukasz Balcerzak.
 """
 
+import array
+import bisect
 import datetime
 import itertools
+import posixpath
+from collections import namedtuple
 
-from vcs.utils import author_name, author_email
+from vcs.utils import (
+    author_name, author_email, date_fromtimestamp, safe_str
+)
+from vcs.utils.archivers import ChunkBuffer, get_archiver
+from vcs.utils.diffcache import get_diff_cache
 from vcs.utils.lazy import LazyProperty
+from vcs.utils.lrucache import LRUCache
 from vcs.utils.helpers import get_dict_for_attrs
 from vcs.conf import settings
 
 from vcs.exceptions import (
-    ChangesetError, EmptyRepositoryError, NodeAlreadyAddedError,
-    NodeAlreadyChangedError, NodeAlreadyExistsError, NodeAlreadyRemovedError,
-    NodeDoesNotExistError, NodeNotChangedError, RepositoryError
+    ChangesetDoesNotExistError, ChangesetError, EmptyRepositoryError,
+    NodeAlreadyAddedError, NodeAlreadyChangedError, NodeAlreadyExistsError,
+    NodeAlreadyRemovedError, NodeDoesNotExistError, NodeNotChangedError,
+    ImproperArchiveTypeError, RepositoryError, VCSError
 )
 
 
@@ -40,7 +50,8 @@ class BaseRepository(object):
             object from external api
 
         ``revisions``
-            list of all available revisions' ids, in ascending order
+            ``RevisionList`` of all available revisions' ids, in ascending
+            order
 
         ``changesets``
             storage dict caching returned changesets
@@ -107,25 +118,40 @@ class BaseRepository(object):
     def description(self):
         raise NotImplementedError
 
+    @LazyProperty
+    def _file_history_cache(self):
+        """
+        Returns ``LRUCache`` of file histories (lists of changesets' ids)
+        keyed by path and id of the changeset history was retrieved from.
+        """
+        return LRUCache(max_entries=settings.FILE_HISTORY_CACHE_ENTRIES)
+
+    @LazyProperty
+    def _annotate_cache(self):
+        """
+        Returns ``LRUCache`` of file annotations (tuples of changesets' ids,
+        one for each line) keyed by path, id of file's version and changeset.
+        """
+        return LRUCache(max_size=settings.ANNOTATE_CACHE_SIZE)
+
+    @LazyProperty
+    def _last_changes_cache(self):
+        """
+        Returns ``LRUCache`` of ids of changesets which have last modified
+        entries of directories, keyed by changeset's id and directory path.
+        """
+        return LRUCache(max_entries=settings.FILE_HISTORY_CACHE_ENTRIES)
+
     @LazyProperty
     def size(self):
         """
         Returns combined size in bytes for all repository files
         """
 
-        size = 0
         try:
-            tip = self.get_changeset()
-            for topnode, dirs, files in tip.walk('/'):
-                for f in files:
-                    size += tip.get_file_size(f.path)
-                for dir in dirs:
-                    for f in files:
-                        size += tip.get_file_size(f.path)
-
-        except RepositoryError, e:
-            pass
-        return size
+            return self.get_changeset().size
+        except RepositoryError:
+            return 0
 
     def is_valid(self):
         """
@@ -149,14 +175,60 @@ class BaseRepository(object):
         """
         raise NotImplementedError
 
+    def get_changesets_bulk(self, revisions):
+        """
+        Returns list of changesets for all given ``revisions`` (in same
+        order). Backends should resolve given ids at once, instead of calling
+        ``get_changeset`` for each of them.
+
+        :raises ``ChangesetDoesNotExistError``: if any of revisions cannot be
+          found
+        """
+        return [self.get_changeset(revision) for revision in revisions]
+
+    def iter_commit_info(self, start=None, end=None, start_date=None,
+                         end_date=None, branch_name=None, reverse=False):
+        """
+        Yields ``CommitInfo`` records of the same changesets, in the same
+        order, as ``get_changesets`` called with given arguments would
+        return. Records are read without building changesets, so this is
+        the cheap way of listing commits. Equal author strings are shared
+        by records.
+        """
+        revs = iter(self.get_changesets(start=start, end=end,
+            start_date=start_date, end_date=end_date,
+            branch_name=branch_name, reverse=reverse).revs)
+        authors = {}
+        while True:
+            chunk = list(itertools.islice(revs, CollectionGenerator.chunk_size))
+            if not chunk:
+                break
+            for info in self._get_commit_infos(chunk, authors):
+                yield info
+
+    def _get_commit_infos(self, revisions, authors):
+        """
+        Returns list of ``CommitInfo`` records for given ``revisions``.
+        Backends should read commits' metadata directly.
+
+        :param authors: dict used to intern author strings (maps authors to
+          themselves or, at backend's choice, raw authors to decoded ones)
+        """
+        infos = []
+        for changeset in self.get_changesets_bulk(revisions):
+            author = authors.setdefault(changeset.author, changeset.author)
+            infos.append(CommitInfo(changeset.raw_id, author,
+                int(changeset._timestamp), changeset.message,
+                tuple(parent.raw_id for parent in changeset.parents)))
+        return infos
+
     def __iter__(self):
         """
         Allows Repository objects to be iterated.
 
         *Requires* implementation of ``__getitem__`` method.
         """
-        for revision in self.revisions:
-            yield self.get_changeset(revision)
+        return iter(CollectionGenerator(self, self.revisions))
 
     def get_changesets(self, start=None, end=None, start_date=None,
                        end_date=None, branch_name=None, reverse=False):
@@ -178,8 +250,7 @@ class BaseRepository(object):
         """
         Returns a iterator of sliced repository
         """
-        for rev in self.revisions[i:j]:
-            yield self.get_changeset(rev)
+        return iter(CollectionGenerator(self, self.revisions[i:j]))
 
     def __getitem__(self, key):
         return self.get_changeset(key)
@@ -231,6 +302,76 @@ class BaseRepository(object):
         """
         raise NotImplementedError
 
+    def get_diff_iter(self, rev1, rev2, path=None, ignore_whitespace=False,
+                      context=3):
+        """
+        Returns iterator over chunks of the same *diff* as ``get_diff``. Chunks
+        are yielded while backend produces them, so whole diff is never kept
+        in memory (i.e. it may be returned as WSGI response or passed to
+        ``DiffProcessor``). Revisions are checked when the method is called.
+        """
+        return iter([self.get_diff(rev1, rev2, path=path,
+                                   ignore_whitespace=ignore_whitespace,
+                                   context=context)])
+
+    def _get_diff_revisions(self, rev1, rev2):
+        """
+        Returns tuple of raw ids of given revisions of a diff (``rev1`` may
+        be ``EMPTY_CHANGESET``).
+
+        :raises ``ChangesetDoesNotExistError``: if there is no such revision
+        """
+        if hasattr(rev1, 'raw_id'):
+            rev1 = getattr(rev1, 'raw_id')
+        if hasattr(rev2, 'raw_id'):
+            rev2 = getattr(rev2, 'raw_id')
+        if rev1 != self.EMPTY_CHANGESET:
+            rev1 = self.get_changeset(rev1).raw_id
+        return rev1, self.get_changeset(rev2).raw_id
+
+    def _get_diff_cache_key(self, kind, rev1, rev2, path, ignore_whitespace,
+                            context):
+        """
+        Returns key of diff cache's entry of given ``kind`` (``raw`` or
+        ``parsed``) for diff between revisions with given raw ids.
+        """
+        return (kind, self.alias, rev1, rev2, safe_str(path or ''),
+                bool(ignore_whitespace), int(context))
+
+    def _get_cached_diff_iter(self, rev1, rev2, path, ignore_whitespace,
+                              context, get_chunks):
+        """
+        Returns iterator over chunks of the diff read from diff cache (see
+        ``DIFF_CACHE_PATH``) or returned by ``get_chunks(rev1, rev2)`` called
+        with raw ids of revisions. In the latter case diff is stored in the
+        cache once all the chunks are read, unless it is bigger than
+        ``DIFF_CACHE_ENTRY_SIZE``.
+        """
+        rev1, rev2 = self._get_diff_revisions(rev1, rev2)
+        cache = get_diff_cache()
+        if cache is None:
+            return get_chunks(rev1, rev2)
+        key = self._get_diff_cache_key('raw', rev1, rev2, path,
+                                       ignore_whitespace, context)
+        diff = cache.get(key)
+        if diff is not None:
+            return iter([diff])
+        return self._iter_and_cache_diff(cache, key, get_chunks(rev1, rev2))
+
+    def _iter_and_cache_diff(self, cache, key, chunks):
+        kept = []
+        size = 0
+        for chunk in chunks:
+            if kept is not None:
+                size += len(chunk)
+                if size > settings.DIFF_CACHE_ENTRY_SIZE:
+                    kept = None
+                else:
+                    kept.append(chunk)
+            yield chunk
+        if kept is not None:
+            cache.set(key, ''.join(kept))
+
     # ========== #
     # COMMIT API #
     # ========== #
@@ -321,6 +462,32 @@ class BaseRepository(object):
         raise NotImplementedError
 
 
+class CommitInfo(namedtuple('CommitInfo',
+                             'raw_id author timestamp message parents')):
+    """
+    Compact, immutable record of commit's metadata, used for listings
+    instead of full changeset. ``timestamp`` is integer unix timestamp and
+    ``parents`` is tuple of raw ids of parent commits.
+    """
+    __slots__ = ()
+
+    @property
+    def short_id(self):
+        return self.raw_id[:12]
+
+    @property
+    def date(self):
+        return date_fromtimestamp(self.timestamp)
+
+    @property
+    def author_name(self):
+        return author_name(self.author)
+
+    @property
+    def author_email(self):
+        return author_email(self.author)
+
+
 class BaseChangeset(object):
     """
     Each backend should implement it's changeset representation.
@@ -497,19 +664,79 @@ class BaseChangeset(object):
         """
         raise NotImplementedError
 
+    def _get_paths_kinds(self, paths):
+        """
+        Returns dict mapping those of given ``paths`` which exist at this
+        changeset to kinds (``NodeKind``) of their nodes. Backends should
+        override this method to resolve all paths within single traversal
+        of the tree.
+        """
+        kinds = {}
+        for path in paths:
+            try:
+                kinds[path] = self.get_node(path).kind
+            except (ChangesetError, NodeDoesNotExistError):
+                pass
+        return kinds
+
+    def _is_file_content_changed(self, path, content):
+        """
+        Returns ``True`` if given ``content`` (raw string) differs from
+        content of the file at the given ``path``. Backends should override
+        this method to compare contents without reading the file.
+        """
+        return self.get_file_content(path) != content
+
     def get_file_changeset(self, path):
         """
         Returns last commit of the file at the given ``path``.
         """
         raise NotImplementedError
 
-    def get_file_history(self, path):
+    def get_file_history(self, path, limit=None):
         """
         Returns history of file as reversed list of ``Changeset`` objects for
         which file at given ``path`` has been modified.
+
+        :param limit: if given, at most ``limit`` changesets are returned
         """
         raise NotImplementedError
 
+    def iter_file_history(self, path, limit=None):
+        """
+        Yields ``Changeset`` objects for which file at given ``path`` has been
+        modified, starting from the most recent one. Backends should
+        override this method to retrieve history lazily.
+
+        :param limit: if given, at most ``limit`` changesets are yielded
+        """
+        return iter(self.get_file_history(path, limit))
+
+    def _iter_cached_file_history(self, key, limit, history):
+        """
+        Yields changesets of file history from ``history`` iterator, or from
+        repository's ``_file_history_cache`` if long enough history is stored
+        for given ``key`` already (``history`` is not consumed then). History
+        retrieved from ``history`` is stored in the cache.
+        """
+        repo = self.repository
+        cached = repo._file_history_cache.get(key)
+        if cached is not None:
+            ids, complete = cached
+            if complete or (limit and len(ids) >= limit):
+                for changeset in repo.get_changesets_bulk(ids[:limit]):
+                    yield changeset
+                return
+
+        ids = []
+        for changeset in history:
+            ids.append(changeset.raw_id)
+            yield changeset
+            if limit and len(ids) >= limit:
+                repo._file_history_cache.set(key, (ids, False))
+                return
+        repo._file_history_cache.set(key, (ids, True))
+
     def get_nodes(self, path):
         """
         Returns combined ``DirNode`` and ``FileNode`` objects list representing
@@ -520,6 +747,49 @@ class BaseChangeset(object):
         """
         raise NotImplementedError
 
+    def get_nodes_with_last_changes(self, path):
+        """
+        Returns list of (node, changeset) tuples for nodes returned by
+        ``get_nodes`` for the given ``path``, where ``changeset`` is the most
+        recent changeset which has modified the node (``None`` for
+        submodules). ``last_changeset`` attribute of each node is set to
+        that changeset as well.
+
+        All nodes are resolved within single walk of directory's history,
+        which stops as soon as every node is resolved. Results are cached by
+        the repository.
+
+        :raises ``ChangesetError``: if node at the given ``path`` is not
+          instance of ``DirNode``
+        """
+        nodes = self.get_nodes(path)
+        path = safe_str(path).strip('/')
+        names = dict((posixpath.basename(safe_str(node.path)), node)
+                     for node in nodes if not node.is_submodule())
+        key = (self.raw_id, path)
+        changes = self.repository._last_changes_cache.get(key)
+        if changes is None:
+            changes = self._find_last_changes(path, names.keys())
+            self.repository._last_changes_cache.set(key, changes)
+
+        ids = sorted(set(changes.itervalues()))
+        changesets = dict((changeset.raw_id, changeset) for changeset
+                          in self.repository.get_changesets_bulk(ids))
+        last_changes = {}
+        for name, node in names.iteritems():
+            changeset = changesets.get(changes.get(name))
+            node.last_changeset = changeset
+            last_changes[node.path] = changeset
+        return [(node, last_changes.get(node.path)) for node in nodes]
+
+    def _find_last_changes(self, path, names):
+        """
+        Returns dict mapping given ``names`` of entries of the directory at
+        ``path`` to ids of the most recent changesets which have modified
+        them.
+        """
+        raise NotImplementedError
+
     def get_node(self, path):
         """
         Returns ``Node`` object from the given ``path``.
@@ -529,7 +799,8 @@ class BaseChangeset(object):
         """
         raise NotImplementedError
 
-    def fill_archive(self, stream=None, kind='tgz', prefix=None):
+    def fill_archive(self, stream=None, kind='tgz', prefix=None,
+                     subrepos=False, level=None, threads=None):
         """
         Fills up given stream.
 
@@ -540,26 +811,99 @@ class BaseChangeset(object):
             Default is repository name and changeset's raw_id joined with dash.
 
             repo-tip.<kind>
-        """
-
-        raise NotImplementedError
+        :param subrepos: include subrepos in this archive.
+        :param level: compression level (``0`` stores files without
+            compression). Default: ``ARCHIVE_COMPRESSION_LEVEL`` setting.
+        :param threads: number of compressing threads. Default:
+            ``ARCHIVE_COMPRESSION_THREADS`` setting.
+
+        :raise ImproperArchiveTypeError: If given kind is wrong.
+        :raise VcsError: If given stream is None
+        """
+        if stream is None:
+            raise VCSError('You need to pass in a valid stream for filling'
+                           ' with archival data')
+        archiver = self._get_archiver(stream, kind, prefix, level, threads)
+        try:
+            for path, mode, content in self._iter_archive_entries(subrepos):
+                archiver.addfile(path, mode, content)
+            archiver.close()
+        finally:
+            archiver.abort()
 
     def get_chunked_archive(self, **kwargs):
         """
-        Returns iterable archive. Tiny wrapper around ``fill_archive`` method.
+        Returns iterable archive. Archive is produced while changeset's tree
+        is walked, as chunks are consumed, so the first chunk is available
+        at once regardless of repository size.
+
+        Accepts the same arguments as ``fill_archive`` except ``stream``
+        (which is not needed and ignored, if given).
 
         :param chunk_size: extra parameter which controls size of returned
             chunks. Default:8k.
-        """
 
+        :raise ImproperArchiveTypeError: If given kind is wrong.
+        """
         chunk_size = kwargs.pop('chunk_size', 8192)
-        stream = kwargs.get('stream')
-        self.fill_archive(**kwargs)
-        while True:
-            data = stream.read(chunk_size)
-            if not data:
-                break
-            yield data
+        kwargs.pop('stream', None)
+        subrepos = kwargs.pop('subrepos', False)
+        buf = ChunkBuffer()
+        # arguments are checked before first chunk is requested
+        archiver = self._get_archiver(buf, **kwargs)
+        return self._iter_archive_chunks(archiver, buf, chunk_size, subrepos)
+
+    def _iter_archive_chunks(self, archiver, buf, chunk_size, subrepos):
+        # archiver is aborted if consumer stops reading (i.e. generator is
+        # closed), so its compressing threads are not left behind
+        try:
+            for path, mode, content in self._iter_archive_entries(subrepos):
+                archiver.addfile(path, mode, content)
+                for chunk in buf.iter_chunks(chunk_size):
+                    yield chunk
+            archiver.close()
+        finally:
+            archiver.abort()
+        for chunk in buf.iter_chunks(chunk_size, flush=True):
+            yield chunk
+
+    def _get_archiver(self, stream, kind='tgz', prefix=None, level=None,
+                      threads=None):
+        """
+        Returns archiver of given ``kind`` writing to given ``stream``.
+
+        :raise ImproperArchiveTypeError: If given kind is wrong.
+        :raise VcsError: If prefix is empty or starts with slash
+        """
+        allowed_kinds = settings.ARCHIVE_SPECS.keys()
+        if kind not in allowed_kinds:
+            raise ImproperArchiveTypeError('Archive kind not supported use one'
+                'of %s', allowed_kinds)
+
+        if prefix is None:
+            prefix = '%s-%s' % (self.repository.name, self.short_id)
+        elif prefix.startswith('/'):
+            raise VCSError("Prefix cannot start with leading slash")
+        elif prefix.strip() == '':
+            raise VCSError("Prefix cannot be empty")
+
+        return get_archiver(kind, stream, prefix=prefix,
+            mtime=self._get_archive_mtime(), level=level, threads=threads)
+
+    def _get_archive_mtime(self):
+        """
+        Returns timestamp used as modification time of archived files.
+        """
+        raise NotImplementedError
+
+    def _iter_archive_entries(self, subrepos=False):
+        """
+        Yields tuples (path, mode, content) of files to archive, where mode
+        is git-like mode (regular file, executable, symlink or gitlink).
+
+        :param subrepos: include files of subrepos
+        """
+        raise NotImplementedError
 
     @LazyProperty
     def root(self):
@@ -586,6 +930,27 @@ class BaseChangeset(object):
         """
         raise NotImplementedError
 
+    def _get_adjacent_changeset(self, step, positions=None):
+        """
+        Returns changeset placed right after (if ``step`` is ``1``) or before
+        (if ``step`` is ``-1``) this one at repository's ``revisions``. If
+        sorted list of ``positions`` is given, only revisions at those
+        positions are taken into account.
+
+        :raises ``ChangesetDoesNotExistError``: if there is no such changeset
+        """
+        if positions is None:
+            pos = self.revision + step
+        elif step > 0:
+            idx = bisect.bisect_right(positions, self.revision)
+            pos = positions[idx] if idx < len(positions) else -1
+        else:
+            idx = bisect.bisect_left(positions, self.revision) - 1
+            pos = positions[idx] if idx >= 0 else -1
+        if not 0 <= pos < len(self.repository.revisions):
+            raise ChangesetDoesNotExistError
+        return self.repository.get_changeset(self.repository.revisions[pos])
+
     @LazyProperty
     def added(self):
         """
@@ -612,7 +977,18 @@ class BaseChangeset(object):
         """
         Returns total number of bytes from contents of all filenodes.
         """
-        return sum((node.size for node in self.get_filenodes_generator()))
+        return self.get_dir_size('')
+
+    def get_dir_size(self, path):
+        """
+        Returns total number of bytes from contents of all files within
+        directory at the given ``path`` (and its subdirectories).
+        """
+        size = 0
+        for topnode, dirs, files in self.walk(path):
+            for f in files:
+                size += self.get_file_size(f.path)
+        return size
 
     def walk(self, topurl=''):
         """
@@ -757,10 +1133,7 @@ class BaseInMemoryChangeset(object):
 
     def __init__(self, repository):
         self.repository = repository
-        self.added = []
-        self.changed = []
-        self.removed = []
-        self.parents = []
+        self.reset()
 
     def add(self, *filenodes):
         """
@@ -773,11 +1146,12 @@ class BaseInMemoryChangeset(object):
         """
         # Check if not already marked as *added* first
         for node in filenodes:
-            if node.path in (n.path for n in self.added):
+            if node.path in self._added_paths:
                 raise NodeAlreadyAddedError("Such FileNode %s is already "
                     "marked for addition" % node.path)
         for node in filenodes:
             self.added.append(node)
+            self._added_paths.add(node.path)
 
     def change(self, *filenodes):
         """
@@ -793,7 +1167,7 @@ class BaseInMemoryChangeset(object):
         :raises ``NodeNotChangedError``: if node hasn't really be changed
         """
         for node in filenodes:
-            if node.path in (n.path for n in self.removed):
+            if node.path in self._removed_paths:
                 raise NodeAlreadyRemovedError("Node at %s is already marked "
                     "as removed" % node.path)
         try:
@@ -802,10 +1176,11 @@ class BaseInMemoryChangeset(object):
             raise EmptyRepositoryError("Nothing to change - try to *add* new "
                 "nodes rather than changing them")
         for node in filenodes:
-            if node.path in (n.path for n in self.changed):
+            if node.path in self._changed_paths:
                 raise NodeAlreadyChangedError("Node at '%s' is already "
                     "marked as changed" % node.path)
             self.changed.append(node)
+            self._changed_paths.add(node.path)
 
     def remove(self, *filenodes):
         """
@@ -818,15 +1193,16 @@ class BaseInMemoryChangeset(object):
           be *changed*
         """
         for node in filenodes:
-            if node.path in (n.path for n in self.removed):
+            if node.path in self._removed_paths:
                 raise NodeAlreadyRemovedError("Node is already marked to "
                     "for removal at %s" % node.path)
-            if node.path in (n.path for n in self.changed):
+            if node.path in self._changed_paths:
                 raise NodeAlreadyChangedError("Node is already marked to "
                     "be changed at %s" % node.path)
             # We only mark node as *removed* - real removal is done by
             # commit method
             self.removed.append(node)
+            self._removed_paths.add(node.path)
 
     def reset(self):
         """
@@ -837,6 +1213,10 @@ class BaseInMemoryChangeset(object):
         self.changed = []
         self.removed = []
         self.parents = []
+        # paths of marked nodes, so marking many nodes is not quadratic
+        self._added_paths = set()
+        self._changed_paths = set()
+        self._removed_paths = set()
 
     def get_ipaths(self):
         """
@@ -860,6 +1240,8 @@ class BaseInMemoryChangeset(object):
         :raises CommitError: if any error occurs (i.e.
           ``NodeDoesNotExistError``).
         """
+        from vcs.nodes import NodeKind
+
         if not self.parents:
             parents = parents or []
             if len(parents) == 0:
@@ -874,57 +1256,68 @@ class BaseInMemoryChangeset(object):
         # Local parents, only if not None
         parents = [p for p in self.parents if p]
 
+        # Existence of all nodes and of directories which nodes are added to
+        # is checked by single lookup at each parent
+        paths = [node.path for node in self.added + self.changed +
+                 self.removed]
+        dirpaths = set()
+        for node in self.added:
+            dirpath = posixpath.dirname(node.path)
+            while dirpath and dirpath not in dirpaths:
+                dirpaths.add(dirpath)
+                dirpath = posixpath.dirname(dirpath)
+        parents_kinds = [(p, p._get_paths_kinds(paths + list(dirpaths)))
+                         for p in parents]
+
         # Check nodes marked as added
-        for p in parents:
+        for p, kinds in parents_kinds:
             for node in self.added:
-                try:
-                    p.get_node(node.path)
-                except NodeDoesNotExistError:
-                    pass
-                else:
+                if node.path in kinds:
                     raise NodeAlreadyExistsError("Node at %s already exists "
                         "at %s" % (node.path, p))
+        # Files may only be replaced by directories if they are removed
+        added_paths = set(node.path for node in self.added)
+        removed_paths = set(node.path for node in self.removed)
+        for dirpath in dirpaths:
+            if dirpath in added_paths:
+                raise NodeAlreadyExistsError("Cannot add nodes into %s as it "
+                    "is added as a file" % dirpath)
+            if dirpath in removed_paths:
+                continue
+            for p, kinds in parents_kinds:
+                if kinds.get(dirpath, NodeKind.DIR) != NodeKind.DIR:
+                    raise NodeAlreadyExistsError("Cannot add nodes into %s "
+                        "as it is not a directory at %s" % (dirpath, p))
 
         # Check nodes marked as changed
-        missing = set(self.changed)
-        not_changed = set(self.changed)
         if self.changed and not parents:
             raise NodeDoesNotExistError(str(self.changed[0].path))
-        for p in parents:
-            for node in self.changed:
-                try:
-                    old = p.get_node(node.path)
-                    missing.remove(node)
-                    if old.content != node.content:
-                        not_changed.remove(node)
-                except NodeDoesNotExistError:
-                    pass
-        if self.changed and missing:
-            raise NodeDoesNotExistError("Node at %s is missing "
-                "(parents: %s)" % (node.path, parents))
-
-        if self.changed and not_changed:
-            raise NodeNotChangedError("Node at %s wasn't actually changed "
-                "since parents' changesets: %s" % (not_changed.pop().path,
-                    parents)
-            )
+        for node in self.changed:
+            if not any(node.path in kinds for p, kinds in parents_kinds):
+                raise NodeDoesNotExistError("Node at %s is missing "
+                    "(parents: %s)" % (node.path, parents))
+        for node in self.changed:
+            content = node.content
+            if not node.is_binary:
+                content = content.encode('utf8')
+            for p, kinds in parents_kinds:
+                kind = kinds.get(node.path)
+                if kind is not None and (kind != NodeKind.FILE or
+                        p._is_file_content_changed(node.path, content)):
+                    break
+            else:
+                raise NodeNotChangedError("Node at %s wasn't actually "
+                    "changed since parents' changesets: %s" % (node.path,
+                        parents))
 
         # Check nodes marked as removed
         if self.removed and not parents:
             raise NodeDoesNotExistError("Cannot remove node at %s as there "
                 "were no parents specified" % self.removed[0].path)
-        really_removed = set()
-        for p in parents:
-            for node in self.removed:
-                try:
-                    p.get_node(node.path)
-                    really_removed.add(node)
-                except ChangesetError:
-                    pass
-        not_removed = set(self.removed) - really_removed
-        if not_removed:
-            raise NodeDoesNotExistError("Cannot remove node at %s from "
-                "following parents: %s" % (not_removed[0], parents))
+        for node in self.removed:
+            if not any(node.path in kinds for p, kinds in parents_kinds):
+                raise NodeDoesNotExistError("Cannot remove node at %s from "
+                    "following parents: %s" % (node.path, parents))
 
     def commit(self, message, author, parents=None, branch=None, date=None,
             **kwargs):
@@ -997,6 +1390,12 @@ class EmptyChangeset(BaseChangeset):
 
 
 class CollectionGenerator(object):
+    """
+    Lazy collection of repository's changesets. Changesets are created with
+    ``get_changesets_bulk`` method of repository, at most ``chunk_size`` at
+    once.
+    """
+    chunk_size = 1000
 
     def __init__(self, repo, revs):
         self.repo = repo
@@ -1006,8 +1405,13 @@ class CollectionGenerator(object):
         return len(self.revs)
 
     def __iter__(self):
-        for rev in self.revs:
-            yield self.repo.get_changeset(rev)
+        revs = iter(self.revs)
+        while True:
+            chunk = list(itertools.islice(revs, self.chunk_size))
+            if not chunk:
+                break
+            for changeset in self.repo.get_changesets_bulk(chunk):
+                yield changeset
 
     def __getslice__(self, i, j):
         """
@@ -1018,3 +1422,182 @@ class CollectionGenerator(object):
 
     def __repr__(self):
         return 'CollectionGenerator<%s>' % (len(self))
+
+
+class RevisionList(list):
+    """
+    List of revisions' ids which also keeps position of each id, so
+    ``index`` calls and membership checks don't need to scan whole list.
+    Short ids may be resolved with ``lookup`` method.
+    """
+
+    def __init__(self, revisions=()):
+        super(RevisionList, self).__init__(revisions)
+        self._reindex()
+
+    def _reindex(self):
+        self._positions = {}
+        self._sorted = None
+        for pos, revision in enumerate(self):
+            self._positions.setdefault(revision, pos)
+
+    def lookup(self, prefix):
+        """
+        Returns full id of the only revision starting with given ``prefix``.
+
+        :raises KeyError: if there is no such revision or ``prefix`` is
+          ambiguous
+        """
+        if prefix in self._positions:
+            return prefix
+        if self._sorted is None:
+            self._sorted = sorted(self._positions)
+        pos = bisect.bisect_left(self._sorted, prefix)
+        matches = self._sorted[pos:pos + 2]
+        matches = [rev for rev in matches if rev.startswith(prefix)]
+        if not matches:
+            raise KeyError('No revision starts with %r' % (prefix,))
+        if len(matches) > 1:
+            raise KeyError('Revision prefix %r is ambiguous' % (prefix,))
+        return matches[0]
+
+    def index(self, revision, *args):
+        if args:
+            return super(RevisionList, self).index(revision, *args)
+        try:
+            return self._positions[revision]
+        except (KeyError, TypeError):
+            raise ValueError('%r is not in list' % (revision,))
+
+    def __contains__(self, revision):
+        try:
+            return revision in self._positions
+        except TypeError:
+            return False
+
+    def append(self, revision):
+        if revision not in self._positions:
+            self._positions[revision] = len(self)
+            if self._sorted is not None:
+                bisect.insort(self._sorted, revision)
+        super(RevisionList, self).append(revision)
+
+    def extend(self, revisions):
+        for revision in revisions:
+            self.append(revision)
+
+    def __iadd__(self, revisions):
+        self.extend(revisions)
+        return self
+
+    # Any other in-place modification simply rebuilds positions
+
+    def insert(self, pos, revision):
+        super(RevisionList, self).insert(pos, revision)
+        self._reindex()
+
+    def remove(self, revision):
+        super(RevisionList, self).remove(revision)
+        self._reindex()
+
+    def pop(self, *args):
+        revision = super(RevisionList, self).pop(*args)
+        self._reindex()
+        return revision
+
+    def reverse(self):
+        super(RevisionList, self).reverse()
+        self._reindex()
+
+    def sort(self, *args, **kwargs):
+        super(RevisionList, self).sort(*args, **kwargs)
+        self._reindex()
+
+    def __setitem__(self, key, value):
+        super(RevisionList, self).__setitem__(key, value)
+        self._reindex()
+
+    def __delitem__(self, key):
+        super(RevisionList, self).__delitem__(key)
+        self._reindex()
+
+    def __setslice__(self, i, j, revisions):
+        super(RevisionList, self).__setslice__(i, j, revisions)
+        self._reindex()
+
+    def __delslice__(self, i, j):
+        super(RevisionList, self).__delslice__(i, j)
+        self._reindex()
+
+
+class CommitGraph(object):
+    """
+    Parents and children of repository's revisions, identified by their
+    positions at ``revisions`` list. Revisions are added in order (with
+    ``append``), so graph may be extended whenever new commits show up.
+
+    Parents are kept in flat arrays (offsets and positions); children are
+    computed once for all revisions added so far and revisions appended
+    afterwards are tracked separately until children are recomputed.
+    """
+
+    def __init__(self):
+        self._offsets = array.array('l', [0])
+        self._parents = array.array('l')
+        self._child_offsets = None
+        self._children = None
+        self._indexed = 0
+        self._new_children = {}
+
+    def __len__(self):
+        return len(self._offsets) - 1
+
+    def append(self, parents):
+        """
+        Adds next revision with given list of ``parents`` positions.
+        """
+        self._parents.extend(parents)
+        self._offsets.append(len(self._parents))
+        if self._children is not None:
+            pos = len(self) - 1
+            for parent in parents:
+                self._new_children.setdefault(parent, []).append(pos)
+            if len(self) - self._indexed > max(1000, self._indexed / 8):
+                self._children = None
+
+    def parents(self, pos):
+        """
+        Returns list of positions of parents of revision at ``pos``.
+        """
+        start, end = self._offsets[pos], self._offsets[pos + 1]
+        return self._parents[start:end].tolist()
+
+    def children(self, pos):
+        """
+        Returns list of positions of children of revision at ``pos``.
+        """
+        if self._children is None:
+            self._index_children()
+        children = []
+        if pos < self._indexed:
+            children = self._children[self._child_offsets[pos]:
+                                      self._child_offsets[pos + 1]].tolist()
+        return children + self._new_children.get(pos, [])
+
+    def _index_children(self):
+        count = len(self)
+        offsets = array.array('l', [0] * (count + 1))
+        for parent in self._parents:
+            offsets[parent + 1] += 1
+        for pos in xrange(count):
+            offsets[pos + 1] += offsets[pos]
+        children = array.array('l', [0] * len(self._parents))
+        fill = offsets[:-1]
+        for pos in xrange(count):
+            for parent in self.parents(pos):
+                children[fill[parent]] = pos
+                fill[parent] += 1
+        self._child_offsets = offsets
+        self._children = children
+        self._indexed = count
+        self._new_children = {}
@@ -0,0 +1,82 @@
+# -*- coding: utf-8 -*-
+"""
+    vcs.backends.git.blame
+    ~~~~~~~~~~~~~~~~~~~~~~
+
+    Annotation of files of git repositories, computed without running git.
+
+    :created_on: Oct 17, 2026
+    :copyright: (c) 2010-2011 by Marcin Kuzminski, Lukasz Balcerzak.
+"""
+
+from vcs.utils.blame import Annotator
+
+from .history import TreeEntryLookup, find_last_change, split_path
+
+
+def split_lines(content):
+    """
+    Returns list of lines (without line breaks) of given ``content``, the way
+    ``git blame`` counts them.
+    """
+    lines = content.split('\n')
+    if lines[-1] == '':
+        lines.pop()
+    return lines
+
+
+class GitAnnotator(Annotator):
+    """
+    Annotates file at given ``path`` of ``repository``. Version of the file
+    is a tuple of dulwich commit which introduced it (as found by
+    ``walk_file_history``), id of its blob and list of commit's parents.
+    Annotations are cached by path, blob id and commit id.
+    """
+
+    def __init__(self, repository, path, cache):
+        super(GitAnnotator, self).__init__(cache)
+        self.repository = repository
+        self.path = path
+        self._parts = split_path(path)
+        self._lookup = TreeEntryLookup(repository)
+
+    def annotate_commit(self, commit):
+        """
+        Returns tuple of commit ids, one for each line of the file at given
+        dulwich ``commit``.
+
+        :raises ``KeyError``: if there is no file at the path
+        """
+        entry = self._lookup.get(commit.tree, self._parts)
+        if entry is None:
+            raise KeyError(self.path)
+        key = (self.path, entry[1], commit.id)
+        annotation = self.cache.get(key)
+        if annotation is None:
+            last_commit, parents = find_last_change(self.repository, commit,
+                self.path, self._lookup)
+            annotation = self.annotate((last_commit, entry[1], parents))
+            self.cache.set(key, annotation, len(annotation))
+        return annotation
+
+    def get_key(self, version):
+        commit, blob_id, parents = version
+        return (self.path, blob_id, commit.id)
+
+    def get_parents(self, version):
+        versions = []
+        for parent in version[2]:
+            if self._lookup.get(parent.tree, self._parts) is None:
+                continue
+            commit, parents = find_last_change(self.repository, parent,
+                self.path, self._lookup)
+            blob_id = self._lookup.get(commit.tree, self._parts)[1]
+            versions.append((commit, blob_id, parents))
+        return versions
+
+    def get_lines(self, version):
+        return split_lines(
+            self.repository._get_object(version[1]).as_raw_string())
+
+    def get_commit_id(self, version):
+        return version[0].id
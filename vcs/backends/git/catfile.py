@@ -0,0 +1,222 @@
+# -*- coding: utf-8 -*-
+"""
+    vcs.backends.git.catfile
+    ~~~~~~~~~~~~~~~~~~~~~~~~
+
+    Long running ``git cat-file --batch`` object reader.
+
+    :created_on: Oct 17, 2026
+    :copyright: (c) 2010-2011 by Marcin Kuzminski, Lukasz Balcerzak.
+"""
+from __future__ import with_statement
+
+import os
+import re
+import atexit
+import time
+import logging
+import threading
+import subprocess
+
+from dulwich.objects import ShaFile, object_class
+
+from vcs.conf import settings
+
+log = logging.getLogger(__name__)
+
+# only object ids are accepted; anything else (i.e. whitespace) could be
+# taken by git as more than one request
+SHA_PATTERN = re.compile(r'^[0-9a-fA-F]{4,40}\Z')
+
+_readers = {}
+_readers_lock = threading.Lock()
+
+
+class CatFileProcess(object):
+    """
+    Single ``git cat-file`` process started with given ``mode`` (either
+    ``--batch`` or ``--batch-check``). Process is started at first request
+    and stopped once it has not been used for ``idle_timeout`` seconds.
+    """
+
+    def __init__(self, path, mode, idle_timeout=None):
+        self.path = path
+        self.mode = mode
+        self.idle_timeout = idle_timeout
+        self.last_used = None
+        self._process = None
+        self._timer = None
+        self._lock = threading.RLock()
+
+    @property
+    def running(self):
+        return self._process is not None
+
+    def request(self, sha):
+        """
+        Writes ``sha`` to the process and returns tuple of (type, size, data)
+        read back (``data`` is ``None`` in ``--batch-check`` mode). Process
+        is restarted once if it cannot be communicated with or its reply
+        doesn't match the request.
+
+        :raises ``KeyError``: if ``sha`` is not an object id or there is no
+          object with given ``sha``
+        """
+        if not isinstance(sha, basestring) or not SHA_PATTERN.match(sha):
+            raise KeyError(sha)
+        sha = str(sha).lower()
+        with self._lock:
+            try:
+                return self._request(sha)
+            except (IOError, OSError, ValueError), err:
+                log.debug('Restarting git cat-file %s at %s: %s'
+                          % (self.mode, self.path, err))
+                self.stop()
+                return self._request(sha)
+
+    def _request(self, sha):
+        if self._process is None:
+            self._start()
+        self.last_used = time.time()
+        process = self._process
+        process.stdin.write(sha + '\n')
+        process.stdin.flush()
+        header = process.stdout.readline()
+        if not header.endswith('\n'):
+            raise IOError('git cat-file process has exited')
+        parts = header.split()
+        if not parts or not parts[0].startswith(sha):
+            # reply to some other request; process is out of sync
+            self.stop()
+            raise IOError('Unexpected git cat-file reply for %s: %r'
+                          % (sha, header))
+        if len(parts) != 3:
+            # "<sha> missing" or "<sha> ambiguous"
+            raise KeyError(sha)
+        type_name, size = parts[1], int(parts[2])
+        data = None
+        if self.mode == '--batch':
+            data = process.stdout.read(size + 1)
+            if len(data) != size + 1:
+                raise IOError('git cat-file process has exited')
+            data = data[:-1]
+        return type_name, size, data
+
+    def _start(self):
+        env = dict(os.environ)
+        env.pop('GIT_DIR', None)
+        cmd = [settings.GIT_EXECUTABLE_PATH, 'cat-file', self.mode]
+        try:
+            self._process = subprocess.Popen(cmd, cwd=self.path, env=env,
+                bufsize=-1, stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                close_fds=True)
+        except OSError, err:
+            raise IOError('Cannot run git cat-file: %s' % err)
+        if self.idle_timeout:
+            self._schedule_check(self.idle_timeout)
+
+    def _schedule_check(self, interval):
+        self._timer = threading.Timer(interval, self._check_idle)
+        self._timer.daemon = True
+        self._timer.start()
+
+    def _check_idle(self):
+        with self._lock:
+            if self._process is None:
+                return
+            idle = time.time() - self.last_used
+            if idle >= self.idle_timeout:
+                self.stop()
+            else:
+                self._schedule_check(self.idle_timeout - idle)
+
+    def stop(self, wait=False):
+        """
+        Stops the process (if it is running). If ``wait`` is ``True``, also
+        waits for the idle timer's thread to finish.
+        """
+        with self._lock:
+            timer, self._timer = self._timer, None
+            if timer is not None:
+                timer.cancel()
+            process, self._process = self._process, None
+            if process is not None:
+                for pipe in (process.stdin, process.stdout):
+                    try:
+                        pipe.close()
+                    except (IOError, OSError):
+                        pass
+                try:
+                    process.wait()
+                except OSError:
+                    pass
+        if wait and timer is not None and \
+                timer is not threading.current_thread():
+            timer.join()
+
+
+class GitCatFileReader(object):
+    """
+    Reads git objects using long running ``git cat-file --batch`` and
+    ``git cat-file --batch-check`` processes. Reader may be safely used by
+    many threads (requests are serialized).
+    """
+
+    def __init__(self, path, idle_timeout=None):
+        self.path = path
+        self._batch = CatFileProcess(path, '--batch', idle_timeout)
+        self._check = CatFileProcess(path, '--batch-check', idle_timeout)
+
+    def get_object(self, sha):
+        """
+        Returns dulwich object with given ``sha``.
+
+        :raises ``KeyError``: if there is no such object
+        """
+        type_name, size, data = self._batch.request(sha)
+        return ShaFile.from_raw_string(object_class(type_name).type_num, data)
+
+    def get_info(self, sha):
+        """
+        Returns tuple of (type name, size) of object with given ``sha``,
+        without reading its content.
+
+        :raises ``KeyError``: if there is no such object
+        """
+        type_name, size, data = self._check.request(sha)
+        return type_name, size
+
+    def stop(self, wait=False):
+        """
+        Stops all processes of this reader.
+        """
+        self._batch.stop(wait)
+        self._check.stop(wait)
+
+
+def get_cat_file_reader(path):
+    """
+    Returns ``GitCatFileReader`` for the repository at given ``path``.
+    Readers are shared within the process.
+    """
+    with _readers_lock:
+        reader = _readers.get(path)
+        if reader is None:
+            reader = _readers[path] = GitCatFileReader(path,
+                idle_timeout=settings.GIT_CAT_FILE_IDLE_TIMEOUT)
+        return reader
+
+
+def stop_cat_file_readers():
+    """
+    Stops processes of all readers and forgets about them.
+    """
+    with _readers_lock:
+        readers = _readers.values()
+        _readers.clear()
+    for reader in readers:
+        reader.stop(wait=True)
+
+
+# idle timers must not outlive the interpreter
+atexit.register(stop_cat_file_readers)
@@ -1,40 +1,49 @@
-import re
+import weakref
+import posixpath
+from functools import partial
 from itertools import chain
+from stat import S_ISDIR
 from dulwich import objects
-from subprocess import Popen, PIPE
 
-from vcs.conf import settings
 from vcs.backends.base import BaseChangeset, EmptyChangeset
 from vcs.exceptions import (
-    RepositoryError, ChangesetError, NodeDoesNotExistError, VCSError,
-    ChangesetDoesNotExistError, ImproperArchiveTypeError
+    RepositoryError, ChangesetError, NodeDoesNotExistError, VCSError
 )
 from vcs.nodes import (
     FileNode, DirNode, NodeKind, RootNode, RemovedFileNode, SubModuleNode,
     ChangedFileNodesGenerator, AddedFileNodesGenerator, RemovedFileNodesGenerator
 )
 from vcs.utils import (
-    safe_unicode, safe_str, safe_int, date_fromtimestamp
+    safe_unicode, safe_str, date_fromtimestamp
 )
 from vcs.utils.lazy import LazyProperty
 
+from .blame import GitAnnotator, split_lines
+from .history import find_last_changes, walk_file_history
+
 
 class GitChangeset(BaseChangeset):
     """
     Represents state of the repository at single revision.
     """
 
-    def __init__(self, repository, revision):
+    def __init__(self, repository, revision, commit=None):
+        """
+        :param commit: dulwich commit object of the ``revision``, if it has
+          been already read
+        """
         self._stat_modes = {}
         self.repository = repository
 
-        try:
-            commit = self.repository._repo[revision]
-            if isinstance(commit, objects.Tag):
-                revision = commit.object[1]
-                commit = self.repository._repo.get_object(commit.object[1])
-        except KeyError:
-            raise RepositoryError("Cannot get object with id %s" % revision)
+        if commit is None:
+            try:
+                commit = self.repository._repo[revision]
+                if isinstance(commit, objects.Tag):
+                    revision = commit.object[1]
+                    commit = self.repository._repo.get_object(revision)
+            except KeyError:
+                raise RepositoryError("Cannot get object with id %s"
+                                      % revision)
         self.raw_id = revision
         self.id = self.raw_id
         self.short_id = self.raw_id[:12]
@@ -46,7 +55,8 @@ class GitChangeset(BaseChangeset):
         self._date_tz_property = 'commit_timezone'
         self.revision = repository.revisions.index(revision)
 
-        self.nodes = {}
+        # nodes are cached only as long as they are referenced elsewhere
+        self.nodes = weakref.WeakValueDictionary()
         self._paths = {}
 
     @LazyProperty
@@ -104,61 +114,57 @@ class GitChangeset(BaseChangeset):
         return path
 
     def _get_id_for_path(self, path):
-
-        # FIXME: Please, spare a couple of minutes and make those codes cleaner;
-        if not path in self._paths:
-            path = path.strip('/')
-            # set root tree
-            tree = self.repository._repo[self._tree_id]
-            if path == '':
-                self._paths[''] = tree.id
-                return tree.id
-            splitted = path.split('/')
-            dirs, name = splitted[:-1], splitted[-1]
-            curdir = ''
-
-            # initially extract things from root dir
-            for item, stat, id in tree.iteritems():
-                if curdir:
-                    name = '/'.join((curdir, item))
-                else:
-                    name = item
-                self._paths[name] = id
-                self._stat_modes[name] = stat
-
-            for dir in dirs:
-                if curdir:
-                    curdir = '/'.join((curdir, dir))
-                else:
-                    curdir = dir
-                dir_id = None
-                for item, stat, id in tree.iteritems():
-                    if dir == item:
-                        dir_id = id
-                if dir_id:
-                    # Update tree
-                    tree = self.repository._repo[dir_id]
-                    if not isinstance(tree, objects.Tree):
-                        raise ChangesetError('%s is not a directory' % curdir)
-                else:
-                    raise ChangesetError('%s have not been found' % curdir)
-
-                # cache all items from the given traversed tree
-                for item, stat, id in tree.iteritems():
-                    if curdir:
-                        name = '/'.join((curdir, item))
-                    else:
-                        name = item
-                    self._paths[name] = id
-                    self._stat_modes[name] = stat
-            if not path in self._paths:
-                raise NodeDoesNotExistError("There is no file nor directory "
-                    "at the given path '%s' at revision %s"
-                    % (path, self.short_id))
-        return self._paths[path]
+        """
+        Returns id of the object at the given ``path``. Path is resolved by
+        a single lookup within each tree leading to it; trees are read through
+        repository's object cache, so they are shared by all changesets.
+
+        :raises ``ChangesetError``: if one of parent directories is missing
+        :raises ``NodeDoesNotExistError``: if there is nothing at ``path``
+        """
+        path = path.strip('/')
+        if path in self._paths:
+            return self._paths[path]
+        if path == '':
+            self._paths[''] = self._tree_id
+            return self._tree_id
+
+        splitted = path.split('/')
+        dirs, name = splitted[:-1], splitted[-1]
+        tree_id = self._tree_id
+        curdir = ''
+        for dir in dirs:
+            curdir = curdir and '/'.join((curdir, dir)) or dir
+            entry = self._get_path_entry(curdir, tree_id, dir)
+            if entry is None:
+                raise ChangesetError('%s have not been found' % curdir)
+            if not S_ISDIR(entry[0]):
+                raise ChangesetError('%s is not a directory' % curdir)
+            tree_id = entry[1]
+
+        entry = self._get_path_entry(path, tree_id, name)
+        if entry is None:
+            raise NodeDoesNotExistError("There is no file nor directory "
+                "at the given path '%s' at revision %s"
+                % (path, self.short_id))
+        return entry[1]
+
+    def _get_path_entry(self, path, tree_id, name):
+        """
+        Returns (mode, id) tuple of the entry ``name`` at the given ``path``
+        within tree ``tree_id``, or ``None`` if there is no such entry.
+        """
+        if path not in self._paths:
+            try:
+                mode, id = self.repository._get_object(tree_id)[name]
+            except KeyError:
+                return None
+            self._paths[path] = id
+            self._stat_modes[path] = mode
+        return self._stat_modes[path], self._paths[path]
 
     def _get_kind(self, path):
-        obj = self.repository._repo[self._get_id_for_path(path)]
+        obj = self.repository._get_object(self._get_id_for_path(path))
         if isinstance(obj, objects.Blob):
             return NodeKind.FILE
         elif isinstance(obj, objects.Tree):
@@ -187,16 +193,10 @@ class GitChangeset(BaseChangeset):
         """
         Returns list of children changesets.
         """
-        rev_filter = _git_path = settings.GIT_REV_FILTER
-        so, se = self.repository.run_git_command(
-            "rev-list %s --children | grep '^%s'" % (rev_filter, self.raw_id)
-        )
-
-        children = []
-        for l in so.splitlines():
-            childs = l.split(' ')[1:]
-            children.extend(childs)
-        return [self.repository.get_changeset(cs) for cs in children]
+        graph = self.repository._get_commit_graph()
+        revisions = self.repository.revisions
+        return self.repository.get_changesets_bulk([revisions[pos]
+            for pos in graph.children(self.revision)])
 
     def next(self, branch=None):
 
@@ -204,43 +204,28 @@ class GitChangeset(BaseChangeset):
             raise VCSError('Branch option used on changeset not belonging '
                            'to that branch')
 
-        def _next(changeset, branch):
-            try:
-                next_ = changeset.revision + 1
-                next_rev = changeset.repository.revisions[next_]
-            except IndexError:
-                raise ChangesetDoesNotExistError
-            cs = changeset.repository.get_changeset(next_rev)
-
-            if branch and branch != cs.branch:
-                return _next(cs, branch)
-
-            return cs
-
-        return _next(self, branch)
+        return self._get_adjacent_changeset(1, self._get_branch_positions(
+            branch))
 
     def prev(self, branch=None):
         if branch and self.branch != branch:
             raise VCSError('Branch option used on changeset not belonging '
                            'to that branch')
 
-        def _prev(changeset, branch):
-            try:
-                prev_ = changeset.revision - 1
-                if prev_ < 0:
-                    raise IndexError
-                prev_rev = changeset.repository.revisions[prev_]
-            except IndexError:
-                raise ChangesetDoesNotExistError
-
-            cs = changeset.repository.get_changeset(prev_rev)
-
-            if branch and branch != cs.branch:
-                return _prev(cs, branch)
-
-            return cs
+        return self._get_adjacent_changeset(-1, self._get_branch_positions(
+            branch))
 
-        return _prev(self, branch)
+    def _get_branch_positions(self, branch):
+        """
+        Returns sorted positions of changesets of given ``branch`` (that is,
+        those pointed by branch's head) or ``None`` if no branch is given.
+        """
+        if not branch:
+            return None
+        revisions = self.repository.revisions
+        heads = self.repository._heads(reverse=False)
+        return sorted(revisions.index(sha) for sha, name in heads.iteritems()
+                      if safe_unicode(name) == branch and sha in revisions)
 
     def diff(self, ignore_whitespace=True, context=3):
         rev1 = self.parents[0] if self.parents else self.repository.EMPTY_CHANGESET
@@ -262,7 +247,7 @@ class GitChangeset(BaseChangeset):
         Returns content of the file at given ``path``.
         """
         id = self._get_id_for_path(path)
-        blob = self.repository._repo[id]
+        blob = self.repository._get_object(id)
         return blob.as_pretty_string()
 
     def get_file_size(self, path):
@@ -270,129 +255,143 @@ class GitChangeset(BaseChangeset):
         Returns size of the file at given ``path``.
         """
         id = self._get_id_for_path(path)
-        blob = self.repository._repo[id]
-        return blob.raw_length()
+        return self.repository._tree_sizes.get_blob_size(id)
 
-    def get_file_changeset(self, path):
+    def _get_paths_kinds(self, paths):
         """
-        Returns last commit of the file at the given ``path``.
+        Returns dict mapping those of given ``paths`` which exist at this
+        changeset to kinds of their nodes. Paths are grouped by directory,
+        so each tree is looked up once.
         """
-        return self.get_file_history(path, limit=1)[0]
+        names_by_dir = {}
+        for path in paths:
+            dirpath, name = posixpath.split(safe_str(path).strip('/'))
+            names_by_dir.setdefault(dirpath, []).append((name, path))
 
-    def get_file_history(self, path, limit=None):
+        kinds = {}
+        for dirpath, names in names_by_dir.iteritems():
+            try:
+                tree_id = self._get_id_for_path(dirpath)
+            except (ChangesetError, NodeDoesNotExistError):
+                continue
+            if dirpath and not S_ISDIR(self._stat_modes[dirpath]):
+                continue
+            for name, path in names:
+                entry = self._get_path_entry(posixpath.join(dirpath, name),
+                                             tree_id, name)
+                if entry is None:
+                    continue
+                if S_ISDIR(entry[0]):
+                    kinds[path] = NodeKind.DIR
+                elif objects.S_ISGITLINK(entry[0]):
+                    kinds[path] = NodeKind.SUBMODULE
+                else:
+                    kinds[path] = NodeKind.FILE
+        return kinds
+
+    def _is_file_content_changed(self, path, content):
         """
-        Returns history of file as reversed list of ``Changeset`` objects for
-        which file at given ``path`` has been modified.
+        Returns ``True`` if given ``content`` differs from content of the
+        file at the given ``path``. Only blob ids are compared.
+        """
+        blob_id = objects.Blob.from_string(content).id
+        return blob_id != self._get_id_for_path(safe_str(path))
 
-        TODO: This function now uses os underlying 'git' and 'grep' commands
-        which is generally not good. Should be replaced with algorithm
-        iterating commits.
+    def get_dir_size(self, path):
         """
-        self._get_filectx(path)
-        cs_id = safe_str(self.id)
-        f_path = safe_str(path)
+        Returns total size of all files within directory at given ``path``.
+        """
+        path = path.strip('/')
+        if path:
+            id = self._get_id_for_path(path)
+            if not S_ISDIR(self._stat_modes[path]):
+                raise ChangesetError("Directory does not exist for revision %s"
+                    " at '%s'" % (self.raw_id, path))
+        else:
+            id = self._commit.tree
+        return self.repository._tree_sizes.get_tree_size(id)
 
-        if limit:
-            cmd = 'log -n %s --pretty="format: %%H" -s -p %s -- "%s"' % (
-                      safe_int(limit, 0), cs_id, f_path
-                   )
+    @LazyProperty
+    def size(self):
+        """
+        Returns total number of bytes from contents of all files.
+        """
+        return self.get_dir_size('')
 
-        else:
-            cmd = 'log --pretty="format: %%H" -s -p %s -- "%s"' % (
-                      cs_id, f_path
-                   )
-        so, se = self.repository.run_git_command(cmd)
-        ids = re.findall(r'[0-9a-fA-F]{40}', so)
-        return [self.repository.get_changeset(id) for id in ids]
+    def get_file_changeset(self, path):
+        """
+        Returns last commit of the file at the given ``path``.
+        """
+        return self.get_file_history(path, limit=1)[0]
 
-    def get_file_history_2(self, path):
+    def get_file_history(self, path, limit=None):
         """
         Returns history of file as reversed list of ``Changeset`` objects for
         which file at given ``path`` has been modified.
+        """
+        return list(self.iter_file_history(path, limit))
 
+    def iter_file_history(self, path, limit=None):
+        """
+        Yields ``Changeset`` objects for which file at given ``path`` has been
+        modified, starting from the most recent one. Commits are walked
+        lazily, so history of recently changed file is retrieved without
+        reading whole repository. Retrieved histories are cached by the
+        repository.
         """
         self._get_filectx(path)
-        from dulwich.walk import Walker
-        include = [self.id]
-        walker = Walker(self.repository._repo.object_store, include,
-                        paths=[path], max_entries=1)
-        return [self.repository.get_changeset(sha)
-                for sha in (x.commit.id for x in walker)]
+        f_path = safe_str(path)
+        return self._iter_cached_file_history((f_path, self.raw_id), limit,
+            self._walk_file_history(f_path))
+
+    def _walk_file_history(self, path):
+        for commit in walk_file_history(self.repository, self._commit, path):
+            yield self.repository._get_changeset_for_commit(commit)
 
     def get_file_annotate(self, path):
         """
         Returns a generator of four element tuples with
             lineno, sha, changeset lazy loader and line
 
-        TODO: This function now uses os underlying 'git' command which is
-        generally not good. Should be replaced with algorithm iterating
-        commits.
-        """
-        cmd = 'blame -l --root -r %s -- "%s"' % (self.id, path)
-        # -l     ==> outputs long shas (and we need all 40 characters)
-        # --root ==> doesn't put '^' character for bounderies
-        # -r sha ==> blames for the given revision
-        so, se = self.repository.run_git_command(cmd)
-
-        for i, blame_line in enumerate(so.split('\n')[:-1]):
-            ln_no = i + 1
-            sha, line = re.split(r' ', blame_line, 1)
-            yield (ln_no, sha, lambda: self.repository.get_changeset(sha), line)
-
-    def fill_archive(self, stream=None, kind='tgz', prefix=None,
-                     subrepos=False):
-        """
-        Fills up given stream.
-
-        :param stream: file like object.
-        :param kind: one of following: ``zip``, ``tgz`` or ``tbz2``.
-            Default: ``tgz``.
-        :param prefix: name of root directory in archive.
-            Default is repository name and changeset's raw_id joined with dash
-            (``repo-tip.<KIND>``).
-        :param subrepos: include subrepos in this archive.
-
-        :raise ImproperArchiveTypeError: If given kind is wrong.
-        :raise VcsError: If given stream is None
-
-        """
-        allowed_kinds = settings.ARCHIVE_SPECS.keys()
-        if kind not in allowed_kinds:
-            raise ImproperArchiveTypeError('Archive kind not supported use one'
-                'of %s', allowed_kinds)
-
-        if prefix is None:
-            prefix = '%s-%s' % (self.repository.name, self.short_id)
-        elif prefix.startswith('/'):
-            raise VCSError("Prefix cannot start with leading slash")
-        elif prefix.strip() == '':
-            raise VCSError("Prefix cannot be empty")
-
-        if kind == 'zip':
-            frmt = 'zip'
-        else:
-            frmt = 'tar'
-        _git_path = settings.GIT_EXECUTABLE_PATH
-        cmd = '%s archive --format=%s --prefix=%s/ %s' % (_git_path,
-                                                frmt, prefix, self.raw_id)
-        if kind == 'tgz':
-            cmd += ' | gzip -9'
-        elif kind == 'tbz2':
-            cmd += ' | bzip2 -9'
-
-        if stream is None:
-            raise VCSError('You need to pass in a valid stream for filling'
-                           ' with archival data')
-        popen = Popen(cmd, stdout=PIPE, stderr=PIPE, shell=True,
-            cwd=self.repository.path)
-
-        buffer_size = 1024 * 8
-        chunk = popen.stdout.read(buffer_size)
-        while chunk:
-            stream.write(chunk)
-            chunk = popen.stdout.read(buffer_size)
-        # Make sure all descriptors would be read
-        popen.communicate()
+        Annotation is computed from cached annotations of previous versions
+        of the file (see ``GitAnnotator``), so only versions changed since
+        are compared.
+        """
+        path = self._get_filectx(path)
+        annotator = GitAnnotator(self.repository, path,
+                                 self.repository._annotate_cache)
+        annotation = annotator.annotate_commit(self._commit)
+        lines = split_lines(self.repository._get_object(
+            self._get_id_for_path(path)).as_raw_string())
+        for i, sha in enumerate(annotation):
+            yield (i + 1, sha, partial(self.repository.get_changeset, sha),
+                   lines[i])
+
+    def _get_archive_mtime(self):
+        return self._commit.commit_time
+
+    def _iter_archive_entries(self, subrepos=False):
+        """
+        Yields tuples (path, mode, content) of all files (and submodules,
+        with empty content) of this changeset, reading tree and blob objects
+        directly.
+        """
+        stack = [('', self._commit.tree)]
+        while stack:
+            dir_path, tree_id = stack.pop()
+            subtrees = []
+            for name, mode, sha in self.repository._get_object(tree_id)\
+                    .iteritems():
+                path = dir_path and '/'.join((dir_path, name)) or name
+                if S_ISDIR(mode):
+                    subtrees.append((path, sha))
+                elif objects.S_ISGITLINK(mode):
+                    yield path, mode, ''
+                else:
+                    yield path, mode, \
+                        self.repository._get_object(sha).as_raw_string()
+            # subdirectories follow files of their parent, in tree order
+            stack.extend(reversed(subtrees))
 
     def get_nodes(self, path):
         if self._get_kind(path) != NodeKind.DIR:
@@ -400,7 +399,7 @@ class GitChangeset(BaseChangeset):
                 " '%s'" % (self.revision, path))
         path = self._fix_path(path)
         id = self._get_id_for_path(path)
-        tree = self.repository._repo[id]
+        tree = self.repository._get_object(id)
         dirnodes = []
         filenodes = []
         als = self.repository.alias
@@ -410,7 +409,7 @@ class GitChangeset(BaseChangeset):
                                               alias=als))
                 continue
 
-            obj = self.repository._repo.get_object(id)
+            obj = self.repository._get_object(id)
             if path != '':
                 obj_path = '/'.join((path, name))
             else:
@@ -431,11 +430,17 @@ class GitChangeset(BaseChangeset):
         nodes.sort()
         return nodes
 
+    def _find_last_changes(self, path, names):
+        changes = find_last_changes(self.repository, self._commit, path,
+                                    names)
+        return dict((name, commit.id) for name, commit in changes.iteritems())
+
     def get_node(self, path):
         if isinstance(path, unicode):
             path = path.encode('utf-8')
         path = self._fix_path(path)
-        if not path in self.nodes:
+        node = self.nodes.get(path)
+        if node is None:
             try:
                 id_ = self._get_id_for_path(path)
             except ChangesetError:
@@ -447,24 +452,22 @@ class GitChangeset(BaseChangeset):
                 node = SubModuleNode(path, url=None, changeset=id_,
                                      alias=self.repository.alias)
             else:
-                obj = self.repository._repo.get_object(id_)
+                obj = self.repository._get_object(id_)
 
                 if isinstance(obj, objects.Tree):
                     if path == '':
                         node = RootNode(changeset=self)
                     else:
                         node = DirNode(path, changeset=self)
-                    node._tree = obj
                 elif isinstance(obj, objects.Blob):
                     node = FileNode(path, changeset=self)
-                    node._blob = obj
                 else:
                     raise NodeDoesNotExistError("There is no file nor directory "
                         "at the given path '%s' at revision %s"
                         % (path, self.short_id))
             # cache node
             self.nodes[path] = node
-        return self.nodes[path]
+        return node
 
     @LazyProperty
     def affected_files(self):
@@ -0,0 +1,192 @@
+# -*- coding: utf-8 -*-
+"""
+    vcs.backends.git.history
+    ~~~~~~~~~~~~~~~~~~~~~~~~
+
+    File history of git repositories, computed without running git.
+
+    :created_on: Oct 17, 2026
+    :copyright: (c) 2010-2011 by Marcin Kuzminski, Lukasz Balcerzak.
+"""
+
+import heapq
+import stat
+import itertools
+
+
+class TreeEntryLookup(object):
+    """
+    Finds entries (tuples of mode and id) of paths within trees. Lookups are
+    remembered per tree, so trees shared by many commits are read once.
+    """
+
+    def __init__(self, repository):
+        self.repository = repository
+        self._entries = {}
+
+    def get(self, tree_id, parts):
+        """
+        Returns entry of the path given as tuple of its ``parts`` within tree
+        with given ``tree_id``, or ``None`` if there is no such path. Empty
+        ``parts`` stand for the tree itself.
+        """
+        if not parts:
+            return (stat.S_IFDIR, tree_id)
+        key = (tree_id, parts)
+        if key not in self._entries:
+            entry = None
+            try:
+                mode, sha = self.repository._get_object(tree_id)[parts[0]]
+            except KeyError:
+                pass
+            else:
+                if len(parts) == 1:
+                    entry = (mode, sha)
+                elif stat.S_ISDIR(mode):
+                    entry = self.get(sha, parts[1:])
+            self._entries[key] = entry
+        return self._entries[key]
+
+
+def split_path(path):
+    """
+    Returns tuple of parts of given ``path`` (empty for root).
+    """
+    path = path.strip('/')
+    return tuple(path.split('/')) if path else ()
+
+
+def _walk(repository, commit, parts, lookup):
+    """
+    Yields tuples of (commit, parents) for commits which have modified the
+    path given by its ``parts``; see ``walk_file_history``.
+    """
+    _repo = repository._repo
+    counter = itertools.count()
+    queue = [(-commit.commit_time, counter.next(), commit)]
+    seen = set([commit.id])
+    while queue:
+        commit = heapq.heappop(queue)[2]
+        entry = lookup.get(commit.tree, parts)
+        parents = []
+        for parent_id in commit.parents:
+            try:
+                parents.append(_repo[parent_id])
+            except KeyError:
+                # i.e. shallow clone
+                pass
+        if not parents:
+            if entry is not None:
+                yield commit, parents
+            continue
+
+        for parent in parents:
+            if lookup.get(parent.tree, parts) == entry:
+                followed = [parent]
+                break
+        else:
+            followed = parents
+            yield commit, parents
+
+        for parent in followed:
+            if parent.id not in seen:
+                seen.add(parent.id)
+                heapq.heappush(queue,
+                    (-parent.commit_time, counter.next(), parent))
+
+
+def walk_file_history(repository, commit, path):
+    """
+    Yields dulwich commits reachable from ``commit`` which have modified
+    file at the given ``path``, most recent first.
+
+    Walk follows same rules as ``git log -- path``: commits are visited in
+    commit date order and commit is reported if path's entry (id and mode)
+    differs from the one in each of its parents. If entry is same as in one
+    of the parents, only that parent is followed (so merges which didn't
+    touch the file are skipped together with the side branch).
+
+    Entries are looked up through the trees leading to ``path`` and lookups
+    are remembered per tree, so commits sharing directories are cheap.
+    """
+    lookup = TreeEntryLookup(repository)
+    for commit, parents in _walk(repository, commit, split_path(path),
+                                 lookup):
+        yield commit
+
+
+def find_last_change(repository, commit, path, lookup=None):
+    """
+    Returns tuple of the most recent commit reachable from ``commit`` which
+    has modified file at the given ``path`` (walked as in
+    ``walk_file_history``) and list of its parents, or ``None`` if there is
+    no such commit.
+
+    :param lookup: ``TreeEntryLookup`` to reuse
+    """
+    if lookup is None:
+        lookup = TreeEntryLookup(repository)
+    for commit, parents in _walk(repository, commit, split_path(path),
+                                 lookup):
+        return commit, parents
+    return None
+
+
+def find_last_changes(repository, commit, path, names):
+    """
+    Returns dict mapping given ``names`` of entries of the directory at
+    ``path`` to the most recent commits (reachable from ``commit``) which
+    have modified them.
+
+    All entries are resolved within single walk of commits in commit date
+    order, which stops as soon as every entry is resolved. Each entry is
+    followed as in ``walk_file_history``: commit has modified the entry if
+    it differs from the entry in each of commit's parents; otherwise only
+    the first parent with the same entry is followed for that entry.
+    """
+    _repo = repository._repo
+    lookup = TreeEntryLookup(repository)
+    parts = split_path(path)
+    changes = {}
+    unresolved = set(names)
+    # names of entries which are still followed through given commits
+    pending = {commit.id: set(names)}
+    counter = itertools.count()
+    queue = [(-commit.commit_time, counter.next(), commit)]
+    while queue and unresolved:
+        commit = heapq.heappop(queue)[2]
+        followed = pending.pop(commit.id) & unresolved
+        parents = []
+        for parent_id in commit.parents:
+            try:
+                parents.append(_repo[parent_id])
+            except KeyError:
+                # i.e. shallow clone
+                pass
+
+        passed = {}
+        if parents and lookup.get(commit.tree, parts) == \
+                lookup.get(parents[0].tree, parts):
+            # whole directory is same as in the first parent
+            passed[parents[0]] = followed
+        else:
+            for name in followed:
+                entry_parts = parts + (name,)
+                entry = lookup.get(commit.tree, entry_parts)
+                for parent in parents:
+                    if lookup.get(parent.tree, entry_parts) == entry:
+                        passed.setdefault(parent, set()).add(name)
+                        break
+                else:
+                    if entry is not None:
+                        changes[name] = commit
+                        unresolved.discard(name)
+
+        for parent, parent_names in passed.iteritems():
+            if parent.id in pending:
+                pending[parent.id].update(parent_names)
+            else:
+                pending[parent.id] = set(parent_names)
+                heapq.heappush(queue,
+                    (-parent.commit_time, counter.next(), parent))
+    return changes
@@ -1,9 +1,11 @@
+import stat
 import time
 import datetime
 import posixpath
 from dulwich import objects
 from dulwich.repo import Repo
 from vcs.backends.base import BaseInMemoryChangeset
+from vcs.conf import settings
 from vcs.exceptions import RepositoryError
 from vcs.utils import safe_str
 
@@ -38,91 +40,78 @@ class GitInMemoryChangeset(BaseInMemoryChangeset):
         object_store = repo.object_store
 
         ENCODING = "UTF-8"
-        DIRMOD = 040000
 
-        # Create tree and populates it with blobs
-        commit_tree = self.parents[0] and repo[self.parents[0]._commit.tree] or\
-            objects.Tree()
+        # Group changes by directory: each entry maps names within the
+        # directory to new (mode, id) pairs or to ``None`` for removed ones
+        changes = {}
+        new_objects = []
         for node in self.added + self.changed:
-            # Compute subdirs if needed
-            dirpath, nodename = posixpath.split(node.path)
-            dirnames = dirpath and dirpath.split('/') or []
-            parent = commit_tree
-            ancestors = [('', parent)]
-
-            # Tries to dig for the deepest existing tree
-            while dirnames:
-                curdir = dirnames.pop(0)
-                try:
-                    dir_id = parent[curdir][1]
-                except KeyError:
-                    # put curdir back into dirnames and stops
-                    dirnames.insert(0, curdir)
-                    break
-                else:
-                    # If found, updates parent
-                    parent = self.repository._repo[dir_id]
-                    ancestors.append((curdir, parent))
-            # Now parent is deepest existing tree and we need to create subtrees
-            # for dirnames (in reverse order) [this only applies for nodes from added]
-            new_trees = []
-
             if not node.is_binary:
                 content = node.content.encode(ENCODING)
             else:
                 content = node.content
             blob = objects.Blob.from_string(content)
-
-            node_path = node.name.encode(ENCODING)
-            if dirnames:
-                # If there are trees which should be created we need to build
-                # them now (in reverse order)
-                reversed_dirnames = list(reversed(dirnames))
-                curtree = objects.Tree()
-                curtree[node_path] = node.mode, blob.id
-                new_trees.append(curtree)
-                for dirname in reversed_dirnames[:-1]:
-                    newtree = objects.Tree()
-                    #newtree.add(DIRMOD, dirname, curtree.id)
-                    newtree[dirname] = DIRMOD, curtree.id
-                    new_trees.append(newtree)
-                    curtree = newtree
-                parent[reversed_dirnames[-1]] = DIRMOD, curtree.id
-            else:
-                parent.add(name=node_path, mode=node.mode, hexsha=blob.id)
-
-            new_trees.append(parent)
-            # Update ancestors
-            for parent, tree, path in reversed([(a[1], b[1], b[0]) for a, b in
-                zip(ancestors, ancestors[1:])]):
-                parent[path] = DIRMOD, tree.id
-                object_store.add_object(tree)
-
-            object_store.add_object(blob)
-            for tree in new_trees:
-                object_store.add_object(tree)
+            new_objects.append(blob)
+            dirpath, name = posixpath.split(safe_str(node.path))
+            changes.setdefault(dirpath, {})[name] = node.mode, blob.id
         for node in self.removed:
-            paths = node.path.split('/')
-            tree = commit_tree
-            trees = [tree]
-            # Traverse deep into the forest...
-            for path in paths:
-                try:
-                    obj = self.repository._repo[tree[path][1]]
-                    if isinstance(obj, objects.Tree):
-                        trees.append(obj)
-                        tree = obj
-                except KeyError:
-                    break
-            # Cut down the blob and all rotten trees on the way back...
-            for path, tree in reversed(zip(paths, trees)):
-                del tree[path]
-                if tree:
-                    # This tree still has elements - don't remove it or any
-                    # of it's parents
-                    break
-
-        object_store.add_object(commit_tree)
+            dirpath, name = posixpath.split(safe_str(node.path))
+            changes.setdefault(dirpath, {})[name] = None
+        # ancestors of changed directories have to be rebuilt too
+        changes.setdefault('', {})
+        for dirpath in changes.keys():
+            while dirpath:
+                dirpath = posixpath.dirname(dirpath)
+                changes.setdefault(dirpath, {})
+
+        root_id = self.parents[0] and self.parents[0]._commit.tree
+        old_tree_ids = {'': root_id}
+
+        def get_old_tree(dirpath):
+            """
+            Returns tree at ``dirpath`` within the first parent's tree (or
+            ``None`` if there is no such tree).
+            """
+            if dirpath not in old_tree_ids:
+                parent = get_old_tree(posixpath.dirname(dirpath))
+                name = posixpath.basename(dirpath)
+                tree_id = None
+                if parent is not None and name in parent:
+                    mode, id = parent[name]
+                    if stat.S_ISDIR(mode):
+                        tree_id = id
+                old_tree_ids[dirpath] = tree_id
+            tree_id = old_tree_ids[dirpath]
+            return tree_id and self.repository._get_object(tree_id)
+
+        # Build each modified tree once, deepest directories first, so trees
+        # of subdirectories are complete when their parent is built
+        depth = lambda dirpath: dirpath and dirpath.count('/') + 1 or 0
+        for dirpath in sorted(changes, key=depth, reverse=True):
+            tree = objects.Tree()
+            old_tree = get_old_tree(dirpath)
+            if old_tree is not None:
+                for name, mode, id in old_tree.iteritems():
+                    tree[name] = mode, id
+            for name, entry in changes[dirpath].iteritems():
+                if entry is not None:
+                    tree[name] = entry
+                elif name in tree:
+                    del tree[name]
+            if not dirpath:
+                commit_tree = tree
+                break
+            parent_changes = changes[posixpath.dirname(dirpath)]
+            name = posixpath.basename(dirpath)
+            if len(tree):
+                parent_changes[name] = stat.S_IFDIR, tree.id
+                new_objects.append(tree)
+            else:
+                # don't keep directories left empty
+                parent_changes[name] = None
+
+        new_objects.append(commit_tree)
+        self._add_objects(object_store, new_objects)
 
         # Create commit
         commit = objects.Commit()
@@ -153,12 +142,26 @@ class GitInMemoryChangeset(BaseInMemoryChangeset):
 
         # Update vcs repository object & recreate dulwich repo
         self.repository.revisions.append(commit.id)
+        if settings.GIT_REVISION_INDEX:
+            self.repository._revision_index.refresh()
         # invalidate parsed refs after commit
         self.repository._parsed_refs = self.repository._get_parsed_refs()
         tip = self.repository.get_changeset()
         self.reset()
         return tip
 
+    def _add_objects(self, object_store, new_objects):
+        """
+        Writes given objects to the ``object_store``: as loose objects if
+        there are at most ``GIT_COMMIT_PACK_LIMIT`` of them, otherwise
+        within single pack.
+        """
+        if len(new_objects) <= settings.GIT_COMMIT_PACK_LIMIT:
+            for obj in new_objects:
+                object_store.add_object(obj)
+        else:
+            object_store.add_objects([(obj, None) for obj in new_objects])
+
     def _get_missing_trees(self, path, root_tree):
         """
         Creates missing ``Tree`` objects for the given path.
@@ -0,0 +1,137 @@
+# -*- coding: utf-8 -*-
+"""
+    vcs.backends.git.repopool
+    ~~~~~~~~~~~~~~~~~~~~~~~~~
+
+    Cached dulwich repository handles.
+
+    :created_on: Oct 17, 2026
+    :copyright: (c) 2010-2011 by Marcin Kuzminski, Lukasz Balcerzak.
+"""
+from __future__ import with_statement
+
+import os
+import weakref
+import threading
+
+from dulwich.repo import Repo
+
+from vcs.conf import settings
+from vcs.utils.ordered_dict import OrderedDict
+
+_pool = OrderedDict()
+_pool_lock = threading.Lock()
+
+# files which dulwich caches in memory; if any of them is replaced or
+# modified, handle needs to be reopened
+WATCHED_PATHS = (
+    'packed-refs',
+    os.path.join('objects', 'pack'),
+    os.path.join('objects', 'info', 'alternates'),
+)
+
+
+class RepoHandle(object):
+    """
+    Keeps dulwich ``Repo`` object opened for given path so pack indexes and
+    packed refs are not re-read on each access. Opened object is discarded
+    whenever ``packed-refs`` file or pack directory changes on disk (their
+    inode, size and modification time are compared).
+
+    Dulwich objects are not thread-safe, so each thread gets its own ``Repo``.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        # repositories opened by all threads, so they may be closed at once
+        self._opened = weakref.WeakKeyDictionary()
+        self._lock = threading.Lock()
+
+    def invalidate(self):
+        """
+        Forces ``Repo`` to be reopened at next ``get`` call (within current
+        thread).
+        """
+        self._local.repo = None
+        self._local.signature = None
+
+    def get(self):
+        """
+        Returns dulwich ``Repo`` object, reopening it if it has changed on
+        disk.
+
+        :raises ``NotGitRepository``: if there is no repository at ``path``
+        """
+        repo = getattr(self._local, 'repo', None)
+        if repo is not None:
+            signature = self._get_signature(repo)
+            if signature == self._local.signature:
+                return repo
+            self._close_repo(repo)
+        repo = Repo(self.path)
+        with self._lock:
+            self._opened[repo] = True
+        self._local.repo = repo
+        self._local.signature = self._get_signature(repo)
+        return repo
+
+    def close(self):
+        """
+        Closes pack files of repositories opened by all threads. Closed
+        repositories are still usable, they reopen packs when needed.
+        """
+        with self._lock:
+            repos = self._opened.keys()
+        for repo in repos:
+            self._close_repo(repo)
+
+    def _close_repo(self, repo):
+        with self._lock:
+            self._opened.pop(repo, None)
+        repo.object_store.close()
+
+    def _get_signature(self, repo):
+        controldir = repo.controldir()
+        signature = []
+        for path in WATCHED_PATHS:
+            try:
+                st = os.stat(os.path.join(controldir, path))
+            except OSError:
+                signature.append(None)
+            else:
+                signature.append((st.st_ino, st.st_size, st.st_mtime))
+        return signature
+
+
+def get_repo_handle(path):
+    """
+    Returns ``RepoHandle`` for given ``path``. If ``GIT_REPO_POOL`` setting
+    is turned on, handles are shared by all repository objects created for
+    the same path within the process. At most ``GIT_REPO_POOL_SIZE`` least
+    recently used handles are kept; evicted ones are closed.
+    """
+    if not settings.GIT_REPO_POOL:
+        return RepoHandle(path)
+    evicted = []
+    with _pool_lock:
+        handle = _pool.pop(path, None)
+        if handle is None:
+            handle = RepoHandle(path)
+        _pool[path] = handle
+        while len(_pool) > max(settings.GIT_REPO_POOL_SIZE, 1):
+            evicted.append(_pool.popitem(last=False)[1])
+    for old_handle in evicted:
+        old_handle.close()
+    return handle
+
+
+def clear_repo_pool():
+    """
+    Closes and removes all handles from the shared pool.
+    """
+    with _pool_lock:
+        handles = _pool.values()
+        _pool.clear()
+    for handle in handles:
+        handle.close()
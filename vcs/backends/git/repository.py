@@ -18,11 +18,14 @@ import logging
 import posixpath
 import string
 
-from dulwich.objects import Tag
+from dulwich.objects import Blob, Tag, Tree
 from dulwich.repo import Repo, NotGitRepository
 
 from vcs import subprocessio
-from vcs.backends.base import BaseRepository, CollectionGenerator
+from vcs.backends.base import (
+    BaseRepository, CollectionGenerator, CommitGraph, CommitInfo,
+    RevisionList
+)
 from vcs.conf import settings
 
 from vcs.exceptions import (
@@ -31,6 +34,7 @@ from vcs.exceptions import (
 )
 from vcs.utils import safe_unicode, makedate, date_fromtimestamp
 from vcs.utils.lazy import LazyProperty
+from vcs.utils.lrucache import LRUCache
 from vcs.utils.ordered_dict import OrderedDict
 from vcs.utils.paths import abspath, get_user_home
 
@@ -38,11 +42,17 @@ from vcs.utils.hgcompat import (
     hg_url, httpbasicauthhandler, httpdigestauthhandler
 )
 
+from .catfile import get_cat_file_reader
+from .sizes import TreeSizes
 from .changeset import GitChangeset
 from .config import ConfigFile
 from .inmemory import GitInMemoryChangeset
+from .repopool import get_repo_handle
+from .revindex import GitRevisionIndex
 from .workdir import GitWorkdir
 
+log = logging.getLogger(__name__)
+
 SHA_PATTERN = re.compile(r'^[[0-9a-fA-F]{12}|[0-9a-fA-F]{40}]$')
 
 
@@ -70,7 +80,95 @@ class GitRepository(BaseRepository):
 
     @property
     def _repo(self):
-        return Repo(self.path)
+        return self._repo_handle.get()
+
+    @LazyProperty
+    def _commit_graph(self):
+        return CommitGraph()
+
+    def _get_commit_graph(self):
+        """
+        Returns ``CommitGraph`` of this repository, extended with revisions
+        which are not there yet. Parents of many new revisions are taken
+        from single ``git rev-list --parents`` call; for just a few of them
+        commits are read directly.
+        """
+        graph = self._commit_graph
+        revisions = self.revisions
+        missing = revisions[len(graph):]
+        if not missing:
+            return graph
+        parents = {}
+        if len(missing) > 100:
+            so, se = self.run_git_command('rev-list --parents %s'
+                                          % settings.GIT_REV_FILTER)
+            for line in so.splitlines():
+                shas = line.split()
+                parents[shas[0]] = shas[1:]
+        _repo = self._repo
+        for sha in missing:
+            shas = parents.get(sha)
+            if shas is None:
+                shas = _repo[sha].parents
+            graph.append([revisions.index(parent) for parent in shas
+                          if parent in revisions])
+        return graph
+
+    @LazyProperty
+    def _object_cache(self):
+        """
+        Returns ``LRUCache`` of tree objects and small blobs, shared by all
+        changesets of this repository.
+        """
+        return LRUCache(max_entries=settings.GIT_OBJECT_CACHE_ENTRIES,
+                        max_size=settings.GIT_OBJECT_CACHE_SIZE)
+
+    def _get_object(self, sha):
+        """
+        Returns dulwich object with given ``sha``, read by dulwich or by
+        ``git cat-file`` process (depending on ``GIT_OBJECT_READER``
+        setting). Trees and blobs not bigger than
+        ``GIT_OBJECT_CACHE_BLOB_SIZE`` are kept in ``_object_cache`` so they
+        are not inflated again. Returned objects must not be modified.
+
+        :raises ``KeyError``: if there is no such object
+        """
+        obj = self._object_cache.get(sha)
+        if obj is None:
+            if settings.GIT_OBJECT_READER == 'cat-file':
+                obj = self._cat_file.get_object(sha)
+            else:
+                obj = self._repo[sha]
+            if isinstance(obj, (Tree, Blob)):
+                size = obj.raw_length()
+                if isinstance(obj, Tree) or \
+                        size <= settings.GIT_OBJECT_CACHE_BLOB_SIZE:
+                    self._object_cache.set(sha, obj, size)
+        return obj
+
+    @LazyProperty
+    def _cat_file(self):
+        """
+        Returns ``GitCatFileReader`` used to read objects if
+        ``GIT_OBJECT_READER`` is set to ``cat-file``.
+        """
+        return get_cat_file_reader(self.path)
+
+    @LazyProperty
+    def _tree_sizes(self):
+        """
+        Returns ``TreeSizes`` computing sizes of blobs and trees of this
+        repository.
+        """
+        return TreeSizes(self)
+
+    @LazyProperty
+    def _repo_handle(self):
+        """
+        Returns ``RepoHandle`` which keeps dulwich repository opened (and
+        reopens it if it changes on disk).
+        """
+        return get_repo_handle(self.path)
 
     @property
     def head(self):
@@ -85,7 +183,16 @@ class GitRepository(BaseRepository):
         Returns list of revisions' ids, in ascending order.  Being lazy
         attribute allows external tools to inject shas from cache.
         """
-        return self._get_all_revisions()
+        if settings.GIT_REVISION_INDEX:
+            return self._revision_index.get_revisions()
+        return RevisionList(self._get_all_revisions())
+
+    @LazyProperty
+    def _revision_index(self):
+        """
+        Returns ``GitRevisionIndex`` persisted within this repository.
+        """
+        return GitRevisionIndex(self)
 
     @classmethod
     def _run_git_command(cls, cmd, **opts):
@@ -96,17 +203,38 @@ class GitRepository(BaseRepository):
         :param cmd: git command to be executed
         :param opts: env options to pass into Subprocess command
         """
+        safe_call = False
+        if '_safe' in opts:
+            #no exc on failure
+            del opts['_safe']
+            safe_call = True
 
+        try:
+            p = cls._start_git_command(cmd, **opts)
+            # failures may be also detected when output is being read
+            return ''.join(p.output), ''.join(p.error)
+        except (EnvironmentError, OSError), err:
+            tb_err = ("Couldn't run git command (%s).\n"
+                      "Original error was:%s\n" % (cmd, err))
+            log.error(tb_err)
+            if safe_call:
+                return '', err
+            else:
+                raise RepositoryError(tb_err)
+
+    @classmethod
+    def _start_git_command(cls, cmd, **opts):
+        """
+        Starts given ``cmd`` as git command and returns chunker object (see
+        ``GIT_SUBPROCESS_ENGINE`` setting) iterating over its stdout.
+
+        :raises ``EnvironmentError``: if command cannot be run or fails
+        """
         if '_bare' in opts:
             _copts = []
             del opts['_bare']
         else:
             _copts = ['-c', 'core.quotepath=false', ]
-        safe_call = False
-        if '_safe' in opts:
-            #no exc on failure
-            del opts['_safe']
-            safe_call = True
 
         _str_cmd = False
         if isinstance(cmd, basestring):
@@ -123,23 +251,18 @@ class GitRepository(BaseRepository):
         cmd = [_git_path] + _copts + cmd
         if _str_cmd:
             cmd = ' '.join(cmd)
-        try:
-            _opts = dict(
-                env=gitenv,
-                shell=False,
-            )
-            _opts.update(opts)
-            p = subprocessio.SubprocessIOChunker(cmd, **_opts)
-        except (EnvironmentError, OSError), err:
-            tb_err = ("Couldn't run git command (%s).\n"
-                      "Original error was:%s\n" % (cmd, err))
-            log.error(tb_err)
-            if safe_call:
-                return '', err
-            else:
-                raise RepositoryError(tb_err)
-
-        return ''.join(p.output), ''.join(p.error)
+        if settings.GIT_SUBPROCESS_ENGINE == 'select':
+            chunker = subprocessio.SelectIOChunker
+            opts.setdefault('timeout', settings.GIT_COMMAND_TIMEOUT)
+        else:
+            chunker = subprocessio.SubprocessIOChunker
+            opts.pop('timeout', None)
+        _opts = dict(
+            env=gitenv,
+            shell=False,
+        )
+        _opts.update(opts)
+        return chunker(cmd, **_opts)
 
     def run_git_command(self, cmd):
         opts = {}
@@ -147,6 +270,38 @@ class GitRepository(BaseRepository):
             opts['cwd'] = self.path
         return self._run_git_command(cmd, **opts)
 
+    def stream_git_command(self, cmd):
+        """
+        Runs given ``cmd`` as git command and returns generator of chunks of
+        its stdout, yielded as the command produces them. Only a bounded
+        amount of output is buffered ahead of the consumer.
+
+        :raises ``RepositoryError``: if command cannot be run or fails (also
+          while chunks are being yielded)
+        """
+        opts = {}
+        if os.path.isdir(self.path):
+            opts['cwd'] = self.path
+        try:
+            p = self._start_git_command(cmd, **opts)
+        except (EnvironmentError, OSError), err:
+            raise RepositoryError("Couldn't run git command (%s).\n"
+                                  "Original error was:%s\n" % (cmd, err))
+        return self._iter_git_output(cmd, p)
+
+    def _iter_git_output(self, cmd, p):
+        try:
+            try:
+                for chunk in p:
+                    yield chunk
+            except (EnvironmentError, OSError), err:
+                raise RepositoryError("Git command (%s) failed.\n"
+                                      "Original error was:%s\n" % (cmd, err))
+        finally:
+            close = getattr(p, 'close', None)
+            if close is not None:
+                close()
+
     @classmethod
     def _check_url(cls, url):
         """
@@ -275,10 +430,18 @@ class GitRepository(BaseRepository):
             if revision in _tags_shas:
                 return _tags_shas[_tags_shas.index(revision)]
 
-            elif not SHA_PATTERN.match(revision) or revision not in self.revisions:
+            elif not SHA_PATTERN.match(revision):
                 raise ChangesetDoesNotExistError("Revision %s does not exist "
                     "for this repository" % (revision))
 
+            elif revision not in self.revisions:
+                # maybe it's a short id
+                try:
+                    revision = self.revisions.lookup(revision)
+                except KeyError:
+                    raise ChangesetDoesNotExistError("Revision %s does not "
+                        "exist for this repository" % (revision))
+
         # Ensure we return full id
         if not SHA_PATTERN.match(str(revision)):
             raise ChangesetDoesNotExistError("Given revision %s not recognized"
@@ -463,6 +626,60 @@ class GitRepository(BaseRepository):
         changeset = GitChangeset(repository=self, revision=revision)
         return changeset
 
+    def _get_changeset_for_commit(self, commit):
+        """
+        Returns ``GitChangeset`` for already read dulwich ``commit``.
+        """
+        if commit.id in self.revisions:
+            return GitChangeset(repository=self, revision=commit.id,
+                                commit=commit)
+        return self.get_changeset(commit.id)
+
+    def get_changesets_bulk(self, revisions):
+        """
+        Returns list of ``GitChangeset`` objects for given ``revisions``.
+        Full ids are resolved directly against ``revisions`` and commits are
+        read using single dulwich repository object.
+        """
+        _repo = self._repo
+        changesets = []
+        for revision in revisions:
+            if isinstance(revision, GitChangeset):
+                changeset = revision
+            elif revision in self.revisions:
+                try:
+                    commit = _repo[revision]
+                except KeyError:
+                    raise RepositoryError("Cannot get object with id %s"
+                                          % revision)
+                changeset = self._get_changeset_for_commit(commit)
+            else:
+                changeset = self.get_changeset(revision)
+            changesets.append(changeset)
+        return changesets
+
+    def _get_commit_infos(self, revisions, authors):
+        """
+        Returns list of ``CommitInfo`` records for given ``revisions``, read
+        from dulwich commit objects.
+        """
+        _repo = self._repo
+        infos = []
+        for revision in revisions:
+            if len(revision) != 40:
+                revision = self._get_revision(revision)
+            try:
+                commit = _repo[revision]
+            except KeyError:
+                raise RepositoryError("Cannot get object with id %s"
+                                      % revision)
+            author = authors.get(commit.author)
+            if author is None:
+                author = authors[commit.author] = safe_unicode(commit.author)
+            infos.append(CommitInfo(commit.id, author, commit.commit_time,
+                safe_unicode(commit.message), tuple(commit.parents)))
+        return infos
+
     def get_changesets(self, start=None, end=None, start_date=None,
            end_date=None, branch_name=None, reverse=False):
         """
@@ -550,40 +767,76 @@ class GitRepository(BaseRepository):
         :param context: How many lines before/after changed lines should be
           shown. Defaults to ``3``.
         """
+        def get_chunks(rev1, rev2):
+            cmd, show = self._get_diff_command(rev1, rev2, path,
+                                               ignore_whitespace, context)
+            stdout, stderr = self.run_git_command(cmd)
+            if show:
+                return self._strip_show_header([stdout])
+            return [stdout]
+        return ''.join(self._get_cached_diff_iter(rev1, rev2, path,
+            ignore_whitespace, context, get_chunks))
+
+    def get_diff_iter(self, rev1, rev2, path=None, ignore_whitespace=False,
+                      context=3):
+        """
+        Returns generator of chunks of the same *diff* as ``get_diff``,
+        yielded while ``git diff`` produces them.
+        """
+        def get_chunks(rev1, rev2):
+            cmd, show = self._get_diff_command(rev1, rev2, path,
+                                               ignore_whitespace, context)
+            chunks = self.stream_git_command(cmd)
+            if show:
+                chunks = self._strip_show_header(chunks)
+            return chunks
+        return self._get_cached_diff_iter(rev1, rev2, path, ignore_whitespace,
+                                          context, get_chunks)
+
+    def _get_diff_command(self, rev1, rev2, path, ignore_whitespace, context):
+        """
+        Returns tuple of git command showing the diff between revisions with
+        given raw ids and flag telling if it is ``show`` command (which
+        output starts with commit's header).
+        """
         flags = ['-U%s' % context, '--full-index', '--binary', '-p', '-M', '--abbrev=40']
         if ignore_whitespace:
             flags.append('-w')
 
-        if hasattr(rev1, 'raw_id'):
-            rev1 = getattr(rev1, 'raw_id')
-
-        if hasattr(rev2, 'raw_id'):
-            rev2 = getattr(rev2, 'raw_id')
-
-        if rev1 == self.EMPTY_CHANGESET:
-            rev2 = self.get_changeset(rev2).raw_id
+        show = rev1 == self.EMPTY_CHANGESET
+        if show:
             cmd = ' '.join(['show'] + flags + [rev2])
         else:
-            rev1 = self.get_changeset(rev1).raw_id
-            rev2 = self.get_changeset(rev2).raw_id
             cmd = ' '.join(['diff'] + flags + [rev1, rev2])
 
         if path:
             cmd += ' -- "%s"' % path
+        return cmd, show
 
-        stdout, stderr = self.run_git_command(cmd)
-        # If we used 'show' command, strip first few lines (until actual diff
-        # starts)
-        if rev1 == self.EMPTY_CHANGESET:
-            lines = stdout.splitlines()
-            x = 0
-            for line in lines:
-                if line.startswith('diff'):
-                    break
-                x += 1
-            # Append new line just like 'diff' command do
-            stdout = '\n'.join(lines[x:]) + '\n'
-        return stdout
+    def _strip_show_header(self, chunks):
+        """
+        Yields given chunks of ``show`` command's output without lines
+        preceding the actual diff (commit's header). Only the header is
+        buffered.
+        """
+        chunks = iter(chunks)
+        pending = ''
+        for chunk in chunks:
+            # pending part always starts at the beginning of a line
+            pending += chunk
+            if pending.startswith('diff'):
+                start = 0
+            else:
+                start = pending.find('\ndiff') + 1
+                if not start:
+                    pending = pending[pending.rfind('\n') + 1:]
+                    continue
+            yield pending[start:]
+            for chunk in chunks:
+                yield chunk
+            return
+        # Append new line just like 'diff' command do
+        yield '\n'
 
     @LazyProperty
     def in_memory_changeset(self):
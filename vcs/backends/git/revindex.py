@@ -0,0 +1,283 @@
+# -*- coding: utf-8 -*-
+"""
+    vcs.backends.git.revindex
+    ~~~~~~~~~~~~~~~~~~~~~~~~~
+
+    Persistent revision index for git repositories.
+
+    :created_on: Oct 17, 2026
+    :copyright: (c) 2010-2011 by Marcin Kuzminski, Lukasz Balcerzak.
+"""
+
+import os
+import time
+import hashlib
+import logging
+
+from dulwich.objects import Tag
+
+from vcs.backends.base import RevisionList
+from vcs.conf import settings
+from vcs.exceptions import RepositoryError
+from vcs.utils.lockfiles import LockFile
+
+log = logging.getLogger(__name__)
+
+
+class GitRevisionIndex(object):
+    """
+    Index of repository's revisions persisted within git directory.
+
+    Index is keyed by the state of refs (and ``GIT_REV_FILTER`` setting). As
+    long as refs don't change, revisions are read from disk without running
+    ``git rev-list`` at all. If refs have changed but all of previously
+    indexed commits are still reachable, only new commits are appended to
+    the index; otherwise it is rebuilt from scratch.
+
+    Index is only a cache - any problem with reading or writing it falls back
+    to asking git directly.
+    """
+    FILENAME = 'vcs-revindex'
+    VERSION = '1'
+    LINE_LENGTH = 41
+    # lock files older than this number of seconds were left by killed
+    # processes (writing index takes a fraction of a second)
+    STALE_LOCK_AGE = 60
+
+    def __init__(self, repository):
+        self.repository = repository
+        self.revisions = None
+        self.state = None
+        self.tips = None
+        self.generation = None
+        self.stored = 0
+
+    @property
+    def path(self):
+        git_dir = self.repository.path
+        if not self.repository.bare:
+            git_dir = os.path.join(git_dir, '.git')
+        return os.path.join(git_dir, self.FILENAME)
+
+    @property
+    def state_path(self):
+        return '%s.state' % self.path
+
+    @property
+    def _header(self):
+        return 'vcs-revindex %s %s\n' % (self.VERSION, self.generation)
+
+    def get_revisions(self):
+        """
+        Returns ``RevisionList`` of revisions' ids, in ascending order,
+        refreshed against current state of refs.
+        """
+        if self.revisions is None:
+            self._read()
+        self.refresh()
+        return self.revisions
+
+    def refresh(self):
+        """
+        Brings index up to date with current refs. New commits are appended
+        to already loaded ``revisions`` list (ids which are already indexed
+        are skipped).
+        """
+        _repo = self.repository._repo
+        refs = _repo.get_refs()
+        state = self._get_state(refs)
+        if self.revisions is not None and state == self.state:
+            return
+        if not refs:
+            self.revisions = RevisionList()
+            self.state, self.tips = state, []
+            return
+
+        heads = self._get_heads(_repo, refs)
+        new = None
+        if self.revisions and self.tips is not None and \
+                self._tips_reachable(_repo, heads):
+            if all(head in self.revisions for head in heads):
+                new = []
+            else:
+                new = self._rev_list(['^%s' % tip for tip in self.tips])
+        if new is None:
+            if self.revisions:
+                log.debug('Rebuilding revision index at %s' % self.path)
+            self.revisions = RevisionList(self.repository._get_all_revisions())
+            self.generation = None
+        else:
+            self.revisions.extend(rev for rev in new
+                                  if rev not in self.revisions)
+        self.state = state
+        self.tips = sorted(head for head in heads if head in self.revisions)
+        self._write()
+
+    def _get_state(self, refs):
+        state = hashlib.sha1(settings.GIT_REV_FILTER)
+        for ref in sorted(refs):
+            state.update('%s %s\n' % (ref, refs[ref]))
+        return state.hexdigest()
+
+    def _get_heads(self, _repo, refs):
+        """
+        Returns set of commits pointed by the given ``refs`` (tags are
+        peeled).
+        """
+        heads = set()
+        for sha in set(refs.values()):
+            try:
+                obj = _repo[sha]
+                while isinstance(obj, Tag):
+                    obj = _repo[obj.object[1]]
+            except KeyError:
+                continue
+            heads.add(obj.id)
+        return heads
+
+    def _tips_reachable(self, _repo, heads):
+        """
+        Checks if all previously indexed tips are still reachable from
+        current refs. Tips which are still pointed by refs (or are parents of
+        such commits) are reachable by definition; only the rest needs to be
+        checked by git.
+        """
+        tips = set(self.tips)
+        if settings.GIT_REV_FILTER == '--all':
+            tips.difference_update(heads)
+            for head in heads:
+                if not tips:
+                    break
+                try:
+                    tips.difference_update(_repo[head].parents)
+                except (KeyError, AttributeError):
+                    pass
+        if not tips:
+            return True
+        return self._rev_list(list(tips), '--count --not') == ['0']
+
+    def _rev_list(self, revs, opts='--reverse --date-order'):
+        """
+        Runs ``git rev-list`` for ``GIT_REV_FILTER`` and given ``revs`` (passed
+        through stdin, so there is no limit on their number). Returns list of
+        output lines or ``None`` if command failed.
+        """
+        cmd = 'rev-list --stdin %s %s' % (opts, settings.GIT_REV_FILTER)
+        # close_fds: git would never see EOF at stdin if it inherited write
+        # end of the pipe
+        try:
+            so, se = self.repository._run_git_command(cmd,
+                cwd=self.repository.path, close_fds=True,
+                inputstream='\n'.join(revs) + '\n')
+        except RepositoryError:
+            return None
+        return so.splitlines()
+
+    def _read(self):
+        """
+        Reads index from disk. Leaves ``revisions`` as ``None`` if there is
+        no usable index stored.
+        """
+        try:
+            state_file = open(self.state_path, 'rb')
+            try:
+                lines = state_file.read().splitlines()
+            finally:
+                state_file.close()
+            generation, count = lines[0].split()
+            count = int(count)
+            state, tips = lines[1], lines[2:]
+
+            body = open(self.path, 'rb')
+            try:
+                header = body.readline()
+                if header != 'vcs-revindex %s %s\n' % (self.VERSION,
+                                                       generation):
+                    return
+                data = body.read(count * self.LINE_LENGTH)
+            finally:
+                body.close()
+        except (IOError, OSError, IndexError, ValueError):
+            return
+        if len(data) != count * self.LINE_LENGTH:
+            return
+        self.revisions = RevisionList(data.splitlines())
+        self.state = state
+        self.tips = tips
+        self.generation = generation
+        self.stored = count
+
+    def _write(self):
+        lock = LockFile(self.path)
+        self._remove_stale_lock(lock._lock_file_path())
+        try:
+            lock._obtain_lock()
+        except IOError:
+            log.debug('Revision index at %s is locked' % self.path)
+            return
+        try:
+            if not self._append():
+                self._write_body()
+            self._write_file(self.state_path, '%s %s\n%s\n%s' % (
+                self.generation, self.stored, self.state,
+                ''.join('%s\n' % tip for tip in self.tips)))
+        except (IOError, OSError), err:
+            log.warning('Cannot write revision index at %s: %s'
+                        % (self.path, err))
+        finally:
+            lock._release_lock()
+
+    def _remove_stale_lock(self, lock_path):
+        try:
+            age = time.time() - os.stat(lock_path).st_mtime
+        except OSError:
+            return
+        if age > self.STALE_LOCK_AGE:
+            log.warning('Removing stale revision index lock %s' % lock_path)
+            try:
+                os.remove(lock_path)
+            except OSError:
+                pass
+
+    def _append(self):
+        """
+        Appends not yet stored revisions to the index file. Returns ``False``
+        if index file needs to be rewritten instead.
+        """
+        if self.generation is None:
+            return False
+        expected = len(self._header) + self.stored * self.LINE_LENGTH
+        try:
+            body = open(self.path, 'r+b')
+        except IOError:
+            return False
+        try:
+            # make sure file wasn't rewritten by someone else in the meantime
+            if body.readline() != self._header:
+                return False
+            body.seek(0, os.SEEK_END)
+            if body.tell() != expected:
+                return False
+            body.write(''.join('%s\n' % rev
+                               for rev in self.revisions[self.stored:]))
+        finally:
+            body.close()
+        self.stored = len(self.revisions)
+        return True
+
+    def _write_body(self):
+        self.generation = hashlib.sha1(os.urandom(20)).hexdigest()
+        self._write_file(self.path, self._header +
+                         ''.join('%s\n' % rev for rev in self.revisions))
+        self.stored = len(self.revisions)
+
+    def _write_file(self, path, data):
+        tmp_path = '%s.%s.tmp' % (path, os.getpid())
+        f = open(tmp_path, 'wb')
+        try:
+            f.write(data)
+        finally:
+            f.close()
+        if os.name == 'nt' and os.path.exists(path):
+            os.remove(path)
+        os.rename(tmp_path, path)
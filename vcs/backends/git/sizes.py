@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+"""
+    vcs.backends.git.sizes
+    ~~~~~~~~~~~~~~~~~~~~~~
+
+    Sizes of git blobs and trees, computed without inflating blobs.
+
+    :created_on: Oct 17, 2026
+    :copyright: (c) 2010-2011 by Marcin Kuzminski, Lukasz Balcerzak.
+"""
+
+import stat
+
+from vcs.conf import settings
+from vcs.utils.lrucache import LRUCache
+
+
+class TreeSizes(object):
+    """
+    Computes sizes of blobs and total sizes of all blobs within trees of
+    given ``repository``. Sizes of blobs are read by ``git cat-file
+    --batch-check`` (which reads them from object headers) unless blob is
+    already held by repository's object cache. Sizes of trees are remembered
+    per tree id, so unchanged subtrees are summed up once for all commits.
+    """
+
+    def __init__(self, repository):
+        self.repository = repository
+        # object id -> size (blobs' and trees' ids never collide)
+        self._sizes = LRUCache(max_entries=settings.GIT_SIZE_CACHE_ENTRIES)
+
+    def get_blob_size(self, sha):
+        """
+        Returns size in bytes of blob with given ``sha``.
+
+        :raises ``KeyError``: if there is no such object
+        """
+        size = self._sizes.get(sha)
+        if size is None:
+            blob = self.repository._object_cache.get(sha)
+            if blob is not None:
+                size = blob.raw_length()
+            else:
+                size = self.repository._cat_file.get_info(sha)[1]
+            self._sizes.set(sha, size)
+        return size
+
+    def get_tree_size(self, sha):
+        """
+        Returns total size in bytes of all blobs within tree with given
+        ``sha`` (and its subtrees). Submodules are not counted.
+
+        :raises ``KeyError``: if there is no such object
+        """
+        size = self._sizes.get(sha)
+        if size is not None:
+            return size
+        # iterative post-order walk; each stack item is a list of tree id,
+        # total size of its blobs and ids of its subtrees (``None`` until
+        # the tree is read)
+        totals = {}
+        stack = [[sha, 0, None]]
+        while stack:
+            item = stack[-1]
+            tree_id, blobs_size, subtrees = item
+            if tree_id in totals:
+                stack.pop()
+            elif subtrees is None:
+                item[2] = subtrees = []
+                for name, mode, entry_id in \
+                        self.repository._get_object(tree_id).iteritems():
+                    if stat.S_ISDIR(mode):
+                        subtrees.append(entry_id)
+                    elif mode & 0170000 != 0160000:
+                        # not a submodule
+                        item[1] += self.get_blob_size(entry_id)
+                for subtree_id in subtrees:
+                    if subtree_id not in totals:
+                        size = self._sizes.get(subtree_id)
+                        if size is None:
+                            stack.append([subtree_id, 0, None])
+                        else:
+                            totals[subtree_id] = size
+            else:
+                stack.pop()
+                size = blobs_size + sum(totals[s] for s in subtrees)
+                totals[tree_id] = size
+                self._sizes.set(tree_id, size)
+        return totals[sha]
@@ -0,0 +1,42 @@
+# -*- coding: utf-8 -*-
+"""
+    vcs.backends.hg.blame
+    ~~~~~~~~~~~~~~~~~~~~~
+
+    Annotation of files of Mercurial repositories.
+
+    :created_on: Oct 17, 2026
+    :copyright: (c) 2010-2011 by Marcin Kuzminski, Lukasz Balcerzak.
+"""
+
+from vcs.utils.blame import Annotator
+from vcs.utils.hgcompat import hex, nullrev
+
+
+class MercurialAnnotator(Annotator):
+    """
+    Annotates file at given ``path`` of Mercurial ``repo``. Version of the
+    file is its revision within ``filelog``; its parents are parents within
+    the filelog (copies are not followed, as by ``filectx.annotate``).
+    Annotations are cached by path, file node and changeset of the version.
+    """
+
+    def __init__(self, repo, path, filelog, cache):
+        super(MercurialAnnotator, self).__init__(cache)
+        self.repo = repo
+        self.path = path
+        self.filelog = filelog
+
+    def get_key(self, version):
+        return (self.path, hex(self.filelog.node(version)),
+                self.get_commit_id(version))
+
+    def get_parents(self, version):
+        return [rev for rev in self.filelog.parentrevs(version)
+                if rev != nullrev]
+
+    def get_lines(self, version):
+        return self.filelog.read(self.filelog.node(version)).splitlines(True)
+
+    def get_commit_id(self, version):
+        return hex(self.repo.changelog.node(self.filelog.linkrev(version)))
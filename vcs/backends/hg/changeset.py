@@ -1,11 +1,10 @@
-import os
-import posixpath
 
-from vcs.conf import settings
+import weakref
+from functools import partial
+
 from vcs.backends.base import BaseChangeset
 from vcs.exceptions import (
-    ChangesetDoesNotExistError, ChangesetError, ImproperArchiveTypeError,
-    NodeDoesNotExistError, VCSError
+    ChangesetError, NodeDoesNotExistError, VCSError
 )
 from vcs.nodes import (
     AddedFileNodesGenerator, ChangedFileNodesGenerator, DirNode, FileNode,
@@ -13,8 +12,26 @@ from vcs.nodes import (
 )
 from vcs.utils import safe_str, safe_unicode, date_fromtimestamp
 from vcs.utils.lazy import LazyProperty
-from vcs.utils.paths import get_dirs_for_path
-from vcs.utils.hgcompat import archival, hex
+from vcs.utils.hgcompat import hex, narrowmatcher
+
+from .blame import MercurialAnnotator
+
+
+class _SubrepoArchiveCollector(object):
+    """
+    Collects files of subrepository, added with interface of Mercurial's
+    archivers, as archive entries.
+    """
+
+    def __init__(self):
+        self.entries = []
+
+    def addfile(self, name, mode, islink, data):
+        if islink:
+            mode = 0120000
+        else:
+            mode = mode & 0111 and 0100755 or 0100644
+        self.entries.append((name, mode, data))
 
 
 class MercurialChangeset(BaseChangeset):
@@ -27,7 +44,8 @@ class MercurialChangeset(BaseChangeset):
         self.raw_id = revision
         self._ctx = repository._repo[revision]
         self.revision = self._ctx._rev
-        self.nodes = {}
+        # nodes are cached only as long as they are referenced elsewhere
+        self.nodes = weakref.WeakValueDictionary()
 
     @LazyProperty
     def tags(self):
@@ -75,9 +93,11 @@ class MercurialChangeset(BaseChangeset):
 
     @LazyProperty
     def _dir_paths(self):
-        p = list(set(get_dirs_for_path(*self._file_paths)))
-        p.insert(0, '')
-        return p
+        return sorted(self._dir_index.dirs)
+
+    @LazyProperty
+    def _dir_index(self):
+        return self.repository._get_directory_index(self._ctx)
 
     @LazyProperty
     def _paths(self):
@@ -98,16 +118,20 @@ class MercurialChangeset(BaseChangeset):
         """
         Returns list of parents changesets.
         """
-        return [self.repository.get_changeset(parent.rev())
-                for parent in self._ctx.parents() if parent.rev() >= 0]
+        graph = self.repository._get_commit_graph()
+        revisions = self.repository.revisions
+        return self.repository.get_changesets_bulk([revisions[pos]
+            for pos in graph.parents(self.revision)])
 
     @LazyProperty
     def children(self):
         """
         Returns list of children changesets.
         """
-        return [self.repository.get_changeset(child.rev())
-                for child in self._ctx.children() if child.rev() >= 0]
+        graph = self.repository._get_commit_graph()
+        revisions = self.repository.revisions
+        return self.repository.get_changesets_bulk([revisions[pos]
+            for pos in graph.children(self.revision)])
 
     def next(self, branch=None):
 
@@ -115,43 +139,20 @@ class MercurialChangeset(BaseChangeset):
             raise VCSError('Branch option used on changeset not belonging '
                            'to that branch')
 
-        def _next(changeset, branch):
-            try:
-                next_ = changeset.revision + 1
-                next_rev = changeset.repository.revisions[next_]
-            except IndexError:
-                raise ChangesetDoesNotExistError
-            cs = changeset.repository.get_changeset(next_rev)
-
-            if branch and branch != cs.branch:
-                return _next(cs, branch)
-
-            return cs
-
-        return _next(self, branch)
+        positions = None
+        if branch:
+            positions = self.repository._get_branch_positions(branch)
+        return self._get_adjacent_changeset(1, positions)
 
     def prev(self, branch=None):
         if branch and self.branch != branch:
             raise VCSError('Branch option used on changeset not belonging '
                            'to that branch')
 
-        def _prev(changeset, branch):
-            try:
-                prev_ = changeset.revision - 1
-                if prev_ < 0:
-                    raise IndexError
-                prev_rev = changeset.repository.revisions[prev_]
-            except IndexError:
-                raise ChangesetDoesNotExistError
-
-            cs = changeset.repository.get_changeset(prev_rev)
-
-            if branch and branch != cs.branch:
-                return _prev(cs, branch)
-
-            return cs
-
-        return _prev(self, branch)
+        positions = None
+        if branch:
+            positions = self.repository._get_branch_positions(branch)
+        return self._get_adjacent_changeset(-1, positions)
 
     def diff(self, ignore_whitespace=True, context=3):
         return ''.join(self._ctx.diff(git=True,
@@ -171,9 +172,9 @@ class MercurialChangeset(BaseChangeset):
 
     def _get_kind(self, path):
         path = self._fix_path(path)
-        if path in self._file_paths:
+        if self._dir_index.is_file(path):
             return NodeKind.FILE
-        elif path in self._dir_paths:
+        elif self._dir_index.is_dir(path):
             return NodeKind.DIR
         else:
             raise ChangesetError("Node does not exist at the given path '%s'"
@@ -217,6 +218,40 @@ class MercurialChangeset(BaseChangeset):
         fctx = self._get_filectx(path)
         return fctx.size()
 
+    def _get_paths_kinds(self, paths):
+        """
+        Returns dict mapping those of given ``paths`` which exist at this
+        changeset to kinds of their nodes, using changeset's directory index.
+        """
+        kinds = {}
+        for path in paths:
+            fixed = self._fix_path(path)
+            if self._dir_index.is_file(fixed):
+                kinds[path] = NodeKind.FILE
+            elif self._dir_index.is_dir(fixed):
+                kinds[path] = NodeKind.DIR
+        return kinds
+
+    def _is_file_content_changed(self, path, content):
+        """
+        Returns ``True`` if given ``content`` differs from content of the
+        file at the given ``path``. Content is compared by filelog using
+        revision hashes, so it is not read unless hashes differ.
+        """
+        fctx = self._get_filectx(path)
+        return fctx.filelog().cmp(fctx.filenode(), content)
+
+    def get_dir_size(self, path):
+        """
+        Returns total size of all files within directory at given ``path``.
+        """
+        path = self._fix_path(path)
+        if not self._dir_index.is_dir(path):
+            raise ChangesetError("Directory does not exist for revision %s at "
+                " '%s'" % (self.revision, path))
+        filectx = self._ctx.filectx
+        return self._dir_index.get_size(path, lambda f: filectx(f).size())
+
     def get_file_changeset(self, path):
         """
         Returns last commit of the file at the given ``path``.
@@ -228,71 +263,80 @@ class MercurialChangeset(BaseChangeset):
         Returns history of file as reversed list of ``Changeset`` objects for
         which file at given ``path`` has been modified.
         """
-        fctx = self._get_filectx(path)
-        hist = []
-        cnt = 0
-        for cs in reversed([x for x in fctx.filelog()]):
-            cnt += 1
-            hist.append(hex(fctx.filectx(cs).node()))
-            if limit and cnt == limit:
-                break
+        return list(self.iter_file_history(path, limit))
 
-        return [self.repository.get_changeset(node) for node in hist]
+    def iter_file_history(self, path, limit=None):
+        """
+        Yields ``Changeset`` objects for which file at given ``path`` has been
+        modified, starting from the most recent one. File revisions are read
+        lazily from the filelog. Retrieved histories are cached by the
+        repository.
+        """
+        fctx = self._get_filectx(path)
+        filelog = fctx.filelog()
+        # history contains all revisions of the filelog, so it changes
+        # whenever the file is modified (at any branch)
+        key = (safe_str(path), self.raw_id, len(filelog))
+        return self._iter_cached_file_history(key, limit,
+            self._walk_file_history(fctx, filelog))
+
+    def _walk_file_history(self, fctx, filelog):
+        for filerev in xrange(len(filelog) - 1, -1, -1):
+            node = hex(fctx.filectx(filerev).node())
+            yield self.repository.get_changeset(node)
 
     def get_file_annotate(self, path):
         """
         Returns a generator of four element tuples with
             lineno, sha, changeset lazy loader and line
-        """
 
+        Annotation is computed from cached annotations of previous versions
+        of the file, so only versions changed since are compared.
+        """
         fctx = self._get_filectx(path)
-        for i, annotate_data in enumerate(fctx.annotate()):
-            ln_no = i + 1
-            sha = hex(annotate_data[0].node())
-            yield (ln_no, sha, lambda: self.repository.get_changeset(sha), annotate_data[1],)
-
-    def fill_archive(self, stream=None, kind='tgz', prefix=None,
-                     subrepos=False):
-        """
-        Fills up given stream.
-
-        :param stream: file like object.
-        :param kind: one of following: ``zip``, ``tgz`` or ``tbz2``.
-            Default: ``tgz``.
-        :param prefix: name of root directory in archive.
-            Default is repository name and changeset's raw_id joined with dash
-            (``repo-tip.<KIND>``).
-        :param subrepos: include subrepos in this archive.
-
-        :raise ImproperArchiveTypeError: If given kind is wrong.
-        :raise VcsError: If given stream is None
-        """
-
-        allowed_kinds = settings.ARCHIVE_SPECS.keys()
-        if kind not in allowed_kinds:
-            raise ImproperArchiveTypeError('Archive kind not supported use one'
-                'of %s', allowed_kinds)
-
-        if stream is None:
-            raise VCSError('You need to pass in a valid stream for filling'
-                           ' with archival data')
-
-        if prefix is None:
-            prefix = '%s-%s' % (self.repository.name, self.short_id)
-        elif prefix.startswith('/'):
-            raise VCSError("Prefix cannot start with leading slash")
-        elif prefix.strip() == '':
-            raise VCSError("Prefix cannot be empty")
-
-        archival.archive(self.repository._repo, stream, self.raw_id,
-                         kind, prefix=prefix, subrepos=subrepos)
-
-        if stream.closed and hasattr(stream, 'name'):
-            stream = open(stream.name, 'rb')
-        elif hasattr(stream, 'mode') and 'r' not in stream.mode:
-            stream = open(stream.name, 'rb')
-        else:
-            stream.seek(0)
+        annotator = MercurialAnnotator(self.repository._repo, fctx.path(),
+            fctx.filelog(), self.repository._annotate_cache)
+        annotation = annotator.annotate(fctx.filerev())
+        lines = fctx.data().splitlines(True)
+        for i, sha in enumerate(annotation):
+            yield (i + 1, sha, partial(self.repository.get_changeset, sha),
+                   lines[i])
+
+    def _get_archive_mtime(self):
+        return self._ctx.date()[0]
+
+    def _iter_archive_entries(self, subrepos=False):
+        repo = self.repository._repo
+        if repo.ui.configbool('ui', 'archivemeta', True):
+            yield '.hg_archival.txt', 0100644, self._get_archival_metadata()
+        for path in sorted(self._ctx.manifest()):
+            flags = self._ctx.flags(path)
+            if 'l' in flags:
+                mode = 0120000
+            elif 'x' in flags:
+                mode = 0100755
+            else:
+                mode = 0100644
+            yield path, mode, repo.wwritedata(path, self._ctx[path].data())
+        if subrepos:
+            for subpath in sorted(self._ctx.substate):
+                collector = _SubrepoArchiveCollector()
+                self._ctx.sub(subpath).archive(repo.ui, collector, '',
+                    narrowmatcher(subpath, None))
+                for entry in collector.entries:
+                    yield entry
+
+    def _get_archival_metadata(self):
+        """
+        Returns content of ``.hg_archival.txt`` file Mercurial puts into
+        archives.
+        """
+        repo = self.repository._repo
+        metadata = 'repo: %s\nnode: %s\nbranch: %s\n' % (repo[0].hex(),
+            self.raw_id, self._ctx.branch())
+        metadata += ''.join('tag: %s\n' % tag for tag in self._ctx.tags()
+                            if repo.tagtype(tag) == 'global')
+        return metadata
 
     def get_nodes(self, path):
         """
@@ -306,12 +350,9 @@ class MercurialChangeset(BaseChangeset):
                 " '%s'" % (self.revision, path))
         path = self._fix_path(path)
 
-        filenodes = [FileNode(f, changeset=self) for f in self._file_paths
-            if os.path.dirname(f) == path]
-        dirs = path == '' and '' or [d for d in self._dir_paths
-            if d and posixpath.dirname(d) == path]
-        dirnodes = [DirNode(d, changeset=self) for d in dirs
-            if os.path.dirname(d) == path]
+        dirs, files = self._dir_index.get_children(path)
+        filenodes = [FileNode(f, changeset=self) for f in files]
+        dirnodes = [DirNode(d, changeset=self) for d in dirs]
 
         als = self.repository.alias
         for k, vals in self._extract_submodules().iteritems():
@@ -328,6 +369,28 @@ class MercurialChangeset(BaseChangeset):
 
         return nodes
 
+    def _find_last_changes(self, path, names):
+        """
+        Walks ancestors of this changeset (most recent first) looking at
+        files modified by each of them, until every entry is resolved.
+        """
+        changelog = self.repository._repo.changelog
+        prefix = path and path + '/'
+        unresolved = set(names)
+        changes = {}
+        for rev in changelog.ancestors([self.revision], inclusive=True):
+            node = changelog.node(rev)
+            for f in changelog.read(node)[3]:
+                if not f.startswith(prefix):
+                    continue
+                name = f[len(prefix):].split('/', 1)[0]
+                if name in unresolved:
+                    unresolved.discard(name)
+                    changes[name] = hex(node)
+            if not unresolved:
+                break
+        return changes
+
     def get_node(self, path):
         """
         Returns ``Node`` object from the given ``path``. If there is no node at
@@ -336,10 +399,11 @@ class MercurialChangeset(BaseChangeset):
 
         path = self._fix_path(path)
 
-        if not path in self.nodes:
-            if path in self._file_paths:
+        node = self.nodes.get(path)
+        if node is None:
+            if self._dir_index.is_file(path):
                 node = FileNode(path, changeset=self)
-            elif path in self._dir_paths or path in self._dir_paths:
+            elif self._dir_index.is_dir(path):
                 if path == '':
                     node = RootNode(changeset=self)
                 else:
@@ -350,7 +414,7 @@ class MercurialChangeset(BaseChangeset):
                     % (path, self.short_id))
             # cache node
             self.nodes[path] = node
-        return self.nodes[path]
+        return node
 
     @LazyProperty
     def affected_files(self):
@@ -0,0 +1,87 @@
+# -*- coding: utf-8 -*-
+"""
+    vcs.backends.hg.dirindex
+    ~~~~~~~~~~~~~~~~~~~~~~~~
+
+    Directory index of Mercurial manifests.
+
+    :created_on: Oct 17, 2026
+    :copyright: (c) 2010-2011 by Marcin Kuzminski, Lukasz Balcerzak.
+"""
+
+
+class DirectoryIndex(object):
+    """
+    Maps each directory of a manifest to its subdirectories and files, so
+    directories may be listed without scanning all of manifest's files.
+    Index is built once per manifest and never modified, so it is shared by
+    all changesets with the same manifest.
+    """
+
+    def __init__(self, files):
+        """
+        :param files: paths of all files of the manifest
+        """
+        self.files = frozenset(files)
+        # directory -> (list of subdirectories, list of files)
+        self._children = {'': ([], [])}
+        # directory -> total size of its files, computed on demand
+        self._sizes = {}
+        children = self._children
+        for path in files:
+            head, sep, tail = path.rpartition('/')
+            entry = children.get(head)
+            if entry is None:
+                entry = children[head] = ([], [])
+                # register new directory within its parents
+                dir_path = head
+                while True:
+                    parent = dir_path.rpartition('/')[0]
+                    parent_entry = children.get(parent)
+                    if parent_entry is not None:
+                        parent_entry[0].append(dir_path)
+                        break
+                    children[parent] = ([dir_path], [])
+                    dir_path = parent
+            entry[1].append(path)
+
+    @property
+    def dirs(self):
+        """
+        Returns list of all directories' paths (including root, ``''``).
+        """
+        return self._children.keys()
+
+    def is_file(self, path):
+        return path in self.files
+
+    def is_dir(self, path):
+        return path in self._children
+
+    def get_children(self, path):
+        """
+        Returns tuple of lists of paths of subdirectories and files directly
+        within the directory at the given ``path``.
+
+        :raises ``KeyError``: if there is no such directory
+        """
+        dirs, files = self._children[path]
+        return list(dirs), list(files)
+
+    def get_size(self, path, get_file_size):
+        """
+        Returns total size of all files within the directory at the given
+        ``path`` (including its subdirectories). Totals are summed up from
+        directory's children and remembered, so sizes of files are read
+        once per manifest.
+
+        :param get_file_size: function returning size of file at given path
+        :raises ``KeyError``: if there is no such directory
+        """
+        size = self._sizes.get(path)
+        if size is None:
+            dirs, files = self._children[path]
+            size = sum(get_file_size(f) for f in files) + \
+                sum(self.get_size(d, get_file_size) for d in dirs)
+            self._sizes[path] = size
+        return size
@@ -39,6 +39,9 @@ class MercurialInMemoryChangeset(BaseInMemoryChangeset):
             branch = MercurialRepository.DEFAULT_BRANCH_NAME
         kwargs['branch'] = branch
 
+        removed = set(node.path for node in self.removed)
+        nodes = dict((node.path, node) for node in self.added + self.changed)
+
         def filectxfn(_repo, memctx, path):
             """
             Marks given path as added/changed/removed in a given _repo. This is
@@ -46,29 +49,19 @@ class MercurialInMemoryChangeset(BaseInMemoryChangeset):
             """
 
             # check if this path is removed
-            if path in (node.path for node in self.removed):
+            if path in removed:
                 # Raising exception is a way to mark node for removal
                 raise IOError(errno.ENOENT, '%s is deleted' % path)
 
-            # check if this path is added
-            for node in self.added:
-                if node.path == path:
-                    return memfilectx(path=node.path,
-                        data=(node.content.encode('utf8')
-                              if not node.is_binary else node.content),
-                        islink=False,
-                        isexec=node.is_executable,
-                        copied=False)
-
-            # or changed
-            for node in self.changed:
-                if node.path == path:
-                    return memfilectx(path=node.path,
-                        data=(node.content.encode('utf8')
-                              if not node.is_binary else node.content),
-                        islink=False,
-                        isexec=node.is_executable,
-                        copied=False)
+            # check if this path is added or changed
+            node = nodes.get(path)
+            if node is not None:
+                return memfilectx(path=node.path,
+                    data=(node.content.encode('utf8')
+                          if not node.is_binary else node.content),
+                    islink=False,
+                    isexec=node.is_executable,
+                    copied=False)
 
             raise RepositoryError("Given path haven't been marked as added,"
                                   "changed or removed (%s)" % path)
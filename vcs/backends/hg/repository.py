@@ -16,7 +16,10 @@ import urllib2
 import datetime
 
 
-from vcs.backends.base import BaseRepository, CollectionGenerator
+from vcs.backends.base import (
+    BaseRepository, CollectionGenerator, CommitGraph, CommitInfo,
+    RevisionList
+)
 from vcs.conf import settings
 
 from vcs.exceptions import (
@@ -27,6 +30,7 @@ from vcs.utils import (
     author_email, author_name, date_fromtimestamp, makedate, safe_unicode
 )
 from vcs.utils.lazy import LazyProperty
+from vcs.utils.lrucache import LRUCache
 from vcs.utils.ordered_dict import OrderedDict
 from vcs.utils.paths import abspath
 from vcs.utils.hgcompat import (
@@ -36,6 +40,7 @@ from vcs.utils.hgcompat import (
 )
 
 from .changeset import MercurialChangeset
+from .dirindex import DirectoryIndex
 from .inmemory import MercurialInMemoryChangeset
 from .workdir import MercurialWorkdir
 
@@ -71,6 +76,8 @@ class MercurialRepository(BaseRepository):
         self.baseui = baseui or ui.ui()
         # We've set path and ui, now we can set _repo itself
         self._repo = self._get_repo(create, src_url, update_after_clone)
+        self._branch_positions = {}
+        self._branch_positions_count = 0
 
     @property
     def _empty(self):
@@ -237,9 +244,63 @@ class MercurialRepository(BaseRepository):
                  self._repo._bookmarks.items()]
         return OrderedDict(sorted(_bookmarks, key=sortkey, reverse=True))
 
+    @LazyProperty
+    def _directory_indexes(self):
+        """
+        Returns ``LRUCache`` of ``DirectoryIndex`` objects keyed by manifest
+        node, so they are shared by changesets with the same manifest.
+        """
+        return LRUCache(max_entries=settings.HG_DIRECTORY_INDEX_CACHE_ENTRIES)
+
+    def _get_directory_index(self, ctx):
+        """
+        Returns ``DirectoryIndex`` of the manifest of given changeset
+        context.
+        """
+        key = ctx.manifestnode()
+        index = self._directory_indexes.get(key)
+        if index is None:
+            index = DirectoryIndex(list(ctx))
+            self._directory_indexes.set(key, index)
+        return index
+
+    @LazyProperty
+    def _commit_graph(self):
+        return CommitGraph()
+
+    def _get_commit_graph(self):
+        """
+        Returns ``CommitGraph`` of this repository, extended with revisions
+        which are not there yet (parents are taken from changelog's index).
+        """
+        graph = self._commit_graph
+        index = self._repo.changelog.index
+        for rev in xrange(len(graph), len(self.revisions)):
+            entry = index[rev]
+            graph.append([parent for parent in (entry[5], entry[6])
+                          if parent >= 0])
+        return graph
+
+    def _get_branch_positions(self, branch):
+        """
+        Returns sorted list of positions of changesets of given ``branch``.
+        Branches of all changesets are read once and kept at
+        ``_branch_positions`` (mapping of branch names to lists of
+        positions), which is extended whenever new changesets show up.
+        """
+        positions = self._branch_positions
+        changelog = self._repo.changelog
+        for rev in xrange(self._branch_positions_count, len(self.revisions)):
+            extra = changelog.read(changelog.node(rev))[5]
+            name = safe_unicode(extra.get('branch', 'default'))
+            positions.setdefault(name, []).append(rev)
+        self._branch_positions_count = len(self.revisions)
+        return positions.get(safe_unicode(branch), [])
+
     def _get_all_revisions(self):
 
-        return map(lambda x: hex(x[7]), self._repo.changelog.index)[:-1]
+        return RevisionList(map(lambda x: hex(x[7]),
+                                self._repo.changelog.index)[:-1])
 
     def get_diff(self, rev1, rev2, path='', ignore_whitespace=False,
                   context=3):
@@ -256,26 +317,29 @@ class MercurialRepository(BaseRepository):
         :param context: How many lines before/after changed lines should be
           shown. Defaults to ``3``.
         """
-        if hasattr(rev1, 'raw_id'):
-            rev1 = getattr(rev1, 'raw_id')
+        return ''.join(self.get_diff_iter(rev1, rev2, path=path,
+                                          ignore_whitespace=ignore_whitespace,
+                                          context=context))
 
-        if hasattr(rev2, 'raw_id'):
-            rev2 = getattr(rev2, 'raw_id')
-
-        # Check if given revisions are present at repository (may raise
-        # ChangesetDoesNotExistError)
-        if rev1 != self.EMPTY_CHANGESET:
-            self.get_changeset(rev1)
-        self.get_changeset(rev2)
+    def get_diff_iter(self, rev1, rev2, path='', ignore_whitespace=False,
+                      context=3):
+        """
+        Returns generator of chunks of the same *diff* as ``get_diff``,
+        yielded while mercurial produces them.
+        """
         if path:
             file_filter = match(self.path, '', [path])
         else:
             file_filter = None
 
-        return ''.join(patch.diff(self._repo, rev1, rev2, match=file_filter,
-                          opts=diffopts(git=True,
-                                        ignorews=ignore_whitespace,
-                                        context=context)))
+        def get_chunks(rev1, rev2):
+            return patch.diff(self._repo, rev1, rev2, match=file_filter,
+                              opts=diffopts(git=True,
+                                            ignorews=ignore_whitespace,
+                                            context=context))
+        # revisions are checked here (may raise ChangesetDoesNotExistError)
+        return self._get_cached_diff_iter(rev1, rev2, path, ignore_whitespace,
+                                          context, get_chunks)
 
     @classmethod
     def _check_url(cls, url):
@@ -456,6 +520,43 @@ class MercurialRepository(BaseRepository):
         changeset = MercurialChangeset(repository=self, revision=revision)
         return changeset
 
+    def get_changesets_bulk(self, revisions):
+        """
+        Returns list of ``MercurialChangeset`` objects for given
+        ``revisions``. Full ids are resolved directly against ``revisions``
+        without asking mercurial to look them up.
+        """
+        changesets = []
+        for revision in revisions:
+            if revision not in self.revisions:
+                revision = self._get_revision(revision)
+            changesets.append(MercurialChangeset(repository=self,
+                                                 revision=revision))
+        return changesets
+
+    def _get_commit_infos(self, revisions, authors):
+        """
+        Returns list of ``CommitInfo`` records for given ``revisions``, read
+        directly from the changelog.
+        """
+        changelog = self._repo.changelog
+        infos = []
+        for revision in revisions:
+            if isinstance(revision, (int, long)):
+                node = changelog.node(revision)
+            else:
+                node = self._repo.lookup(revision)
+            manifest, user, date, files, description, extra = \
+                changelog.read(node)
+            author = authors.get(user)
+            if author is None:
+                author = authors[user] = safe_unicode(user)
+            parents = tuple(hex(parent) for parent in changelog.parents(node)
+                            if parent != nullid)
+            infos.append(CommitInfo(hex(node), author, int(date[0]),
+                safe_unicode(description), parents))
+        return infos
+
     def get_changesets(self, start=None, end=None, start_date=None,
                        end_date=None, branch_name=None, reverse=False):
         """
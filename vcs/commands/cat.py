@@ -1,6 +1,7 @@
 import os
 from vcs.cli import make_option
 from vcs.cli import SingleChangesetCommand
+from vcs.utils.blame import get_annotate_changesets
 
 
 class CatCommand(SingleChangesetCommand):
@@ -59,8 +60,11 @@ class CatCommand(SingleChangesetCommand):
             lines = text.splitlines()
             output = []
             author_width = 15
+            annotate = node.annotate
+            changesets = get_annotate_changesets(node.changeset.repository,
+                                                 annotate)
             for line in xrange(len(lines)):
-                cs = node.annotate[line][1]
+                cs = changesets[annotate[line][1]]
                 output.append('%s |%s | %s' % (
                     cs.raw_id[:6],
                     cs.author[:14].rjust(author_width),
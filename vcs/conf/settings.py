@@ -23,6 +23,49 @@ DEFAULT_ENCODINGS = aslist('utf8')
 GIT_EXECUTABLE_PATH = 'git'
 # can be also --branches --tags
 GIT_REV_FILTER = '--all'
+# keep persistent index of revisions within git directory (vcs-revindex file)
+GIT_REVISION_INDEX = True
+# share opened dulwich repositories between repository objects of same path
+GIT_REPO_POOL = False
+GIT_REPO_POOL_SIZE = 32
+# limits of cache of git trees and small blobs kept by each repository;
+# blobs bigger than GIT_OBJECT_CACHE_BLOB_SIZE bytes are never cached
+GIT_OBJECT_CACHE_ENTRIES = 10000
+GIT_OBJECT_CACHE_SIZE = 16 * 1024 * 1024
+GIT_OBJECT_CACHE_BLOB_SIZE = 64 * 1024
+# number of remembered sizes of git blobs and trees
+GIT_SIZE_CACHE_ENTRIES = 100000
+# how changesets read git objects: 'dulwich' or 'cat-file' (long running
+# git cat-file --batch processes, stopped after given idle timeout in seconds)
+GIT_OBJECT_READER = 'dulwich'
+GIT_CAT_FILE_IDLE_TIMEOUT = 60
+# how git commands' pipes are handled: 'threads' (separate thread for each
+# pipe) or 'select' (poll within calling thread; POSIX only, treats only non 0
+# exit status as failure)
+GIT_SUBPROCESS_ENGINE = 'threads'
+# number of seconds after which git commands are killed (None means no limit;
+# only supported by 'select' engine)
+GIT_COMMAND_TIMEOUT = None
+# in-memory commits writing more objects than that are stored as single pack
+GIT_COMMIT_PACK_LIMIT = 100
+
+# number of directory indexes of manifests cached by each hg repository
+HG_DIRECTORY_INDEX_CACHE_ENTRIES = 32
+
+# number of worker threads of vcs.backends.asyncrepo default pool
+ASYNC_WORKERS = 4
+
+# number of file histories cached by each repository
+FILE_HISTORY_CACHE_ENTRIES = 1000
+
+# maximal total number of lines of file annotations cached by each repository
+ANNOTATE_CACHE_SIZE = 1000000
+
+# directory of persistent cache of diffs shared by processes (None disables
+# it), maximal total size of its entries and maximal size of single diff
+DIFF_CACHE_PATH = None
+DIFF_CACHE_SIZE = 256 * 1024 * 1024
+DIFF_CACHE_ENTRY_SIZE = 8 * 1024 * 1024
 
 BACKENDS = {
     'hg': 'vcs.backends.hg.MercurialRepository',
@@ -35,3 +78,8 @@ ARCHIVE_SPECS = {
     'tgz': ('application/x-gzip', '.tar.gz'),
     'zip': ('application/zip', '.zip'),
 }
+ARCHIVE_COMPRESSION_LEVEL = 6
+ARCHIVE_COMPRESSION_THREADS = None
+ARCHIVE_COMPRESSION_BLOCK_SIZE = 128 * 1024
+ARCHIVE_STORED_EXTENSIONS = frozenset(['.7z', '.bz2', '.gif', '.gz', '.jar',
+    '.jpeg', '.jpg', '.mp3', '.mp4', '.png', '.rar', '.tgz', '.xz', '.zip'])
@@ -17,7 +17,7 @@ from pygments import lexers
 
 from vcs.backends.base import EmptyChangeset
 from vcs.exceptions import NodeError, RemovedFileNodeError
-from vcs.utils.lazy import LazyProperty
+from vcs.utils.lazy import LazySlot, lazy_slots
 from vcs.utils import safe_unicode
 
 
@@ -98,6 +98,9 @@ class Node(object):
     only. Moreover, every single node is identified by the ``path`` attribute,
     so it cannot end with slash, too. Otherwise, path could lead to mistakes.
     """
+    __slots__ = ('path', '_kind', 'changeset', '__weakref__') + lazy_slots(
+        'parent', 'unicode_path', 'name', 'added', 'changed', 'not_changed',
+        'removed', 'state')
 
     def __init__(self, path, kind):
         if path.startswith('/'):
@@ -112,7 +115,23 @@ class Node(object):
         if self.is_root() and not self.is_dir():
             raise NodeError("Root node cannot be FILE kind")
 
-    @LazyProperty
+    def __getstate__(self):
+        """
+        Returns dict of filled slots (including calculated lazy attributes),
+        as nodes have no ``__dict__`` to be pickled.
+        """
+        state = {}
+        for klass in type(self).__mro__:
+            for name in getattr(klass, '__slots__', ()):
+                if name != '__weakref__' and hasattr(self, name):
+                    state[name] = getattr(self, name)
+        return state
+
+    def __setstate__(self, state):
+        for name, value in state.iteritems():
+            setattr(self, name, value)
+
+    @LazySlot
     def parent(self):
         parent_path = self.get_parent_path()
         if parent_path:
@@ -121,11 +140,11 @@ class Node(object):
             return DirNode(parent_path)
         return None
 
-    @LazyProperty
+    @LazySlot
     def unicode_path(self):
         return safe_unicode(self.path)
 
-    @LazyProperty
+    @LazySlot
     def name(self):
         """
         Returns name of the node so if its path
@@ -218,19 +237,19 @@ class Node(object):
         """
         return self.kind == NodeKind.SUBMODULE
 
-    @LazyProperty
+    @LazySlot
     def added(self):
         return self.state is NodeState.ADDED
 
-    @LazyProperty
+    @LazySlot
     def changed(self):
         return self.state is NodeState.CHANGED
 
-    @LazyProperty
+    @LazySlot
     def not_changed(self):
         return self.state is NodeState.NOT_CHANGED
 
-    @LazyProperty
+    @LazySlot
     def removed(self):
         return self.state is NodeState.REMOVED
 
@@ -244,6 +263,9 @@ class FileNode(Node):
     :attribute: changeset: if given, first time content is accessed, callback
     :attribute: mode: octal stat mode for a node. Default is 0100644.
     """
+    __slots__ = ('_content', '_mode', '_mimetype') + lazy_slots('mode',
+        'size', 'message', 'last_changeset', 'mimetype', 'mimetype_main',
+        'lexer', 'lexer_alias', 'history', 'annotate', 'extension')
 
     def __init__(self, path, content=None, changeset=None, mode=None):
         """
@@ -263,7 +285,7 @@ class FileNode(Node):
         self._content = content
         self._mode = mode or 0100644
 
-    @LazyProperty
+    @LazySlot
     def mode(self):
         """
         Returns lazily mode of the FileNode. If ``changeset`` is not set, would
@@ -294,21 +316,21 @@ class FileNode(Node):
             return content
         return safe_unicode(content)
 
-    @LazyProperty
+    @LazySlot
     def size(self):
         if self.changeset:
             return self.changeset.get_file_size(self.path)
         raise NodeError("Cannot retrieve size of the file without related "
             "changeset attribute")
 
-    @LazyProperty
+    @LazySlot
     def message(self):
         if self.changeset:
             return self.last_changeset.message
         raise NodeError("Cannot retrieve message of the file without related "
             "changeset attribute")
 
-    @LazyProperty
+    @LazySlot
     def last_changeset(self):
         if self.changeset:
             return self.changeset.get_file_changeset(self.path)
@@ -341,7 +363,7 @@ class FileNode(Node):
                 encoding = None
         return mtype, encoding
 
-    @LazyProperty
+    @LazySlot
     def mimetype(self):
         """
         Wrapper around full mimetype info. It returns only type of fetched
@@ -350,11 +372,11 @@ class FileNode(Node):
         """
         return self.get_mimetype()[0]
 
-    @LazyProperty
+    @LazySlot
     def mimetype_main(self):
         return self.mimetype.split('/')[0]
 
-    @LazyProperty
+    @LazySlot
     def lexer(self):
         """
         Returns pygment's lexer class. Would try to guess lexer taking file's
@@ -368,14 +390,14 @@ class FileNode(Node):
         # returns first alias
         return lexer
 
-    @LazyProperty
+    @LazySlot
     def lexer_alias(self):
         """
         Returns first alias of the lexer guessed for this file.
         """
         return self.lexer.aliases[0]
 
-    @LazyProperty
+    @LazySlot
     def history(self):
         """
         Returns a list of changeset for this file in which the file was changed
@@ -384,16 +406,16 @@ class FileNode(Node):
             raise NodeError('Unable to get changeset for this FileNode')
         return self.changeset.get_file_history(self.path)
 
-    @LazyProperty
+    @LazySlot
     def annotate(self):
         """
         Returns a list of three element tuples with lineno,changeset and line
         """
         if self.changeset is None:
             raise NodeError('Unable to get changeset for this FileNode')
-        return self.changeset.get_file_annotate(self.path)
+        return list(self.changeset.get_file_annotate(self.path))
 
-    @LazyProperty
+    @LazySlot
     def state(self):
         if not self.changeset:
             raise NodeError("Cannot check state of the node if it's not "
@@ -413,7 +435,7 @@ class FileNode(Node):
         _bin = '\0' in self._get_content()
         return _bin
 
-    @LazyProperty
+    @LazySlot
     def extension(self):
         """Returns filenode extension"""
         return self.name.split('.')[-1]
@@ -435,6 +457,8 @@ class RemovedFileNode(FileNode):
     name, kind or state (or methods/attributes checking those two) would raise
     RemovedFileNodeError.
     """
+    __slots__ = ()
+
     ALLOWED_ATTRIBUTES = [
         'name', 'path', 'state', 'is_root', 'is_file', 'is_dir', 'kind',
         'added', 'changed', 'not_changed', 'removed'
@@ -452,7 +476,7 @@ class RemovedFileNode(FileNode):
         raise RemovedFileNodeError("Cannot access attribute %s on "
             "RemovedFileNode" % attr)
 
-    @LazyProperty
+    @LazySlot
     def state(self):
         return NodeState.REMOVED
 
@@ -463,6 +487,9 @@ class DirNode(Node):
     Nodes may be used standalone but within repository context they
     lazily fetch data within same repositorty's changeset.
     """
+    # ``last_changeset`` is set by ``get_nodes_with_last_changes``
+    __slots__ = ('_nodes', '_nodes_dict', 'last_changeset') + lazy_slots(
+        'content', 'nodes', 'files', 'dirs', 'size')
 
     def __init__(self, path, nodes=(), changeset=None):
         """
@@ -480,12 +507,12 @@ class DirNode(Node):
         self.changeset = changeset
         self._nodes = nodes
 
-    @LazyProperty
+    @LazySlot
     def content(self):
         raise NodeError("%s represents a dir and has no ``content`` attribute"
             % self)
 
-    @LazyProperty
+    @LazySlot
     def nodes(self):
         if self.changeset:
             nodes = self.changeset.get_nodes(self.path)
@@ -494,11 +521,11 @@ class DirNode(Node):
         self._nodes_dict = dict((node.path, node) for node in nodes)
         return sorted(nodes)
 
-    @LazyProperty
+    @LazySlot
     def files(self):
         return sorted((node for node in self.nodes if node.is_file()))
 
-    @LazyProperty
+    @LazySlot
     def dirs(self):
         return sorted((node for node in self.nodes if node.is_dir()))
 
@@ -548,18 +575,13 @@ class DirNode(Node):
         except KeyError:
             raise NodeError("Node does not exist at %s" % path)
 
-    @LazyProperty
+    @LazySlot
     def state(self):
         raise NodeError("Cannot access state of DirNode")
 
-    @LazyProperty
+    @LazySlot
     def size(self):
-        size = 0
-        for root, dirs, files in self.changeset.walk(self.path):
-            for f in files:
-                size += f.size
-
-        return size
+        return self.changeset.get_dir_size(self.path)
 
     def __repr__(self):
         return '<%s %r @ %s>' % (self.__class__.__name__, self.path,
@@ -570,6 +592,7 @@ class RootNode(DirNode):
     """
     DirNode being the root node of the repository.
     """
+    __slots__ = ()
 
     def __init__(self, nodes=(), changeset=None):
         super(RootNode, self).__init__(path='', nodes=nodes,
@@ -583,6 +606,8 @@ class SubModuleNode(Node):
     """
     represents a SubModule of Git or SubRepo of Mercurial
     """
+    __slots__ = ('alias', 'url')
+
     is_binary = False
     size = 0
 
@@ -607,7 +632,7 @@ class SubModuleNode(Node):
         if self.alias == 'hg':
             return self.path
 
-    @LazyProperty
+    @LazySlot
     def name(self):
         """
         Returns name of the node so if its path
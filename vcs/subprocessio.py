@@ -23,9 +23,18 @@ along with git_http_backend.py Project.
 If not, see <http://www.gnu.org/licenses/>.
 '''
 import os
+import time
+import errno
+import select
 import subprocess
 from vcs.utils.compat import deque, Event, Thread, _bytes, _bytearray
 
+try:
+    import fcntl
+except ImportError:
+    # SelectIOChunker is not available on Windows
+    fcntl = None
+
 
 class StreamFeeder(Thread):
     """
@@ -413,3 +422,269 @@ class SubprocessIOChunker(object):
 
     def __del__(self):
         self.close()
+
+
+class SelectIOChunker(object):
+    '''
+    Alternative to SubprocessIOChunker which does not start any threads.
+    All the pipes (stdin, stdout and stderr) are serviced by the thread which
+    creates or iterates the object, using poll (or select where poll is not
+    available).
+
+    The contract is the same: the initializer runs the command and reads
+    its output until either internal buffer is full or the output ends. If
+    the command failed by then, EnvironmentError is raised. Otherwise the
+    object is an iterator over the output chunks, fit to be returned by a
+    WSGI application. Failure detected later is raised (as EnvironmentError)
+    while iterating.
+
+    Additionally:
+
+    - process is killed and EnvironmentError raised once ``timeout`` (in
+      seconds, counted from the start of the command) passes
+    - number of bytes written to the process and read from its stdout and
+      stderr is kept at ``bytes_in``, ``bytes_out`` and ``bytes_err``
+    - only non 0 return code is considered a failure; output at stderr is
+      not an error by itself
+    '''
+
+    # max number of bytes kept from stderr
+    error_buffer_size = 65536
+
+    def __init__(self, cmd, inputstream=None, buffer_size=65536,
+                 chunk_size=4096, starting_values=[], timeout=None, **kwargs):
+        '''
+        Initializes SelectIOChunker
+
+        :param cmd: A Subprocess.Popen style "cmd". Can be string or array of strings
+        :param inputstream: (Default: None) A file-like, string, or file pointer.
+        :param buffer_size: (Default: 65536) A size of output buffer in bytes.
+        :param chunk_size: (Default: 4096) A max size of a chunk. Actual chunk may be smaller.
+        :param starting_values: (Default: []) An array of strings to put in front of output que.
+        :param timeout: (Default: None) Number of seconds after which the command is killed.
+        '''
+        self.chunk_size = chunk_size
+        self.timeout = timeout
+        self.bytes_in = self.bytes_out = self.bytes_err = 0
+        self.data = deque(starting_values)
+        self.errors = []
+        self._buffered = sum(len(value) for value in starting_values)
+        self._input = None
+        self._input_offset = 0
+        self._input_pending = ''
+        self._fds = {}
+        self.process = None
+        if timeout:
+            self._deadline = time.time() + timeout
+        else:
+            self._deadline = None
+
+        stdin = None
+        if type(inputstream) in (int, long):  # file descriptor
+            stdin = inputstream
+        elif inputstream:
+            if not (isinstance(inputstream, (str, _bytes, _bytearray)) or
+                    hasattr(inputstream, 'read')):
+                raise TypeError("Input stream must be a readable file-like, "
+                                "a file descriptor, or a string-like.")
+            stdin = subprocess.PIPE
+            self._input = inputstream
+
+        if isinstance(cmd, (list, tuple)):
+            cmd = ' '.join(cmd)
+
+        _shell = kwargs.get('shell') or True
+        kwargs['shell'] = _shell
+        self.process = _p = subprocess.Popen(cmd,
+            bufsize=-1,
+            stdin=stdin,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            **kwargs
+            )
+
+        for name, pipe in (('in', _p.stdin), ('out', _p.stdout),
+                           ('err', _p.stderr)):
+            if pipe is None:
+                continue
+            fd = pipe.fileno()
+            flags = fcntl.fcntl(fd, fcntl.F_GETFL)
+            fcntl.fcntl(fd, fcntl.F_SETFL, flags | os.O_NONBLOCK)
+            self._fds[fd] = name
+        self._fd_out = _p.stdout.fileno()
+
+        while self._fd_out in self._fds and self._buffered < buffer_size:
+            self._pump()
+
+        if self._fd_out not in self._fds:
+            # whole output has been read already
+            self._finish()
+
+    def __iter__(self):
+        return self
+
+    @property
+    def output(self):
+        return self
+
+    @property
+    def error(self):
+        return self.errors
+
+    def next(self):
+        while not self.data and self._fd_out in self._fds:
+            self._pump()
+        if self.data:
+            chunk = self.data.popleft()
+            self._buffered -= len(chunk)
+            return chunk
+        self._finish()
+        raise StopIteration
+
+    def throw(self, type, value=None, traceback=None):
+        if self.data or self._fd_out in self._fds:
+            raise type(value)
+
+    def close(self):
+        for fd in self._fds.keys():
+            self._close_fd(fd)
+        if self.process is not None and self.process.poll() is None:
+            try:
+                self.process.kill()
+                self.process.wait()
+            except OSError:
+                pass
+
+    def __del__(self):
+        self.close()
+
+    def _fail(self, msg):
+        self.close()
+        raise EnvironmentError(msg)
+
+    def _finish(self):
+        '''
+        Reads the rest of stderr and waits for the process; raises
+        EnvironmentError if it has failed.
+        '''
+        while self._fds:
+            self._pump()
+        if self._deadline is None:
+            self.process.wait()
+        else:
+            # Popen.wait has no timeout, so poll with growing delays
+            delay = 0.001
+            while self.process.poll() is None:
+                remaining = self._deadline - time.time()
+                if remaining <= 0:
+                    self._fail("Subprocess timed out after %s seconds"
+                               % self.timeout)
+                time.sleep(min(delay, remaining))
+                delay = min(delay * 2, 0.05)
+        _returncode = self.process.returncode
+        if _returncode:
+            err = ''.join(self.errors)
+            if err:
+                self._fail("Subprocess exited due to an error:\n" + err)
+            self._fail("Subprocess exited with non 0 ret code:%s"
+                       % _returncode)
+
+    def _close_fd(self, fd):
+        name = self._fds.pop(fd)
+        pipe = {'in': self.process.stdin, 'out': self.process.stdout,
+                'err': self.process.stderr}[name]
+        try:
+            pipe.close()
+        except (IOError, OSError):
+            pass
+
+    def _pump(self):
+        '''
+        Waits until any of the pipes is ready and services it.
+        '''
+        timeout = None
+        if self._deadline is not None:
+            timeout = self._deadline - time.time()
+            if timeout <= 0:
+                self._fail("Subprocess timed out after %s seconds"
+                           % self.timeout)
+        ready = _wait_for_fds(self._fds, timeout)
+        for fd in ready:
+            name = self._fds.get(fd)
+            if name == 'in':
+                self._write_input(fd)
+            elif name is not None:
+                self._read_output(fd, name)
+
+    def _write_input(self, fd):
+        if not self._input_pending:
+            source = self._input
+            if hasattr(source, 'read'):
+                self._input_pending = source.read(4096)
+            else:
+                self._input_pending = _bytes(source[self._input_offset:
+                                                    self._input_offset + 4096])
+                self._input_offset += len(self._input_pending)
+        if not self._input_pending:
+            # end of input
+            self._close_fd(fd)
+            return
+        try:
+            written = os.write(fd, self._input_pending)
+        except OSError, err:
+            if err.errno == errno.EAGAIN:
+                return
+            # process doesn't want any more input (i.e. has exited)
+            self._close_fd(fd)
+            return
+        self.bytes_in += written
+        self._input_pending = self._input_pending[written:]
+
+    def _read_output(self, fd, name):
+        try:
+            data = os.read(fd, self.chunk_size)
+        except OSError, err:
+            if err.errno == errno.EAGAIN:
+                return
+            data = ''
+        if not data:
+            self._close_fd(fd)
+        elif name == 'out':
+            self.bytes_out += len(data)
+            self._buffered += len(data)
+            self.data.append(data)
+        else:
+            self.bytes_err += len(data)
+            if self.bytes_err - len(data) < self.error_buffer_size:
+                self.errors.append(data)
+
+
+def _wait_for_fds(fds, timeout=None):
+    '''
+    Returns list of ready descriptors out of ``fds`` dict (mapping
+    descriptors to "in", "out" or "err"). Waits at most ``timeout`` seconds.
+    '''
+    if hasattr(select, 'poll'):
+        poller = select.poll()
+        for fd, name in fds.iteritems():
+            if name == 'in':
+                poller.register(fd, select.POLLOUT)
+            else:
+                poller.register(fd, select.POLLIN | select.POLLPRI)
+        if timeout is not None:
+            timeout = int(timeout * 1000) + 1
+        while True:
+            try:
+                return [fd for fd, event in poller.poll(timeout)]
+            except select.error, err:
+                if err.args[0] != errno.EINTR:
+                    raise
+    rlist = [fd for fd, name in fds.iteritems() if name != 'in']
+    wlist = [fd for fd, name in fds.iteritems() if name == 'in']
+    while True:
+        try:
+            r, w, x = select.select(rlist, wlist, [], timeout)
+            return r + w
+        except select.error, err:
+            if err.args[0] != errno.EINTR:
+                raise
@@ -1,15 +1,24 @@
 from __future__ import with_statement
 
 import os
+import gzip
+import zlib
 import tarfile
 import zipfile
 import datetime
 import tempfile
+import threading
 import StringIO
+import mock
 from vcs.tests.base import BackendTestMixin
 from vcs.tests.conf import SCM_TESTS
 from vcs.exceptions import VCSError
+from vcs.conf import settings
 from vcs.nodes import FileNode
+from vcs.utils import archivers
+from vcs.utils.archivers import (
+    ChunkBuffer, Deflater, GzipCompressor, get_archiver
+)
 from vcs.utils.compat import unittest
 
 
@@ -83,10 +92,70 @@ class ArchivesTestCaseMixin(BackendTestMixin):
         with open(tmppath, 'r') as f:
             self.assertEqual(f.read(), mystream.read())
 
+    def test_archive_stored_zip(self):
+        stream = StringIO.StringIO()
+        self.tip.fill_archive(stream=stream, kind='zip', prefix='repo',
+                              level=0)
+        out = zipfile.ZipFile(stream)
+        for info in out.infolist():
+            self.assertEqual(info.compress_type, zipfile.ZIP_STORED)
+        self.assertEqual(out.read('repo/0/file_0.txt'), 'Foobar 0')
+
+    def test_archive_parallel_tgz(self):
+        stream = StringIO.StringIO()
+        with mock.patch.object(settings, 'ARCHIVE_COMPRESSION_BLOCK_SIZE', 64):
+            self.tip.fill_archive(stream=stream, kind='tgz', prefix='repo',
+                                  threads=4)
+        stream.seek(0)
+        outfile = tarfile.open(fileobj=stream, mode='r:gz')
+        for x in xrange(5):
+            node_path = 'repo/%d/file_%d.txt' % (x, x)
+            self.assertEqual(outfile.extractfile(node_path).read(),
+                             'Foobar %d' % x)
+
     def test_archive_wrong_kind(self):
         with self.assertRaises(VCSError):
             self.tip.fill_archive(kind='wrong kind')
 
+    def test_chunked_archive(self):
+        stream = StringIO.StringIO()
+        self.tip.fill_archive(stream=stream, kind='tgz', prefix='repo')
+        chunks = list(self.tip.get_chunked_archive(kind='tgz', prefix='repo',
+                                                   chunk_size=100))
+        self.assertTrue(all(len(chunk) == 100 for chunk in chunks[:-1]))
+        self.assertEqual(''.join(chunks), stream.getvalue())
+
+    def test_chunked_archive_is_produced_while_walking_tree(self):
+        walked = []
+        entries = self.tip._iter_archive_entries
+
+        def iter_entries(subrepos=False):
+            for entry in entries(subrepos):
+                walked.append(entry[0])
+                yield entry
+
+        with mock.patch.object(self.tip, '_iter_archive_entries',
+                               iter_entries):
+            chunks = self.tip.get_chunked_archive(kind='tar', chunk_size=512)
+            self.assertEqual(walked, [])
+            chunks.next()
+            self.assertEqual(len(walked), 1)
+
+    def test_chunked_archive_closed_early_stops_threads(self):
+        threads = threading.active_count()
+        with mock.patch.object(settings, 'ARCHIVE_COMPRESSION_BLOCK_SIZE', 64):
+            for x in xrange(3):
+                chunks = self.tip.get_chunked_archive(kind='tgz', threads=4,
+                                                      chunk_size=1)
+                chunks.next()
+                self.assertTrue(threading.active_count() > threads)
+                chunks.close()
+        self.assertEqual(threading.active_count(), threads)
+
+    def test_chunked_archive_wrong_kind(self):
+        with self.assertRaises(VCSError):
+            self.tip.get_chunked_archive(kind='wrong kind')
+
     def test_archive_empty_prefix(self):
         with self.assertRaises(VCSError):
             self.tip.fill_archive(prefix='')
@@ -95,6 +164,96 @@ class ArchivesTestCaseMixin(BackendTestMixin):
         with self.assertRaises(VCSError):
             self.tip.fill_archive(prefix='/any')
 
+class ArchiversTest(unittest.TestCase):
+
+    def test_parallel_deflate(self):
+        data = ''.join('line %d\n' % x for x in xrange(20000))
+        for threads in (1, 3):
+            deflater = Deflater(level=6, threads=threads, block_size=1000)
+            chunks = [deflater.compress(data[x:x + 777])
+                      for x in xrange(0, len(data), 777)]
+            chunks.append(deflater.flush())
+            self.assertEqual(
+                zlib.decompress(''.join(chunks), -zlib.MAX_WBITS), data)
+
+    def test_gzip(self):
+        data = 'foo bar\n' * 1000
+        compressor = GzipCompressor(level=9, threads=2, mtime=1000)
+        compressed = compressor.compress(data) + compressor.flush()
+        out = gzip.GzipFile(fileobj=StringIO.StringIO(compressed))
+        self.assertEqual(out.read(), data)
+        self.assertEqual(out.mtime, 1000)
+
+    def test_tar_entries(self):
+        stream = StringIO.StringIO()
+        archiver = get_archiver('tar', stream, prefix='repo', mtime=1000)
+        archiver.addfile('bin/run', 0100755, '#!/bin/sh\n')
+        archiver.addfile('link', 0120000, 'bin/run')
+        archiver.addfile('sub', 0160000, '')
+        archiver.close()
+        self.assertEqual(len(stream.getvalue()) % tarfile.RECORDSIZE, 0)
+        stream.seek(0)
+        members = dict((m.name, m) for m in tarfile.open(fileobj=stream))
+        self.assertEqual(members['repo/bin/run'].mode, 0755)
+        self.assertEqual(members['repo/bin/run'].mtime, 1000)
+        self.assertTrue(members['repo/link'].issym())
+        self.assertEqual(members['repo/link'].linkname, 'bin/run')
+        self.assertTrue(members['repo/sub'].isdir())
+
+    def test_zip_stores_compressed_files(self):
+        stream = StringIO.StringIO()
+        archiver = get_archiver('zip', stream, level=9)
+        archiver.addfile('image.png', 0100644, 'x' * 100)
+        archiver.addfile('text.txt', 0100644, 'x' * 100)
+        archiver.close()
+        out = zipfile.ZipFile(stream)
+        self.assertEqual(out.getinfo('image.png').compress_type,
+                         zipfile.ZIP_STORED)
+        self.assertEqual(out.getinfo('text.txt').compress_type,
+                         zipfile.ZIP_DEFLATED)
+        self.assertEqual(out.read('text.txt'), 'x' * 100)
+
+    def test_zip_entries_share_compressing_threads(self):
+        threads = threading.active_count()
+        stream = StringIO.StringIO()
+        with mock.patch.object(settings, 'ARCHIVE_COMPRESSION_BLOCK_SIZE',
+                               100):
+            with mock.patch.object(archivers, 'ThreadPool',
+                                   wraps=archivers.ThreadPool) as pool:
+                archiver = get_archiver('zip', stream, threads=3)
+                for x in xrange(5):
+                    archiver.addfile('file_%d' % x, 0100644, 'foo %d\n' % x
+                                     * 100)
+                archiver.close()
+        self.assertEqual(pool.call_count, 1)
+        self.assertEqual(threading.active_count(), threads)
+        out = zipfile.ZipFile(stream)
+        self.assertEqual(out.read('file_3'), 'foo 3\n' * 100)
+
+    def test_abort_stops_compressing_threads(self):
+        threads = threading.active_count()
+        with mock.patch.object(settings, 'ARCHIVE_COMPRESSION_BLOCK_SIZE',
+                               100):
+            archiver = get_archiver('tgz', StringIO.StringIO(), threads=3)
+            archiver.addfile('file', 0100644, 'foo\n' * 1000)
+        self.assertTrue(threading.active_count() > threads)
+        archiver.abort()
+        self.assertEqual(threading.active_count(), threads)
+
+    def test_wrong_kind(self):
+        with self.assertRaises(VCSError):
+            get_archiver('rar', StringIO.StringIO())
+
+    def test_chunk_buffer(self):
+        buf = ChunkBuffer()
+        buf.write('abc')
+        buf.write('defgh')
+        self.assertEqual(list(buf.iter_chunks(3)), ['abc', 'def'])
+        buf.write('ij')
+        self.assertEqual(list(buf.iter_chunks(3, flush=True)), ['ghi', 'j'])
+        self.assertEqual(buf.size, 0)
+
+
 # For each backend create test case class
 for alias in SCM_TESTS:
     attrs = {
@@ -1,19 +1,23 @@
 from __future__ import with_statement
 
+import gc
+import mock
 import datetime
 import vcs
 from vcs.tests.base import BackendTestMixin
 from vcs.tests.conf import SCM_TESTS
 
-from vcs.backends.base import BaseChangeset
+from vcs.backends.base import BaseChangeset, CommitInfo
 from vcs.nodes import (
     FileNode, AddedFileNodesGenerator,
     ChangedFileNodesGenerator, RemovedFileNodesGenerator
 )
 from vcs.exceptions import (
-    BranchDoesNotExistError, ChangesetDoesNotExistError,
+    BranchDoesNotExistError, ChangesetDoesNotExistError, ChangesetError,
     RepositoryError
 )
+from vcs.utils.annotate import annotate_highlight
+from vcs.utils.blame import get_annotate_changesets, get_matching_blocks
 from vcs.utils.compat import unittest
 
 
@@ -124,6 +128,128 @@ class ChangesetsWithCommitsTestCaseixin(BackendTestMixin):
             branch_name=self.repo.DEFAULT_BRANCH_NAME)
         self.assertNotIn(doc_changeset, default_branch_changesets)
 
+    def test_children_and_parents(self):
+        tip = self.repo.get_changeset()
+        self.imc.add(vcs.nodes.FileNode('docs/index.txt',
+            content='Documentation\n'))
+        foobar_tip = self.imc.commit(
+            message=u'New branch: foobar',
+            author=u'joe',
+            branch='foobar',
+            parents=[tip],
+        )
+        self.imc.add(vcs.nodes.FileNode('newfile', content=''))
+        default_tip = self.imc.commit(
+            message=u'Back in default branch',
+            author=u'joe',
+            parents=[tip],
+        )
+        merge = self.imc.commit(
+            message=u'Merged foobar',
+            author=u'joe',
+            parents=[default_tip, foobar_tip],
+        )
+        self.assertEqual(sorted(cs.raw_id for cs in tip.children),
+            sorted([foobar_tip.raw_id, default_tip.raw_id]))
+        self.assertEqual([cs.raw_id for cs in merge.parents],
+            [default_tip.raw_id, foobar_tip.raw_id])
+        self.assertEqual([cs.raw_id for cs in foobar_tip.children],
+            [merge.raw_id])
+        self.assertEqual(merge.children, [])
+
+    def test_file_history(self):
+        first = self.repo.get_changeset(0)
+        self.imc.change(vcs.nodes.FileNode('file_0.txt', content='Changed'))
+        changed = self.imc.commit(message=u'Changed file_0', author=u'joe')
+        self.imc.add(vcs.nodes.FileNode('newfile', content=''))
+        tip = self.imc.commit(message=u'Added newfile', author=u'joe')
+        self.assertEqual(
+            [cs.raw_id for cs in tip.get_file_history('file_0.txt')],
+            [changed.raw_id, first.raw_id])
+        self.assertEqual(
+            [cs.raw_id for cs in tip.get_file_history('file_0.txt', 1)],
+            [changed.raw_id])
+        self.assertEqual(
+            [cs.raw_id for cs in tip.iter_file_history('newfile')],
+            [tip.raw_id])
+        self.assertEqual(tip.get_file_changeset('file_1.txt').raw_id,
+            self.repo.revisions[1])
+
+    def test_file_history_is_cached(self):
+        tip = self.repo.get_changeset()
+        history = [cs.raw_id for cs in tip.get_file_history('file_0.txt')]
+        # walking history again would yield nothing
+        with mock.patch.object(tip.__class__, '_walk_file_history',
+                               return_value=iter([])):
+            self.assertEqual(history,
+                [cs.raw_id for cs in tip.get_file_history('file_0.txt')])
+            self.assertEqual(history[:1],
+                [cs.raw_id for cs in tip.get_file_history('file_0.txt', 1)])
+        self.imc.change(vcs.nodes.FileNode('file_0.txt', content='Changed'))
+        changed = self.imc.commit(message=u'Changed file_0', author=u'joe')
+        self.assertEqual([changed.raw_id] + history,
+            [cs.raw_id for cs in changed.get_file_history('file_0.txt')])
+
+    def test_get_nodes_with_last_changes(self):
+        self.imc.add(vcs.nodes.FileNode('docs/index.txt', content='Docs'))
+        docs = self.imc.commit(message=u'Added docs', author=u'joe')
+        self.imc.change(vcs.nodes.FileNode('file_1.txt', content='Changed'))
+        tip = self.imc.commit(message=u'Changed file_1', author=u'joe')
+        last_changes = dict((node.path, changeset.raw_id)
+            for node, changeset in tip.get_nodes_with_last_changes(''))
+        self.assertEqual(last_changes, {
+            'docs': docs.raw_id,
+            'file_0.txt': self.repo.revisions[0],
+            'file_1.txt': tip.raw_id,
+            'file_2.txt': self.repo.revisions[2],
+            'file_3.txt': self.repo.revisions[3],
+            'file_4.txt': self.repo.revisions[4],
+        })
+        node, changeset = tip.get_nodes_with_last_changes('docs')[0]
+        self.assertEqual(node.path, 'docs/index.txt')
+        self.assertEqual(node.last_changeset.raw_id, docs.raw_id)
+
+    def test_nodes_last_changes_are_cached(self):
+        tip = self.repo.get_changeset()
+        nodes = tip.get_nodes_with_last_changes('')
+        with mock.patch.object(tip.__class__, '_find_last_changes') as find:
+            self.assertEqual(
+                [(node.path, cs.raw_id) for node, cs in nodes],
+                [(node.path, cs.raw_id) for node, cs
+                 in tip.get_nodes_with_last_changes('')])
+        self.assertFalse(find.called)
+
+    def test_dir_size(self):
+        self.imc.add(vcs.nodes.FileNode('docs/index.txt', content='Docs'))
+        self.imc.add(vcs.nodes.FileNode('docs/api/x.txt', content='API'))
+        tip = self.imc.commit(message=u'Added docs', author=u'joe')
+        self.assertEqual(tip.get_dir_size('docs/api'), 3)
+        self.assertEqual(tip.get_node('docs').size, 7)
+        self.assertEqual(tip.size, 5 * len('Foobar N') + 7)
+        self.assertEqual(self.repo.size, tip.size)
+        self.assertRaises(ChangesetError, tip.get_dir_size, 'file_0.txt')
+
+    def test_next_and_prev(self):
+        first = self.repo.get_changeset(0)
+        self.assertEqual(first.next().raw_id, self.repo.revisions[1])
+        self.assertEqual(first.next().prev().raw_id, first.raw_id)
+        self.assertRaises(ChangesetDoesNotExistError, first.prev)
+        self.assertRaises(ChangesetDoesNotExistError,
+            self.repo.get_changeset().next)
+
+    def test_next_by_branch(self):
+        self.imc.add(vcs.nodes.FileNode('docs/index.txt',
+            content='Documentation\n'))
+        foobar_tip = self.imc.commit(
+            message=u'New branch: foobar',
+            author=u'joe',
+            branch='foobar',
+        )
+        self.assertRaises(ChangesetDoesNotExistError, foobar_tip.next,
+            branch='foobar')
+        self.assertRaises(ChangesetDoesNotExistError, foobar_tip.prev,
+            branch='foobar')
+
     def test_get_changeset_by_branch(self):
         for branch, sha in self.repo.branches.iteritems():
             self.assertEqual(sha, self.repo.get_changeset(branch).raw_id)
@@ -159,6 +285,41 @@ class ChangesetsTestCaseMixin(BackendTestMixin):
             key=lambda cs: cs.date)
         self.assertItemsEqual(changesets, ordered_by_date)
 
+    def test_iter_commit_info(self):
+        changesets = list(self.repo.get_changesets())
+        infos = list(self.repo.iter_commit_info())
+        self.assertEqual(len(infos), len(changesets))
+        for info, changeset in zip(infos, changesets):
+            self.assertTrue(isinstance(info, CommitInfo))
+            self.assertEqual(info.raw_id, changeset.raw_id)
+            self.assertEqual(info.short_id, changeset.short_id)
+            self.assertEqual(info.author, changeset.author)
+            self.assertEqual(info.author_email, changeset.author_email)
+            self.assertEqual(info.message, changeset.message)
+            self.assertEqual(info.date, changeset.date)
+            self.assertEqual(list(info.parents),
+                             [parent.raw_id for parent in changeset.parents])
+        # author strings are interned
+        self.assertTrue(infos[0].author is infos[-1].author)
+
+    def test_iter_commit_info_respects_arguments(self):
+        second_id = self.repo.revisions[1]
+        infos = list(self.repo.iter_commit_info(start=second_id,
+                                                reverse=True))
+        self.assertEqual([info.raw_id for info in infos],
+            [cs.raw_id for cs in self.repo.get_changesets(start=second_id,
+                                                          reverse=True)])
+        self.assertEqual(infos[-1].raw_id, second_id)
+
+    def test_commit_info_is_compact_and_immutable(self):
+        info = iter(self.repo.iter_commit_info()).next()
+        self.assertTrue(isinstance(info.timestamp, int))
+        with self.assertRaises(AttributeError):
+            info.author = u'Someone'
+        # there is no per instance dict
+        with self.assertRaises(AttributeError):
+            info.extra = 1
+
     def test_get_changesets_respects_start(self):
         second_id = self.repo.revisions[1]
         changesets = list(self.repo.get_changesets(start=second_id))
@@ -230,6 +391,14 @@ class ChangesetsTestCaseMixin(BackendTestMixin):
         filepaths = [node.path for node in tip.get_filenodes_generator()]
         self.assertItemsEqual(filepaths, ['file_%d.txt' % x for x in xrange(5)])
 
+    def test_nodes_are_cached_while_referenced(self):
+        tip = self.repo.get_changeset()
+        node = tip.get_node('file_0.txt')
+        self.assertTrue(tip.get_node('file_0.txt') is node)
+        del node
+        gc.collect()
+        self.assertFalse('file_0.txt' in tip.nodes)
+
     def test_size(self):
         tip = self.repo.get_changeset()
         size = 5 * len('Foobar N') # Size of 5 files
@@ -335,6 +504,77 @@ class ChangesetsChangesTestCaseMixin(BackendTestMixin):
         self.assertEqual(list(changeset.removed)[0].path, 'qwe')
 
 
+class ChangesetsAnnotateTestCaseMixin(BackendTestMixin):
+
+    @classmethod
+    def _get_commits(cls):
+        start_date = datetime.datetime(2010, 1, 1, 20)
+        contents = ['1\n2\n3\n', '1\nX\n3\n', '0\n1\nX\n3\n4\n']
+        for x, content in enumerate(contents):
+            commit = {
+                'message': u'Commit %d' % x,
+                'author': u'Joe Doe <joe.doe@example.com>',
+                'date': start_date + datetime.timedelta(hours=x),
+                'added': [FileNode('other_%d' % x, content='%d' % x)],
+            }
+            key = x and 'changed' or 'added'
+            commit.setdefault(key, []).append(FileNode('file', content=content))
+            yield commit
+
+    def test_file_annotate(self):
+        ids = [cs.raw_id for cs in self.repo.get_changesets()]
+        annotate = list(self.repo.get_changeset().get_file_annotate('file'))
+        self.assertEqual([(x[0], x[1], x[3]) for x in annotate], [
+            (1, ids[2], '0'),
+            (2, ids[0], '1'),
+            (3, ids[1], 'X'),
+            (4, ids[0], '3'),
+            (5, ids[2], '4'),
+        ] if self.backend_alias == 'git' else [
+            (1, ids[2], '0\n'),
+            (2, ids[0], '1\n'),
+            (3, ids[1], 'X\n'),
+            (4, ids[0], '3\n'),
+            (5, ids[2], '4\n'),
+        ])
+        # each loader returns its own changeset
+        self.assertEqual([x[2]().raw_id for x in annotate],
+                         [x[1] for x in annotate])
+
+    def test_file_annotate_reuses_previous_version(self):
+        self.repo._annotate_cache.clear()
+        list(self.repo.get_changeset(1).get_file_annotate('file'))
+        with mock.patch('vcs.utils.blame.get_matching_blocks',
+                wraps=get_matching_blocks) as matching_blocks:
+            list(self.repo.get_changeset().get_file_annotate('file'))
+        self.assertEqual(matching_blocks.call_count, 1)
+
+    def test_get_annotate_changesets(self):
+        annotate = self.repo.get_changeset().get_node('file').annotate
+        with mock.patch.object(self.repo, 'get_changesets_bulk',
+                wraps=self.repo.get_changesets_bulk) as bulk:
+            changesets = get_annotate_changesets(self.repo, annotate)
+        self.assertEqual(bulk.call_count, 1)
+        self.assertEqual(len(bulk.call_args[0][0]), 3)
+        for annotate_data in annotate:
+            self.assertEqual(changesets[annotate_data[1]].raw_id,
+                             annotate_data[1])
+
+    def test_annotate_highlight_renders_each_changeset_once(self):
+        node = self.repo.get_changeset().get_node('file')
+        rendered = []
+
+        def render(changeset):
+            rendered.append(changeset.raw_id)
+            return '%s\n' % changeset.raw_id
+
+        html = annotate_highlight(node, render)
+        self.assertEqual(sorted(rendered), sorted(set(rendered)))
+        self.assertEqual(len(rendered), 3)
+        for annotate_data in node.annotate:
+            self.assertTrue(annotate_data[1] in html)
+
+
 # For each backend create test case class
 for alias in SCM_TESTS:
     attrs = {
@@ -350,6 +590,11 @@ for alias in SCM_TESTS:
     bases = (ChangesetsTestCaseMixin, unittest.TestCase)
     globals()[cls_name] = type(cls_name, bases, attrs)
 
+    # tests annotate
+    cls_name = ''.join(('%s changesets annotate test' % alias).title().split())
+    bases = (ChangesetsAnnotateTestCaseMixin, unittest.TestCase)
+    globals()[cls_name] = type(cls_name, bases, attrs)
+
     # tests changes
     cls_name = ''.join(('%s changesets changes test' % alias).title().split())
     bases = (ChangesetsChangesTestCaseMixin, unittest.TestCase)
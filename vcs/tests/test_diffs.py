@@ -3,7 +3,7 @@ from vcs.tests.base import BackendTestMixin
 from vcs.tests.conf import SCM_TESTS
 from vcs.nodes import FileNode
 from vcs.utils.compat import unittest
-from vcs.utils.diffs import get_gitdiff
+from vcs.utils.diffs import DiffProcessor, get_gitdiff
 
 
 class DiffsTestMixin(BackendTestMixin):
@@ -47,6 +47,80 @@ class DiffsTestMixin(BackendTestMixin):
         self.assertIn('+...', result)
 
 
+DIFF = """diff --git a/file1 b/file1
+--- a/file1
++++ b/file1
+@@ -1,2 +1,2 @@
+-Foobar
++...
+ same
+diff --git a/file2 b/file2
+--- a/file2
++++ b/file2
+@@ -1,0 +1,3 @@
++a
++b
++c
+"""
+
+
+class DiffProcessorTest(unittest.TestCase):
+
+    def _get_lines(self, files):
+        return [[[line['action'] for line in chunk] for chunk in f['chunks']]
+                for f in files]
+
+    def test_iter_files_matches_prepare(self):
+        files = list(DiffProcessor(DIFF, format='gitdiff').iter_files())
+        self.assertEqual([f['filename'] for f in files], ['file1', 'file2'])
+        self.assertEqual(files,
+                         DiffProcessor(DIFF, format='gitdiff').prepare())
+
+    def test_iter_files_is_incremental(self):
+        read = []
+        def chunks():
+            # diff given in chunks not aligned with lines
+            for i in xrange(0, len(DIFF), 7):
+                read.append(i)
+                yield DIFF[i:i + 7]
+        files = DiffProcessor(chunks(), format='gitdiff').iter_files()
+        first = files.next()
+        self.assertEqual(first['filename'], 'file1')
+        self.assertTrue(len(read) * 7 < len(DIFF))
+        self.assertEqual(self._get_lines([first] + list(files)),
+            [[['del', 'add', 'unmod']], [['context', 'add', 'add', 'add']]])
+
+    def test_iter_files_budgets(self):
+        processor = DiffProcessor(DIFF, format='gitdiff')
+        files = list(processor.iter_files(max_file_lines=2))
+        self.assertEqual([f['limited'] for f in files], [True, True])
+        self.assertEqual([len(f['chunks'][0]) for f in files], [2, 2])
+        self.assertEqual(processor.stat(), (4, 1))
+
+        files = list(DiffProcessor(DIFF, format='gitdiff')
+                     .iter_files(max_lines=4))
+        self.assertEqual([f['limited'] for f in files], [False, True])
+        self.assertEqual(self._get_lines(files)[1], [['context']])
+
+    def test_parsed_files_are_compact(self):
+        processor = DiffProcessor(DIFF, format='gitdiff')
+        first, second = processor.parsed
+        self.assertEqual(len(first), 3)
+        self.assertEqual(first.filename, 'file1')
+        self.assertEqual(first.text, u'Foobar\n...\nsame\n')
+        self.assertEqual(list(first.old_linenos), [1, 0, 2])
+        self.assertEqual(list(first.new_linenos), [0, 1, 2])
+        self.assertEqual(first.get_line(1), {'old_lineno': '',
+            'new_lineno': 1, 'action': 'add', 'line': u'...\n'})
+        self.assertEqual(second.get_line(0)['old_lineno'], '...')
+        self.assertEqual(processor.stat(), (4, 1))
+        # rendering doesn't consume parsed diff
+        html = processor.as_html()
+        self.assertTrue('<ins>...</ins>' in html)
+        self.assertEqual(processor.as_html(), html)
+        self.assertEqual(processor.prepare(), processor.prepare())
+
+
 # For each backend create test case class
 for alias in SCM_TESTS:
     attrs = {
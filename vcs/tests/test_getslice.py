@@ -1,6 +1,8 @@
 from __future__ import with_statement
 
 import datetime
+import mock
+from vcs.backends.base import CollectionGenerator
 from vcs.tests.base import BackendTestMixin
 from vcs.tests.conf import SCM_TESTS
 from vcs.nodes import FileNode
@@ -41,6 +43,26 @@ class GetsliceTestCaseMixin(BackendTestMixin):
         self.assertEqual(list(self.repo[:-2]),
             [self.repo.get_changeset(rev) for rev in self.repo.revisions[:-2]])
 
+    def test__iter__returns_all_changesets(self):
+        self.assertEqual([cs.raw_id for cs in self.repo],
+            list(self.repo.revisions))
+
+    def test_get_changesets_bulk(self):
+        revisions = self.repo.revisions
+        changesets = self.repo.get_changesets_bulk([revisions[3],
+            revisions[1][:12], 0])
+        self.assertEqual([cs.raw_id for cs in changesets],
+            [revisions[3], revisions[1], revisions[0]])
+
+    def test_collection_is_built_in_chunks(self):
+        collection = CollectionGenerator(self.repo, self.repo.revisions)
+        collection.chunk_size = 2
+        with mock.patch.object(self.repo, 'get_changesets_bulk',
+                wraps=self.repo.get_changesets_bulk) as bulk:
+            changesets = list(collection)
+        self.assertEqual(changesets, list(self.repo))
+        self.assertEqual(bulk.call_count, 3)
+
 
 # For each backend create test case class
 for alias in SCM_TESTS:
@@ -2,9 +2,15 @@ from __future__ import with_statement
 
 import os
 import mock
+import time
 import datetime
 from vcs.backends.git import GitRepository, GitChangeset
-from vcs.exceptions import RepositoryError, VCSError, NodeDoesNotExistError
+from vcs.backends.git.catfile import GitCatFileReader
+from vcs.backends.git.repopool import clear_repo_pool
+from vcs.conf import settings
+from vcs.exceptions import (
+    ChangesetError, RepositoryError, VCSError, NodeDoesNotExistError
+)
 from vcs.nodes import NodeKind, FileNode, DirNode, NodeState
 from vcs.utils.compat import unittest
 from vcs.tests.base import BackendTestMixin
@@ -660,6 +666,297 @@ class GitSpecificWithRepoTest(BackendTestMixin, unittest.TestCase):
           'diff -U%s --full-index --binary -p -M --abbrev=40 %s %s -- "foo"'
             % (3, self.repo._get_revision(0), self.repo._get_revision(1)))
 
+    def test_get_diff_iter_strips_show_header_in_chunks(self):
+        output = 'commit abc\nAuthor: Joe\n\n    diff in message\n' \
+                 'diff --git a/foo b/foo\n+foo\n'
+        for size in (1, 3, 10, len(output)):
+            chunks = [output[i:i + size] for i in xrange(0, len(output), size)]
+            self.repo.stream_git_command = mock.Mock(
+                return_value=iter(chunks))
+            self.assertEqual(''.join(self.repo.get_diff_iter(
+                self.repo.EMPTY_CHANGESET, 1)),
+                'diff --git a/foo b/foo\n+foo\n')
+
+    def test_stream_git_command(self):
+        chunks = self.repo.stream_git_command('cat-file -p %s'
+                                              % self.repo.revisions[0])
+        self.assertEqual(''.join(chunks), self.repo.run_git_command(
+            'cat-file -p %s' % self.repo.revisions[0])[0])
+        with self.assertRaises(RepositoryError):
+            list(self.repo.stream_git_command('cat-file -p %s' % ('f' * 40)))
+
+
+class GitRevisionIndexTest(BackendTestMixin, unittest.TestCase):
+    backend_alias = 'git'
+
+    def test_index_is_stored_within_git_dir(self):
+        index = self.repo._revision_index
+        self.assertTrue(os.path.isfile(index.path))
+        self.assertTrue(index.path.startswith(self.repo.path))
+
+    def test_revisions_are_read_from_index(self):
+        with mock.patch.object(GitRepository, '_get_all_revisions') as m:
+            repo = GitRepository(self.repo.path)
+            self.assertEqual(repo.revisions, self.repo.revisions)
+            self.assertFalse(m.called)
+
+    def test_revision_position_lookup(self):
+        revisions = GitRepository(self.repo.path).revisions
+        for pos, revision in enumerate(self.repo.revisions):
+            self.assertEqual(revisions.index(revision), pos)
+            self.assertTrue(revision in revisions)
+        self.assertFalse('0' * 40 in revisions)
+        self.assertRaises(ValueError, revisions.index, '0' * 40)
+
+    def test_new_commits_are_appended(self):
+        self.imc.add(FileNode('appended', content='foo'))
+        tip = self.imc.commit(message=u'Appended', author=u'joe')
+        with mock.patch.object(GitRepository, '_get_all_revisions') as m:
+            repo = GitRepository(self.repo.path)
+            self.assertEqual(repo.revisions[-1], tip.raw_id)
+            self.assertEqual(repo.get_changeset().revision,
+                len(repo.revisions) - 1)
+            self.assertFalse(m.called)
+
+    def test_index_is_rebuilt_if_commits_became_unreachable(self):
+        self.repo.run_git_command('update-ref refs/heads/master %s'
+            % self.repo.revisions[0])
+        repo = GitRepository(self.repo.path)
+        self.assertEqual(repo.revisions, self.repo.revisions[:1])
+
+    def test_stale_lock_is_removed(self):
+        index = self.repo._revision_index
+        lock_path = index.path + '.lock'
+        open(lock_path, 'w').close()
+        os.utime(lock_path, (0, 0))
+        os.remove(index.state_path)
+        repo = GitRepository(self.repo.path)
+        repo.revisions
+        self.assertFalse(os.path.exists(lock_path))
+        self.assertTrue(os.path.isfile(index.state_path))
+
+    def test_fresh_lock_is_respected(self):
+        index = self.repo._revision_index
+        lock_path = index.path + '.lock'
+        open(lock_path, 'w').close()
+        os.remove(index.state_path)
+        try:
+            GitRepository(self.repo.path).revisions
+            self.assertFalse(os.path.exists(index.state_path))
+        finally:
+            os.remove(lock_path)
+
+
+class GitRepoHandleTest(BackendTestMixin, unittest.TestCase):
+    backend_alias = 'git'
+
+    def tearDown(self):
+        super(GitRepoHandleTest, self).tearDown()
+        clear_repo_pool()
+
+    def test_repo_is_not_reopened(self):
+        self.assertTrue(self.repo._repo is self.repo._repo)
+
+    def test_repo_is_reopened_after_packing(self):
+        _repo = self.repo._repo
+        self.repo.run_git_command('gc -q')
+        self.assertFalse(self.repo._repo is _repo)
+        tip = self.repo.get_changeset(self.repo.revisions[-1])
+        self.assertEqual(tip.raw_id, self.repo._repo.head())
+
+    def test_pooled_repo_is_shared(self):
+        with mock.patch.object(settings, 'GIT_REPO_POOL', True):
+            repo1 = GitRepository(self.repo.path)
+            repo2 = GitRepository(self.repo.path)
+        self.assertTrue(repo1._repo is repo2._repo)
+        self.assertFalse(self.repo._repo is repo1._repo)
+
+    def test_pool_is_bounded(self):
+        other = GitRepository(get_new_dir('repo-pool'), create=True)
+        with mock.patch.multiple(settings, GIT_REPO_POOL=True,
+                                 GIT_REPO_POOL_SIZE=1):
+            repo1 = GitRepository(self.repo.path)
+            repo1.get_changeset()
+            self.assertTrue(repo1._repo.object_store._pack_cache is not None)
+            GitRepository(other.path)
+            self.assertTrue(repo1._repo.object_store._pack_cache is None)
+            # evicted handle is still usable
+            self.assertEqual(repo1.get_changeset().raw_id,
+                             self.repo.revisions[-1])
+            self.assertFalse(GitRepository(self.repo.path)._repo_handle is
+                             repo1._repo_handle)
+
+
+class GitObjectCacheTest(BackendTestMixin, unittest.TestCase):
+    backend_alias = 'git'
+
+    def test_trees_are_shared_between_changesets(self):
+        cache = self.repo._object_cache
+        self.repo.get_changeset(self.repo.revisions[-1]).get_nodes('')
+        hits = cache.hits
+        changeset = GitChangeset(self.repo, self.repo.revisions[-1])
+        self.assertTrue(changeset._tree_id in cache)
+        changeset.get_nodes('')
+        self.assertTrue(cache.hits > hits)
+
+    def test_path_lookup_reads_only_trees_along_path(self):
+        tip = GitChangeset(self.repo, self.repo.revisions[-1])
+        baz_id = tip._get_id_for_path('foo/bar/baz')
+        self.assertEqual(tip.get_file_content('foo/bar/baz'), 'baz here!')
+        self.assertEqual(sorted(tip._paths), ['foo', 'foo/bar', 'foo/bar/baz'])
+        other = GitChangeset(self.repo, self.repo.revisions[-1])
+        self.repo._repo_handle
+        with mock.patch.object(self.repo, '_repo_handle') as handle:
+            self.assertEqual(other._get_id_for_path('foo/bar/baz'), baz_id)
+        self.assertFalse(handle.get.called)
+
+    def test_path_lookup_errors(self):
+        tip = self.repo.get_changeset()
+        self.assertRaises(ChangesetError, tip._get_id_for_path, 'foobar/x')
+        self.assertRaises(ChangesetError, tip._get_id_for_path, 'none/x')
+        self.assertRaises(NodeDoesNotExistError, tip._get_id_for_path,
+                          'foo/none')
+
+    def test_big_blobs_are_not_cached(self):
+        self.imc.add(FileNode('big', content='x' * 1024))
+        tip = self.imc.commit(message=u'Big file', author=u'joe')
+        with mock.patch.object(settings, 'GIT_OBJECT_CACHE_BLOB_SIZE', 1023):
+            self.assertEqual(tip.get_file_content('big'), 'x' * 1024)
+        self.assertFalse(tip._get_id_for_path('big') in
+                         self.repo._object_cache)
+
+    def test_sizes_are_read_without_blobs(self):
+        tip = self.repo.get_changeset()
+        expected = sum(len(node.content)
+                       for node in tip.get_filenodes_generator())
+        self.repo._object_cache.clear()
+        self.repo._tree_sizes._sizes.clear()
+        get_object = self.repo._get_object
+        read = []
+        def _get_object(sha):
+            obj = get_object(sha)
+            read.append(obj.type_name)
+            return obj
+        with mock.patch.object(self.repo, '_get_object', _get_object):
+            changeset = GitChangeset(self.repo, tip.raw_id)
+            self.assertEqual(changeset.size, expected)
+        self.assertTrue(read)
+        self.assertFalse('blob' in read)
+
+    def test_tree_sizes_are_reused(self):
+        first = self.repo.get_changeset(0)
+        foo_size = first.get_dir_size('foo')
+        tip = self.repo.get_changeset()
+        # 'foo' tree is same at tip, so its size is not summed up again
+        with mock.patch.object(self.repo._tree_sizes, 'get_blob_size') \
+                as get_blob_size:
+            get_blob_size.return_value = 0
+            self.assertEqual(tip.get_dir_size('foo'), foo_size)
+        self.assertFalse(get_blob_size.called)
+
+
+class GitFileHistoryTest(BackendTestMixin, unittest.TestCase):
+    backend_alias = 'git'
+
+    def _get_history(self, changeset, path, limit=None):
+        return [cs.raw_id for cs in changeset.get_file_history(path, limit)]
+
+    def test_history_matches_git_log(self):
+        tip = self.repo.get_changeset()
+        for path in ('foobar', 'foobar2', 'foo/bar/baz', 'some/new.txt'):
+            cmd = 'log --pretty=format:%%H %s -- %s' % (tip.raw_id, path)
+            so, se = self.repo.run_git_command(cmd)
+            self.assertEqual(self._get_history(tip, path), so.split())
+
+    def test_history_is_cached(self):
+        tip = self.repo.get_changeset()
+        history = self._get_history(tip, 'foobar')
+        with mock.patch('vcs.backends.git.changeset.walk_file_history') \
+                as walk:
+            self.assertEqual(self._get_history(tip, 'foobar'), history)
+            self.assertEqual(self._get_history(tip, 'foobar', 1),
+                             history[:1])
+        self.assertFalse(walk.called)
+
+    def test_limited_history_is_not_reused_for_longer_one(self):
+        tip = self.repo.get_changeset()
+        history = self._get_history(tip, 'foobar')
+        self.repo._file_history_cache.clear()
+        self.assertEqual(self._get_history(tip, 'foobar', 1), history[:1])
+        self.assertEqual(self._get_history(tip, 'foobar'), history)
+
+
+class GitCatFileReaderTest(BackendTestMixin, unittest.TestCase):
+    backend_alias = 'git'
+
+    def setUp(self):
+        super(GitCatFileReaderTest, self).setUp()
+        self.reader = GitCatFileReader(self.repo.path)
+
+    def tearDown(self):
+        super(GitCatFileReaderTest, self).tearDown()
+        self.reader.stop()
+
+    def test_get_object(self):
+        tip = self.repo.get_changeset()
+        tree = self.reader.get_object(tip._tree_id)
+        self.assertEqual(tree.id, tip._tree_id)
+        self.assertEqual(tree.items(), self.repo._repo[tip._tree_id].items())
+
+    def test_get_info(self):
+        tip = self.repo.get_changeset()
+        blob_id = tip._get_id_for_path('foobar')
+        self.assertEqual(self.reader.get_info(blob_id),
+            ('blob', tip.get_file_size('foobar')))
+
+    def test_missing_object(self):
+        self.assertRaises(KeyError, self.reader.get_object, '0' * 40)
+        self.assertRaises(KeyError, self.reader.get_info, 'foo\nbar')
+
+    def test_requests_stay_in_sync(self):
+        tip = self.repo.get_changeset()
+        for sha in ('foo\nbar', tip.raw_id + '\n' + tip._tree_id,
+                    tip.raw_id + '\n', ' ' + tip.raw_id, 'HEAD'):
+            self.assertRaises(KeyError, self.reader.get_object, sha)
+            self.assertRaises(KeyError, self.reader.get_info, sha)
+        self.assertEqual(self.reader.get_object(tip._tree_id).id,
+                         tip._tree_id)
+        self.assertEqual(self.reader.get_object(tip.raw_id).id, tip.raw_id)
+
+    def test_process_out_of_sync_is_restarted(self):
+        tip = self.repo.get_changeset()
+        self.reader.get_info(tip.raw_id)
+        process = self.reader._check._process
+        # leave extra reply within the pipe
+        process.stdin.write(tip._tree_id + '\n')
+        process.stdin.flush()
+        self.assertEqual(self.reader.get_info(tip.raw_id),
+                         ('commit', self.repo._repo[tip.raw_id].raw_length()))
+        self.assertFalse(self.reader._check._process is process)
+
+    def test_process_is_restarted(self):
+        tip = self.repo.get_changeset()
+        self.reader.get_object(tip.raw_id)
+        self.reader._batch._process.kill()
+        self.reader._batch._process.wait()
+        self.assertEqual(self.reader.get_object(tip.raw_id).id, tip.raw_id)
+
+    def test_idle_process_is_stopped(self):
+        reader = GitCatFileReader(self.repo.path, idle_timeout=0.01)
+        reader.get_info(self.repo.get_changeset().raw_id)
+        self.assertTrue(reader._check.running)
+        time.sleep(0.2)
+        self.assertFalse(reader._check.running)
+
+    def test_repository_reads_objects_through_cat_file(self):
+        with mock.patch.object(settings, 'GIT_OBJECT_READER', 'cat-file'):
+            repo = GitRepository(self.repo.path)
+            tip = repo.get_changeset()
+            self.assertEqual(tip.get_file_content('foobar'),
+                self.repo.get_changeset().get_file_content('foobar'))
+            self.assertTrue(repo._cat_file._batch.running)
+        repo._cat_file.stop()
+
 
 class GitRegressionTest(BackendTestMixin, unittest.TestCase):
     backend_alias = 'git'
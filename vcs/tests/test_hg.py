@@ -1,9 +1,12 @@
 from __future__ import with_statement
 
 import os
+import mock
 from vcs.backends.hg import MercurialRepository, MercurialChangeset
-from vcs.exceptions import RepositoryError, VCSError, NodeDoesNotExistError
+from vcs.exceptions import ChangesetError, RepositoryError, VCSError, \
+    NodeDoesNotExistError
 from vcs.nodes import NodeKind, NodeState
+from vcs.tests.base import BackendTestMixin
 from vcs.tests.conf import PACKAGE_DIR, TEST_HG_REPO, TEST_HG_REPO_CLONE, \
     TEST_HG_REPO_PULL
 from vcs.utils.compat import unittest
@@ -556,3 +559,46 @@ class MercurialChangesetTest(unittest.TestCase):
                          self.repo.get_changeset('3803844fdbd3').author_name)
         self.assertEqual('marcink',
                          self.repo.get_changeset('84478366594b').author_name)
+
+
+class MercurialDirectoryIndexTest(BackendTestMixin, unittest.TestCase):
+    backend_alias = 'hg'
+
+    def test_index_is_shared_by_same_manifest(self):
+        tip = self.repo.get_changeset()
+        other = MercurialChangeset(self.repo, tip.raw_id)
+        self.assertTrue(tip._dir_index is other._dir_index)
+        self.assertFalse(tip._dir_index is
+                         self.repo.get_changeset(0)._dir_index)
+
+    def test_get_nodes(self):
+        tip = self.repo.get_changeset()
+        self.assertEqual([node.path for node in tip.get_nodes('')],
+                         ['foo', 'some', 'foobar', 'foobar2'])
+        self.assertEqual([node.path for node in tip.get_nodes('foo')],
+                         ['foo/bar'])
+        self.assertEqual([node.path for node in tip.get_nodes('foo/bar')],
+                         ['foo/bar/baz'])
+        self.assertRaises(ChangesetError, tip.get_nodes, 'foobar')
+        self.assertRaises(ChangesetError, tip.get_nodes, 'missing')
+
+    def test_get_node_kind(self):
+        tip = self.repo.get_changeset()
+        self.assertEqual(tip.get_node('foo/bar').kind, NodeKind.DIR)
+        self.assertEqual(tip.get_node('foo/bar/baz').kind, NodeKind.FILE)
+        self.assertRaises(NodeDoesNotExistError, tip.get_node, 'foo/baz')
+
+    def test_dir_size_is_summed_from_children(self):
+        tip = self.repo.get_changeset()
+        files = [path for path in tip._dir_index.files
+                 if path.startswith('foo/')]
+        self.assertTrue(files)
+        self.assertEqual(tip.get_dir_size('foo'),
+                         sum(tip.get_file_size(path) for path in files))
+        self.assertEqual(tip.get_dir_size(''), tip.size)
+        # totals are kept by index shared by changesets of the same manifest
+        other = MercurialChangeset(self.repo, tip.raw_id)
+        with mock.patch.object(other._ctx, 'filectx') as filectx:
+            self.assertEqual(other.get_dir_size('foo/bar'),
+                             tip.get_dir_size('foo/bar'))
+        self.assertFalse(filectx.called)
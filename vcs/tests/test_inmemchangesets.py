@@ -6,7 +6,10 @@ from __future__ import with_statement
 import time
 import datetime
 
+import mock
+
 import vcs
+from vcs.conf import settings
 from vcs.tests.conf import SCM_TESTS, get_new_dir
 from vcs.exceptions import EmptyRepositoryError
 from vcs.exceptions import NodeAlreadyAddedError
@@ -126,6 +129,32 @@ class InMemoryChangesetTestMixin(object):
             message='new message',
             author=str(self))
 
+    def test_check_integrity_raise_file_exists_at_directory_path(self):
+        self.imc.add(FileNode('foo', content='foo'))
+        self.imc.commit(u'added', u'joe doe')
+
+        self.imc.add(FileNode('foo/bar/baz', content='baz'))
+        self.assertRaises(NodeAlreadyExistsError, self.imc.commit,
+            u'added below file', u'joe doe')
+        self.assertEqual(self.repo.get_changeset().get_node('foo').content,
+            'foo')
+
+    def test_check_integrity_raise_file_added_at_directory_path(self):
+        self.imc.add(FileNode('foo', content='foo'))
+        self.imc.add(FileNode('foo/bar', content='bar'))
+        self.assertRaises(NodeAlreadyExistsError, self.imc.commit,
+            u'added file and directory', u'joe doe')
+
+    def test_replace_removed_file_with_directory(self):
+        self.imc.add(FileNode('foo', content='foo'))
+        self.imc.commit(u'added', u'joe doe')
+
+        self.imc.remove(FileNode('foo'))
+        self.imc.add(FileNode('foo/bar', content='bar'))
+        tip = self.imc.commit(u'replaced', u'joe doe')
+        self.assertTrue(tip.get_node('foo').is_dir())
+        self.assertEqual(tip.get_node('foo/bar').content, 'bar')
+
     def test_change(self):
         self.imc.add(FileNode('foo/bar/baz', content='foo'))
         self.imc.add(FileNode('foo/fbar', content='foobar'))
@@ -203,6 +232,51 @@ class InMemoryChangesetTestMixin(object):
         tip = self.imc.commit(u'removed', u'joe doe')
         self.assertRaises(NodeDoesNotExistError, tip.get_node, 'omg/qwe/foo/bar')
 
+    def test_add_change_and_remove_in_many_directories(self):
+        paths = ['foo/bar/%d.txt' % x for x in xrange(10)] + \
+            ['foo/baz/%d.txt' % x for x in xrange(10)] + ['foo/qwe', 'top']
+        for path in paths:
+            self.imc.add(FileNode(path, content=path))
+        self.imc.commit(u'added', u'joe doe')
+
+        self.imc.add(FileNode('foo/bar/new/file', content='new'))
+        self.imc.change(FileNode('foo/bar/0.txt', content='changed'))
+        self.imc.change(FileNode('top', content='changed'))
+        for x in xrange(10):
+            self.imc.remove(FileNode('foo/baz/%d.txt' % x))
+        tip = self.imc.commit(u'changed', u'joe doe')
+
+        expected = [path for path in paths if not path.startswith('foo/baz')]
+        expected.append('foo/bar/new/file')
+        self.assertEqual(sorted(node.path for node in
+            tip.get_node('foo').nodes), ['foo/bar', 'foo/qwe'])
+        self.assertEqual(sorted(node.path for node in tip.get_node('foo/bar')
+            .files), sorted(p for p in expected if p.count('/') == 2 and
+                            p.startswith('foo/bar/')))
+        self.assertEqual(tip.get_node('foo/bar/0.txt').content, 'changed')
+        self.assertEqual(tip.get_node('foo/bar/1.txt').content, 'foo/bar/1.txt')
+        self.assertEqual(tip.get_node('foo/bar/new/file').content, 'new')
+        self.assertEqual(tip.get_node('top').content, 'changed')
+
+    def test_commit_many_nodes_above_pack_limit(self):
+        with mock.patch.object(settings, 'GIT_COMMIT_PACK_LIMIT', 2):
+            for x in xrange(10):
+                self.imc.add(FileNode('dir%d/file%d' % (x % 3, x),
+                                       content=str(x)))
+            tip = self.imc.commit(u'added', u'joe doe')
+        self.assertEqual(tip.get_node('dir1/file7').content, '7')
+        self.assertEqual(len(tip.get_node('').dirs), 3)
+
+    def test_check_integrity_does_not_read_parents_files(self):
+        self.test_add()  # Performs first commit
+
+        tip = self.repo.get_changeset()
+        self.imc.change(FileNode(self.nodes[0].path, content='changed'))
+        self.imc.add(FileNode('new', content='new'))
+        with mock.patch.object(tip.__class__, 'get_file_content') as content:
+            self.imc.check_integrity([tip])
+        self.assertFalse(content.called)
+
     def test_remove_raise_node_does_not_exist(self):
         self.imc.remove(self.nodes[0])
         self.assertRaises(NodeDoesNotExistError, self.imc.commit,
@@ -1,6 +1,7 @@
 from __future__ import with_statement
 
 import stat
+import pickle
 from vcs.nodes import DirNode
 from vcs.nodes import FileNode
 from vcs.nodes import Node
@@ -171,6 +172,34 @@ class NodeBasicTest(unittest.TestCase):
         self.assertEqual(my_node3.mimetype,ext)
         self.assertEqual(my_node3.get_mimetype(),[ext,ext])
 
+    def test_nodes_have_no_dict(self):
+        for node in (FileNode('foobar', 'content'), DirNode('foo'),
+                     DirNode('', nodes=[FileNode('foobar')])):
+            self.assertFalse(hasattr(node, '__dict__'))
+            self.assertRaises(AttributeError, setattr, node, 'foo', 1)
+
+    def test_pickle(self):
+        node = FileNode('a/b.txt', content='x', mode=0100755)
+        self.assertEqual(node.name, 'b.txt')
+        for protocol in (0, pickle.HIGHEST_PROTOCOL):
+            copy = pickle.loads(pickle.dumps(node, protocol))
+            self.assertEqual(copy.path, 'a/b.txt')
+            self.assertEqual(copy.content, 'x')
+            self.assertEqual(copy.mode, 0100755)
+            self.assertEqual(copy._lazy_name, 'b.txt')
+
+        node = DirNode('a', nodes=[FileNode('a/b.txt', content='x')])
+        copy = pickle.loads(pickle.dumps(node))
+        self.assertEqual([n.path for n in copy.nodes], ['a/b.txt'])
+
+    def test_lazy_attributes_may_be_assigned(self):
+        node = FileNode('foo/bar.py', 'content')
+        self.assertEqual(node.name, 'bar.py')
+        node.message = 'message'
+        self.assertEqual(node.message, 'message')
+        del node.message
+        self.assertRaises(NodeError, getattr, node, 'message')
+
 class NodeContentTest(unittest.TestCase):
 
     def test_if_binary(self):
@@ -1,10 +1,19 @@
 from __future__ import with_statement
+import mock
+import shutil
 import datetime
+import tempfile
+from multiprocessing.pool import ThreadPool
+from vcs.backends.asyncrepo import AsyncRepository, AsyncChangeset
+from vcs.backends.base import CommitGraph, RevisionList
+from vcs.conf import settings
 from vcs.tests.base import BackendTestMixin
 from vcs.tests.conf import SCM_TESTS
 from vcs.tests.conf import TEST_USER_CONFIG_FILE
 from vcs.nodes import FileNode
 from vcs.utils.compat import unittest
+from vcs.utils.diffcache import get_diff_cache
+from vcs.utils.diffs import get_diff_processor
 from vcs.exceptions import ChangesetDoesNotExistError
 
 
@@ -45,6 +54,93 @@ class RepositoryBaseTest(BackendTestMixin):
             path = self.repo.path
         self.assertTrue(self.repo != dummy())
 
+    def test_revisions_index(self):
+        tip = self.repo.revisions[-1]
+        self.assertTrue(tip in self.repo.revisions)
+        self.assertEqual(self.repo.revisions.index(tip),
+            len(self.repo.revisions) - 1)
+
+    def test_get_changeset_by_short_id(self):
+        tip = self.repo.get_changeset()
+        self.assertEqual(self.repo.get_changeset(tip.short_id), tip)
+
+
+class AsyncRepositoryTest(BackendTestMixin):
+
+    @classmethod
+    def setUpClass(cls):
+        super(AsyncRepositoryTest, cls).setUpClass()
+        cls.pool = ThreadPool(2)
+
+    def setUp(self):
+        super(AsyncRepositoryTest, self).setUp()
+        self.async_repo = AsyncRepository(self.repo, pool=self.pool)
+
+    def test_get_changeset(self):
+        changeset = self.async_repo.get_changeset().get(timeout=10)
+        self.assertTrue(isinstance(changeset, AsyncChangeset))
+        self.assertEqual(changeset.raw_id, self.repo.get_changeset().raw_id)
+
+    def test_get_changesets(self):
+        changesets = self.async_repo.get_changesets().get(timeout=10)
+        self.assertEqual([cs.raw_id for cs in changesets],
+            list(self.repo.revisions))
+
+    def test_changeset_calls(self):
+        changeset = self.async_repo.get_changeset().get(timeout=10)
+        results = [changeset.get_file_content('foobar'),
+                   changeset.get_file_size('foobar'),
+                   changeset.get_parents()]
+        content, size, parents = [result.get(timeout=10)
+                                  for result in results]
+        self.assertEqual(content, self.tip.get_file_content('foobar'))
+        self.assertEqual(size, len(content))
+        self.assertEqual([cs.raw_id for cs in parents],
+            [cs.raw_id for cs in self.tip.parents])
+
+    def test_exceptions_are_raised_by_get(self):
+        result = self.async_repo.get_changeset('f' * 40)
+        self.assertRaises(ChangesetDoesNotExistError, result.get, 10)
+
+    def test_get_attribute(self):
+        self.assertEqual(self.async_repo.get_attribute('revisions').get(10),
+            self.repo.revisions)
+
+
+class RevisionListTest(unittest.TestCase):
+
+    def setUp(self):
+        self.revisions = RevisionList(['abc123', 'abd456', 'fff000'])
+
+    def test_index(self):
+        self.assertEqual(self.revisions.index('abd456'), 1)
+        self.assertRaises(ValueError, self.revisions.index, 'abc')
+
+    def test_index_after_modification(self):
+        self.revisions.insert(0, '000000')
+        self.revisions.append('123456')
+        self.assertEqual(self.revisions.index('abd456'), 2)
+        self.assertEqual(self.revisions.index('123456'), 4)
+        del self.revisions[0]
+        self.assertEqual(self.revisions.index('abd456'), 1)
+        self.assertFalse('000000' in self.revisions)
+
+    def test_lookup(self):
+        self.assertEqual(self.revisions.lookup('abc'), 'abc123')
+        self.assertEqual(self.revisions.lookup('f'), 'fff000')
+        self.assertEqual(self.revisions.lookup('abd456'), 'abd456')
+
+    def test_lookup_after_append(self):
+        self.revisions.lookup('f')
+        self.revisions.append('ffa000')
+        self.assertEqual(self.revisions.lookup('ffa'), 'ffa000')
+        self.assertRaises(KeyError, self.revisions.lookup, 'ff')
+
+    def test_lookup_raises_for_ambiguous_or_missing_prefix(self):
+        self.assertRaises(KeyError, self.revisions.lookup, 'ab')
+        self.assertRaises(KeyError, self.revisions.lookup, 'abe')
+        self.assertRaises(KeyError, self.revisions.lookup, 'g')
+
 
 class RepositoryGetDiffTest(BackendTestMixin):
 
@@ -87,6 +183,40 @@ class RepositoryGetDiffTest(BackendTestMixin):
         with self.assertRaises(ChangesetDoesNotExistError):
             self.repo.get_diff('a' * 40, 'b' * 40)
 
+    def test_get_diff_iter(self):
+        revs = [self.repo.EMPTY_CHANGESET] + list(self.repo.revisions)
+        for rev1, rev2 in zip(revs, revs[1:]):
+            self.assertEqual(''.join(self.repo.get_diff_iter(rev1, rev2)),
+                             self.repo.get_diff(rev1, rev2))
+        self.assertEqual(
+            ''.join(self.repo.get_diff_iter(revs[1], revs[3], 'foobar3')),
+            self.repo.get_diff(revs[1], revs[3], 'foobar3'))
+
+    def test_diffs_are_cached(self):
+        revs = self.repo.revisions
+        path = tempfile.mkdtemp(prefix='vcs-diffcache-')
+        try:
+            with mock.patch.object(settings, 'DIFF_CACHE_PATH', path):
+                cache = get_diff_cache()
+                diff = self.repo.get_diff(revs[0], revs[1])
+                self.assertEqual(self.repo.get_diff(revs[0], revs[1]), diff)
+                self.assertEqual(
+                    ''.join(self.repo.get_diff_iter(revs[0], revs[1])), diff)
+                self.assertEqual(cache.hits, 2)
+
+                parsed = get_diff_processor(self.repo, revs[0], revs[1])
+                files = parsed.prepare()
+                cached = get_diff_processor(self.repo, revs[0], revs[1])
+                self.assertEqual(cache.hits, 4)
+                self.assertEqual(cached.prepare(), files)
+                self.assertEqual(cached.stat(), parsed.stat())
+        finally:
+            shutil.rmtree(path)
+
+    def test_get_diff_iter_raise_for_wrong(self):
+        with self.assertRaises(ChangesetDoesNotExistError):
+            self.repo.get_diff_iter('a' * 40, 'b' * 40)
+
 
 class GitRepositoryGetDiffTest(RepositoryGetDiffTest, unittest.TestCase):
     backend_alias = 'git'
@@ -216,6 +346,34 @@ diff --git a/foobar3 b/foobar3
 ''')
 
 
+class CommitGraphTest(unittest.TestCase):
+
+    def setUp(self):
+        # 0 <- 1 <- 3
+        #   <- 2 <-/
+        self.graph = CommitGraph()
+        for parents in ([], [0], [0], [1, 2]):
+            self.graph.append(parents)
+
+    def test_parents(self):
+        self.assertEqual(len(self.graph), 4)
+        self.assertEqual(self.graph.parents(0), [])
+        self.assertEqual(self.graph.parents(3), [1, 2])
+
+    def test_children(self):
+        self.assertEqual(self.graph.children(0), [1, 2])
+        self.assertEqual(self.graph.children(2), [3])
+        self.assertEqual(self.graph.children(3), [])
+
+    def test_children_of_appended_revisions(self):
+        self.graph.children(0)
+        self.graph.append([3])
+        self.graph.append([0])
+        self.assertEqual(self.graph.children(0), [1, 2, 5])
+        self.assertEqual(self.graph.children(3), [4])
+        self.assertEqual(self.graph.children(5), [])
+
+
 # For each backend create test case class
 for alias in SCM_TESTS:
     attrs = {
@@ -225,5 +383,9 @@ for alias in SCM_TESTS:
     bases = (RepositoryBaseTest, unittest.TestCase)
     globals()[cls_name] = type(cls_name, bases, attrs)
 
+    cls_name = alias.capitalize() + AsyncRepositoryTest.__name__
+    bases = (AsyncRepositoryTest, unittest.TestCase)
+    globals()[cls_name] = type(cls_name, bases, attrs)
+
 if __name__ == '__main__':
     unittest.main()
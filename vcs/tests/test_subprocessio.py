@@ -0,0 +1,75 @@
+from __future__ import with_statement
+
+import os
+from vcs.subprocessio import SelectIOChunker, SubprocessIOChunker
+from vcs.utils.compat import unittest
+
+
+class SubprocessIOChunkerTestMixin(object):
+    chunker = None
+
+    def test_output(self):
+        p = self.chunker('echo foo; echo bar')
+        self.assertEqual(''.join(p), 'foo\nbar\n')
+
+    def test_input(self):
+        p = self.chunker('cat', inputstream='x' * 100000, close_fds=True)
+        self.assertEqual(''.join(p), 'x' * 100000)
+
+
+class SelectIOChunkerTest(SubprocessIOChunkerTestMixin, unittest.TestCase):
+    chunker = SelectIOChunker
+
+    def test_error(self):
+        # threaded chunker may miss an error if process ends before
+        # its stderr is read, so it's tested only here
+        self.assertRaises(EnvironmentError, self.chunker,
+            'echo failed >&2; exit 1')
+
+    def test_output_bigger_than_buffer(self):
+        p = self.chunker('yes | head -c 100000', buffer_size=1024,
+            chunk_size=512)
+        self.assertTrue(p.bytes_out < 100000)
+        self.assertEqual(''.join(p), 'y\n' * 50000)
+        self.assertEqual(p.bytes_out, 100000)
+
+    def test_error_after_buffer_is_full(self):
+        p = self.chunker('yes | head -c 100000; exit 1', buffer_size=1024)
+        self.assertRaises(EnvironmentError, ''.join, p)
+
+    def test_stderr_is_not_an_error(self):
+        p = self.chunker('echo warning >&2; sleep 0.1; echo foo')
+        self.assertEqual(''.join(p.output), 'foo\n')
+        self.assertEqual(''.join(p.error), 'warning\n')
+        self.assertEqual(p.bytes_err, len('warning\n'))
+
+    def test_input_from_file(self):
+        with open(__file__) as f:
+            p = self.chunker('cat', inputstream=f)
+            self.assertEqual(''.join(p), open(__file__).read())
+        self.assertEqual(p.bytes_in, os.path.getsize(__file__))
+
+    def test_timeout(self):
+        self.assertRaises(EnvironmentError, self.chunker, 'sleep 5',
+            timeout=0.1)
+
+    def test_timeout_while_iterating(self):
+        p = self.chunker('yes | head -c 100000; sleep 5', buffer_size=1024,
+            timeout=0.5)
+        self.assertRaises(EnvironmentError, ''.join, p)
+        self.assertTrue(p.process.poll() is not None)
+
+    def test_process_running_after_closing_pipes(self):
+        cmd = 'exec >&- 2>&-; sleep 0.2; exit 1'
+        self.assertRaises(EnvironmentError, self.chunker, cmd)
+        self.assertRaises(EnvironmentError, self.chunker, 'exec >&- 2>&-; '
+            'sleep 5', timeout=0.2)
+
+
+class ThreadedSubprocessIOChunkerTest(SubprocessIOChunkerTestMixin,
+                                      unittest.TestCase):
+    chunker = SubprocessIOChunker
+
+
+if __name__ == '__main__':
+    unittest.main()
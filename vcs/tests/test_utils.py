@@ -15,6 +15,8 @@ from vcs.utils.helpers import get_total_seconds
 from vcs.utils.helpers import parse_changesets
 from vcs.utils.helpers import parse_datetime
 from vcs.utils import author_email, author_name
+from vcs.utils.diffcache import DiffCache
+from vcs.utils.lrucache import LRUCache
 from vcs.utils.paths import get_user_home
 from vcs.exceptions import VCSError
 
@@ -275,5 +277,105 @@ class TestGetUserHome(unittest.TestCase):
         self.assertEqual(get_user_home(), '/home/foobar')
 
 
+class TestLRUCache(unittest.TestCase):
+
+    def test_get(self):
+        cache = LRUCache()
+        cache.set('foo', 1)
+        self.assertEqual(cache.get('foo'), 1)
+        self.assertEqual(cache.get('bar'), None)
+        self.assertEqual(cache.get('bar', 2), 2)
+        self.assertEqual((cache.hits, cache.misses), (1, 2))
+
+    def test_max_entries(self):
+        cache = LRUCache(max_entries=2)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        cache.get('a')
+        cache.set('c', 3)
+        self.assertEqual(len(cache), 2)
+        self.assertTrue('a' in cache)
+        self.assertFalse('b' in cache)
+        self.assertTrue('c' in cache)
+
+    def test_max_size(self):
+        cache = LRUCache(max_size=10)
+        cache.set('a', 1, size=4)
+        cache.set('b', 2, size=4)
+        cache.set('a', 3, size=4)
+        cache.set('c', 4, size=4)
+        self.assertEqual(cache.size, 8)
+        self.assertEqual(cache.get('a'), 3)
+        self.assertFalse('b' in cache)
+        cache.set('d', 5, size=11)
+        self.assertFalse('d' in cache)
+        self.assertEqual(cache.size, 8)
+
+    def test_clear(self):
+        cache = LRUCache()
+        cache.set('a', 1, size=4)
+        cache.get('a')
+        cache.clear()
+        self.assertEqual((len(cache), cache.size, cache.hits), (0, 0, 0))
+
+
+class TestDiffCache(unittest.TestCase):
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp(prefix='vcs-diffcache-')
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def _get_files(self):
+        return [name for dir_name in os.listdir(self.path)
+                for name in os.listdir(os.path.join(self.path, dir_name))]
+
+    def test_get(self):
+        cache = DiffCache(self.path)
+        cache.set(('raw', 'git', 'a', 'b'), 'diff')
+        self.assertEqual(cache.get(('raw', 'git', 'a', 'b')), 'diff')
+        self.assertEqual(DiffCache(self.path).get(('raw', 'git', 'a', 'b')),
+                         'diff')
+        self.assertEqual(cache.get(('raw', 'hg', 'a', 'b')), None)
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
+        # no temporary files are left
+        self.assertEqual(len(self._get_files()), 1)
+
+    def test_entries_are_compressed(self):
+        cache = DiffCache(self.path)
+        cache.set('key', 'x' * 10000)
+        self.assertTrue(os.path.getsize(cache._get_path('key')) < 1000)
+
+    def test_broken_entry_is_removed(self):
+        cache = DiffCache(self.path)
+        cache.set('key', 'diff')
+        entry = cache._get_path('key')
+        with open(entry, 'wb') as f:
+            f.write('broken')
+        self.assertEqual(cache.get('key'), None)
+        self.assertFalse(os.path.exists(entry))
+
+    def test_max_size(self):
+        cache = DiffCache(self.path, max_size=1000)
+        for i in xrange(3):
+            cache.set(i, os.urandom(400))
+            # make entries' order of use unambiguous
+            entry = cache._get_path(i)
+            os.utime(entry, (i, i))
+        self.assertEqual(cache.get(0), None)
+        self.assertNotEqual(cache.get(1), None)
+        self.assertNotEqual(cache.get(2), None)
+        self.assertEqual(len(self._get_files()), 2)
+
+    def test_clear(self):
+        cache = DiffCache(self.path)
+        cache.set('key', 'diff')
+        cache.get('key')
+        cache.clear()
+        self.assertEqual(cache.get('key'), None)
+        self.assertEqual((cache.hits, cache.misses), (0, 1))
+
+
 if __name__ == '__main__':
     unittest.main()
@@ -5,6 +5,7 @@ from pygments import highlight
 
 from vcs.exceptions import VCSError
 from vcs.nodes import FileNode
+from vcs.utils.blame import get_annotate_changesets
 
 
 def annotate_highlight(filenode, annotate_from_changeset_func=None,
@@ -130,14 +131,19 @@ class AnnotateHtmlFormatter(HtmlFormatter):
                     lines.append('')
             ls = '\n'.join(lines)
 
-        annotate_changesets = [tup[1] for tup in self.filenode.annotate]
+        annotate_ids = [tup[1] for tup in self.filenode.annotate]
         # If pygments cropped last lines break we need do that too
-        ln_cs = len(annotate_changesets)
+        ln_cs = len(annotate_ids)
         ln_ = len(ls.splitlines())
         if  ln_cs > ln_:
-            annotate_changesets = annotate_changesets[:ln_ - ln_cs]
-        annotate = ''.join((self.annotate_from_changeset(changeset)
-            for changeset in annotate_changesets))
+            annotate_ids = annotate_ids[:ln_ - ln_cs]
+        # cell of each changeset is rendered once
+        cells = {}
+        for sha, changeset in get_annotate_changesets(
+                self.filenode.changeset.repository,
+                self.filenode.annotate).iteritems():
+            cells[sha] = self.annotate_from_changeset(changeset)
+        annotate = ''.join(cells[sha] for sha in annotate_ids)
         # in case you wonder about the seemingly redundant <div> here:
         # since the content in the other cell also is wrapped in a div,
         # some browsers in some configurations seem to mess up the formatting.
@@ -8,60 +8,445 @@
     :created_on: Jan 21, 2011
     :copyright: (c) 2010-2011 by Marcin Kuzminski, Lukasz Balcerzak.
 """
+import bz2
+import stat
+import time
+import zlib
+import struct
+import tarfile
+import zipfile
+import posixpath
+import multiprocessing
+from collections import deque
+from multiprocessing.pool import ThreadPool
 
+from vcs.conf import settings
+from vcs.exceptions import ImproperArchiveTypeError
 
-class BaseArchiver(object):
+
+def _deflate_block(data, level, last):
+    """
+    Returns raw deflate stream of given ``data`` compressed independently of
+    preceding data. Unless ``last`` is set, the stream is ended by a sync
+    flush so that streams of consecutive blocks may be concatenated.
+    """
+    compressor = zlib.compressobj(level, zlib.DEFLATED, -zlib.MAX_WBITS)
+    mode = last and zlib.Z_FINISH or zlib.Z_SYNC_FLUSH
+    return compressor.compress(data) + compressor.flush(mode)
+
+
+class CompressionPool(object):
+    """
+    Pool of ``threads`` threads compressing blocks of data. Threads are
+    started when the first block is submitted, so a pool may be shared by
+    all compressors of an archive and cost nothing if none of them needs
+    it.
+    """
+
+    def __init__(self, threads):
+        self.threads = threads
+        self._pool = None
+
+    def apply_async(self, func, args):
+        if self._pool is None:
+            self._pool = ThreadPool(self.threads)
+        return self._pool.apply_async(func, args)
+
+    def close(self):
+        """
+        Stops worker threads (if any were started).
+        """
+        if self._pool is not None:
+            self._pool.terminate()
+            self._pool = None
+
+
+class Deflater(object):
+    """
+    Produces raw deflate stream. If more than one thread is given, data is
+    split into blocks of ``block_size`` bytes which are compressed in
+    parallel (the way ``pigz`` does it; zlib releases the GIL while
+    compressing). Compressed blocks are returned in order and at most two
+    blocks per thread are pending at any time.
+
+    Blocks are compressed by given ``CompressionPool``; if none is given,
+    deflater uses its own pool, stopped by ``flush`` or ``close``.
+    """
+
+    def __init__(self, level=6, threads=1, block_size=128 * 1024, pool=None):
+        self.level = level
+        self.threads = threads
+        self.block_size = block_size
+        self._buffer = []
+        self._buffered = 0
+        self._pending = deque()
+        self._own_pool = pool is None
+        self._pool = pool or CompressionPool(threads)
+        if threads <= 1:
+            self._compressor = zlib.compressobj(level, zlib.DEFLATED,
+                                                -zlib.MAX_WBITS)
+
+    def compress(self, data):
+        """
+        Returns next part of compressed stream (possibly empty string).
+        """
+        if self.threads <= 1:
+            return self._compressor.compress(data)
+        self._buffer.append(data)
+        self._buffered += len(data)
+        if self._buffered < self.block_size:
+            return ''
+        data = ''.join(self._buffer)
+        blocks = len(data) // self.block_size
+        end = blocks * self.block_size
+        for pos in xrange(0, end, self.block_size):
+            self._submit(data[pos:pos + self.block_size], False)
+        self._buffer = [data[end:]]
+        self._buffered = len(data) - end
+        return self._collect(wait=len(self._pending) > 2 * self.threads)
+
+    def flush(self):
+        """
+        Returns the rest of compressed stream.
+        """
+        if self.threads <= 1:
+            return self._compressor.flush()
+        self._submit(''.join(self._buffer), True)
+        self._buffer = []
+        self._buffered = 0
+        try:
+            return self._collect(wait=True, all=True)
+        finally:
+            self.close()
+
+    def close(self):
+        """
+        Drops pending blocks and stops worker threads of deflater's own pool.
+        """
+        if self._own_pool:
+            self._pool.close()
+        self._pending.clear()
+
+    def _submit(self, data, last):
+        if last and not self._pending:
+            # whole stream fits within single block
+            self._pending.append(_deflate_block(data, self.level, True))
+            return
+        self._pending.append(self._pool.apply_async(_deflate_block,
+            (data, self.level, last)))
+
+    def _collect(self, wait=False, all=False):
+        chunks = []
+        while self._pending:
+            result = self._pending[0]
+            if isinstance(result, str):
+                chunks.append(result)
+            elif result.ready() or wait:
+                chunks.append(result.get())
+            else:
+                break
+            self._pending.popleft()
+            wait = all or len(self._pending) > 2 * self.threads
+        return ''.join(chunks)
+
+
+class GzipCompressor(object):
+    """
+    Produces gzip stream (with fixed ``mtime`` in its header, so archives of
+    the same content are identical) using ``Deflater``.
+    """
+
+    def __init__(self, level=6, threads=1, mtime=0, pool=None):
+        self._deflater = Deflater(level, threads,
+                                  settings.ARCHIVE_COMPRESSION_BLOCK_SIZE, pool)
+        self._crc = zlib.crc32('') & 0xffffffff
+        self._size = 0
+        xfl = level == 9 and 2 or level == 1 and 4 or 0
+        self._header = struct.pack('<BBBBLBB', 0x1f, 0x8b, zlib.DEFLATED, 0,
+                                   int(mtime) & 0xffffffff, xfl, 255)
+
+    def compress(self, data):
+        self._crc = zlib.crc32(data, self._crc) & 0xffffffff
+        self._size += len(data)
+        chunk = self._deflater.compress(data)
+        if self._header:
+            chunk, self._header = self._header + chunk, ''
+        return chunk
+
+    def flush(self):
+        return self._header + self._deflater.flush() + \
+            struct.pack('<LL', self._crc, self._size & 0xffffffff)
+
+    def close(self):
+        self._deflater.close()
+
+
+class _Output(object):
+    """
+    Writes to given ``stream`` counting written bytes (so it can be told
+    position even if ``stream`` is not seekable).
+    """
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.position = 0
+
+    def write(self, data):
+        if data:
+            self.stream.write(data)
+            self.position += len(data)
+
+    def tell(self):
+        return self.position
+
+    def flush(self):
+        pass
+
+
+class ChunkBuffer(object):
+    """
+    Stream collecting written data, so it can be taken out in chunks of
+    given size while archive is still being written.
+    """
 
     def __init__(self):
+        self._chunks = deque()
+        self.size = 0
+
+    def write(self, data):
+        if data:
+            self._chunks.append(data)
+            self.size += len(data)
+
+    def iter_chunks(self, chunk_size, flush=False):
+        """
+        Yields and removes chunks of ``chunk_size`` bytes of written data. If
+        ``flush`` is set, the rest of data is yielded too.
+        """
+        while self.size >= chunk_size or (flush and self.size):
+            parts = []
+            needed = min(chunk_size, self.size)
+            while needed:
+                data = self._chunks.popleft()
+                if len(data) > needed:
+                    self._chunks.appendleft(data[needed:])
+                    data = data[:needed]
+                parts.append(data)
+                needed -= len(data)
+            chunk = ''.join(parts)
+            self.size -= len(chunk)
+            yield chunk
+
+
+class BaseArchiver(object):
+    """
+    Writes archive of files added by ``addfile`` to given ``stream`` (which
+    only needs to have ``write`` method). Paths are prefixed with ``prefix``
+    and all entries get ``mtime`` as modification time.
+
+    ``level`` is compression level from 0 (data is stored) to 9 (defaults to
+    ``ARCHIVE_COMPRESSION_LEVEL`` setting) and ``threads`` is number of
+    threads compressing data in parallel, if archive kind allows it
+    (defaults to ``ARCHIVE_COMPRESSION_THREADS`` setting or number of
+    CPUs). Compressing threads are shared by all files of the archive and
+    stopped by ``close`` or ``abort``.
+    """
+
+    def __init__(self, stream, prefix='', mtime=None, level=None,
+                 threads=None):
+        self.output = _Output(stream)
+        self.prefix = prefix
+        self.mtime = int(time.time() if mtime is None else mtime)
+        if level is None:
+            level = settings.ARCHIVE_COMPRESSION_LEVEL
+        if threads is None:
+            threads = settings.ARCHIVE_COMPRESSION_THREADS
+        if threads is None:
+            try:
+                threads = multiprocessing.cpu_count()
+            except NotImplementedError:
+                threads = 1
+        self.level = level
+        self.threads = threads
+        self.pool = CompressionPool(threads)
         self.archive_file = self._get_archive_file()
 
-    def addfile(self):
+    def addfile(self, path, mode, content):
         """
         Adds a file to archive container
+
+        :param path: path of file within archive (without prefix)
+        :param mode: git-like mode of file (regular, executable, symlink
+            or gitlink - which is added as empty directory)
+        :param content: file's content (or target of symlink)
         """
-        pass
+        raise NotImplementedError
 
     def close(self):
         """
         Closes and finalizes operation of archive container object
         """
+        try:
+            self._finish()
+        finally:
+            self.abort()
+
+    def abort(self):
+        """
+        Releases resources (compressing threads) of the archiver without
+        finishing the archive. Safe to call more than once, i.e. after
+        ``close``.
+        """
+        self.pool.close()
+
+    def _finish(self):
+        """
+        Writes the rest of archive
+        """
         self.archive_file.close()
 
     def _get_archive_file(self):
         """
         Returns container for specific archive
         """
-        raise NotImplementedError()
+        raise NotImplementedError
+
+    def _get_path(self, path):
+        if self.prefix:
+            return posixpath.join(self.prefix, path)
+        return path
 
 
 class TarArchiver(BaseArchiver):
-    pass
 
+    def _get_compressor(self):
+        return None
+
+    def _get_archive_file(self):
+        self._compressor = self._get_compressor()
+        self._offset = 0
+        return self
+
+    def addfile(self, path, mode, content):
+        info = tarfile.TarInfo(self._get_path(path))
+        info.mtime = self.mtime
+        info.uname = info.gname = 'root'
+        if stat.S_ISLNK(mode):
+            info.type = tarfile.SYMTYPE
+            info.linkname = content
+            info.mode = 0777
+            content = ''
+        elif mode & 0170000 == 0160000:
+            info.type = tarfile.DIRTYPE
+            info.mode = 0755
+            content = ''
+        else:
+            info.mode = mode & 0111 and 0755 or 0644
+            info.size = len(content)
+        self._write(info.tobuf(tarfile.GNU_FORMAT))
+        if content:
+            self._write(content)
+            remainder = len(content) % tarfile.BLOCKSIZE
+            if remainder:
+                self._write(tarfile.NUL * (tarfile.BLOCKSIZE - remainder))
+
+    def _finish(self):
+        # end of archive marker, padded to the full record
+        self._write(tarfile.NUL * (tarfile.BLOCKSIZE * 2))
+        remainder = self._offset % tarfile.RECORDSIZE
+        if remainder:
+            self._write(tarfile.NUL * (tarfile.RECORDSIZE - remainder))
+        if self._compressor is not None:
+            self.output.write(self._compressor.flush())
+
+    def _write(self, data):
+        self._offset += len(data)
+        if self._compressor is not None:
+            data = self._compressor.compress(data)
+        self.output.write(data)
+
+
+class Tbz2Archiver(TarArchiver):
 
-class Tbz2Archiver(BaseArchiver):
-    pass
+    def _get_compressor(self):
+        # bzip2 has no store mode and its streams cannot be split into
+        # blocks readable by python's ``bz2`` module, so data is compressed
+        # by single thread
+        return bz2.BZ2Compressor(min(max(self.level, 1), 9))
 
 
-class TgzArchiver(BaseArchiver):
-    pass
+class TgzArchiver(TarArchiver):
+
+    def _get_compressor(self):
+        return GzipCompressor(self.level, self.threads, self.mtime,
+                              self.pool)
 
 
 class ZipArchiver(BaseArchiver):
-    pass
+    """
+    Files with extensions listed at ``ARCHIVE_STORED_EXTENSIONS`` (which are
+    already compressed) are stored rather than deflated.
+    """
+
+    def _get_archive_file(self):
+        return zipfile.ZipFile(self.output, 'w', allowZip64=True)
+
+    def addfile(self, path, mode, content):
+        path = self._get_path(path)
+        if mode & 0170000 == 0160000:
+            path += '/'
+            mode = stat.S_IFDIR | 0755
+            content = ''
+        elif stat.S_ISLNK(mode):
+            mode = stat.S_IFLNK | 0777
+        else:
+            mode = stat.S_IFREG | (mode & 0111 and 0755 or 0644)
+        info = zipfile.ZipInfo(path, time.localtime(self.mtime)[:6])
+        info.create_system = 3
+        info.external_attr = mode << 16
+        if stat.S_ISDIR(mode):
+            info.external_attr |= 0x10
+        info.file_size = len(content)
+        info.CRC = zlib.crc32(content) & 0xffffffff
+        ext = posixpath.splitext(path)[1].lower()
+        if self.level and content and \
+                ext not in settings.ARCHIVE_STORED_EXTENSIONS:
+            info.compress_type = zipfile.ZIP_DEFLATED
+            deflater = Deflater(self.level, self.threads,
+                                settings.ARCHIVE_COMPRESSION_BLOCK_SIZE,
+                                self.pool)
+            content = deflater.compress(content) + deflater.flush()
+        info.compress_size = len(content)
+        info.header_offset = self.output.tell()
+        self.output.write(info.FileHeader())
+        self.output.write(content)
+        # central directory is written by ``ZipFile.close``
+        self.archive_file.filelist.append(info)
+        self.archive_file.NameToInfo[info.filename] = info
 
 
-def get_archiver(self, kind):
+ARCHIVERS = {
+    'tar': TarArchiver,
+    'tbz2': Tbz2Archiver,
+    'tgz': TgzArchiver,
+    'zip': ZipArchiver,
+}
+
+
+def get_archiver(kind, stream, **kwargs):
     """
     Returns instance of archiver class specific to given kind
 
     :param kind: archive kind
-    """
+    :param stream: stream archive is written to
+    :param kwargs: passed to archiver class (``prefix``, ``mtime``,
+        ``level``, ``threads``)
 
-    archivers = {
-        'tar': TarArchiver,
-        'tbz2': Tbz2Archiver,
-        'tgz': TgzArchiver,
-        'zip': ZipArchiver,
-    }
-
-    return archivers[kind]()
+    :raises ``ImproperArchiveTypeError``: if kind is not supported
+    """
+    try:
+        archiver_class = ARCHIVERS[kind]
+    except KeyError:
+        raise ImproperArchiveTypeError('Archive kind not supported use one '
+            'of %s' % ARCHIVERS.keys())
+    return archiver_class(stream, **kwargs)
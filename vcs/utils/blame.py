@@ -0,0 +1,171 @@
+# -*- coding: utf-8 -*-
+"""
+    vcs.utils.blame
+    ~~~~~~~~~~~~~~~
+
+    Incremental annotation (blame) of file versions.
+
+    :created_on: Oct 17, 2026
+    :copyright: (c) 2010-2011 by Marcin Kuzminski, Lukasz Balcerzak.
+"""
+from difflib import SequenceMatcher
+
+
+def get_matching_blocks(a, b):
+    """
+    Returns list of triples ``(i, j, n)`` of matching blocks of sequences of
+    lines ``a`` and ``b`` (``a[i:i + n] == b[j:j + n]``). Common prefix and
+    suffix are matched without running the matcher, so small changes of big
+    files are cheap.
+    """
+    prefix = 0
+    end = min(len(a), len(b))
+    while prefix < end and a[prefix] == b[prefix]:
+        prefix += 1
+    suffix = 0
+    end -= prefix
+    while suffix < end and a[-suffix - 1] == b[-suffix - 1]:
+        suffix += 1
+    blocks = []
+    if prefix:
+        blocks.append((0, 0, prefix))
+    a_middle = a[prefix:len(a) - suffix]
+    b_middle = b[prefix:len(b) - suffix]
+    if a_middle and b_middle:
+        matcher = SequenceMatcher(None, a_middle, b_middle, autojunk=False)
+        for i, j, n in matcher.get_matching_blocks():
+            if n:
+                blocks.append((prefix + i, prefix + j, n))
+    if suffix:
+        blocks.append((len(a) - suffix, len(b) - suffix, suffix))
+    return blocks
+
+
+class Annotator(object):
+    """
+    Annotates versions of a file, i.e. finds id of commit which introduced
+    each line of given version.
+
+    Annotation of a version is computed from annotations of its parent
+    versions: lines matching a parent's line take its commit and the rest
+    belong to the version's own commit. Annotations are kept in given
+    ``cache`` (``LRUCache`` like object; size of entry is its number of
+    lines), so after a change of file only the
+    new version is compared with its parents. Versions without cached
+    annotation are visited by iterative depth-first walk.
+
+    Subclasses define what a version is by implementing ``get_key``,
+    ``get_parents``, ``get_lines`` and ``get_commit_id``.
+    """
+
+    def __init__(self, cache):
+        self.cache = cache
+
+    def annotate(self, version):
+        """
+        Returns tuple of commit ids, one for each line of given ``version``.
+        """
+        target = self.get_key(version)
+        annotation = self.cache.get(target)
+        if annotation is not None:
+            return annotation
+
+        annotations = {}
+        # lines of versions annotated within this walk
+        lines_of = {}
+        parents = {}
+        # number of not yet annotated children of each version
+        needed = {}
+        stack = [version]
+        while stack:
+            version = stack[-1]
+            key = self.get_key(version)
+            if key in annotations:
+                stack.pop()
+                continue
+            if key not in parents:
+                annotation = self.cache.get(key)
+                if annotation is not None:
+                    annotations[key] = annotation
+                    stack.pop()
+                    continue
+                parents[key] = self.get_parents(version)
+                missing = []
+                for parent in parents[key]:
+                    parent_key = self.get_key(parent)
+                    needed[parent_key] = needed.get(parent_key, 0) + 1
+                    if parent_key not in annotations:
+                        missing.append(parent)
+                if missing:
+                    stack.extend(reversed(missing))
+                    continue
+
+            stack.pop()
+            lines = self.get_lines(version)
+            annotation = [None] * len(lines)
+            for parent in parents.pop(key):
+                parent_key = self.get_key(parent)
+                parent_annotation = annotations[parent_key]
+                parent_lines = lines_of.get(parent_key)
+                if parent_lines is None:
+                    parent_lines = self.get_lines(parent)
+                for i, j, n in get_matching_blocks(parent_lines, lines):
+                    for k in xrange(n):
+                        if annotation[j + k] is None:
+                            annotation[j + k] = parent_annotation[i + k]
+                needed[parent_key] -= 1
+                if not needed[parent_key] and parent_key != target:
+                    del annotations[parent_key]
+                    lines_of.pop(parent_key, None)
+            commit_id = self.get_commit_id(version)
+            annotation = tuple(commit_id if c is None else c
+                               for c in annotation)
+            annotations[key] = annotation
+            lines_of[key] = lines
+            self.cache.set(key, annotation, len(annotation))
+        return annotations[target]
+
+    def get_key(self, version):
+        """
+        Returns hashable key of given ``version`` under which its annotation
+        is cached.
+        """
+        raise NotImplementedError
+
+    def get_parents(self, version):
+        """
+        Returns list of parent versions of given ``version``.
+        """
+        raise NotImplementedError
+
+    def get_lines(self, version):
+        """
+        Returns list of lines of given ``version``.
+        """
+        raise NotImplementedError
+
+    def get_commit_id(self, version):
+        """
+        Returns id of commit which introduced given ``version``.
+        """
+        raise NotImplementedError
+
+
+def get_annotate_changesets(repository, annotate):
+    """
+    Returns dict mapping ids of changesets within given ``annotate`` (as
+    returned by ``get_file_annotate``) to changesets. Each distinct id is
+    resolved once and all of them by single ``get_changesets_bulk`` call,
+    instead of loading changeset for each annotated line.
+
+    :param repository: repository the annotated file belongs to
+    :param annotate: sequence of annotate tuples
+    """
+    ids = []
+    seen = set()
+    for annotate_data in annotate:
+        sha = annotate_data[1]
+        if sha not in seen:
+            seen.add(sha)
+            ids.append(sha)
+    return dict(zip(ids, repository.get_changesets_bulk(ids)))
@@ -0,0 +1,199 @@
+# -*- coding: utf-8 -*-
+"""
+    vcs.utils.diffcache
+    ~~~~~~~~~~~~~~~~~~~
+
+    Persistent cache of raw and parsed diffs, shared by processes.
+
+    :created_on: Oct 17, 2026
+    :copyright: (c) 2010-2011 by Marcin Kuzminski, Lukasz Balcerzak.
+"""
+from __future__ import with_statement
+
+import os
+import zlib
+import errno
+import hashlib
+import logging
+import tempfile
+import threading
+import cPickle as pickle
+
+from vcs.conf import settings
+
+log = logging.getLogger(__name__)
+
+_caches = {}
+_caches_lock = threading.Lock()
+
+
+class DiffCache(object):
+    """
+    Cache of diffs kept at directory at given ``path``. As diffs between
+    given revisions never change, entries are never invalidated, only
+    evicted once their total size exceeds ``max_size`` bytes (least recently
+    used entries first; modification time of entry is updated on each hit).
+
+    Each entry is a file named by SHA-1 of its key holding pickled and
+    compressed value. Entries are written to temporary files which are then
+    renamed, so many processes may safely share the directory. Values are
+    unpickled, so the directory must not be writable by untrusted users.
+
+    Number of lookups which found (``hits``) or did not find (``misses``)
+    value are counted.
+    """
+
+    # once eviction starts, entries are removed until total size drops below
+    # this fraction of ``max_size``
+    low_water_mark = 0.9
+
+    def __init__(self, path, max_size=None, level=6):
+        """
+        :param path: path of cache's directory (created if needed)
+        :param max_size: maximal total size of entries in bytes
+        :param level: zlib compression level of entries
+        """
+        self.path = path
+        self.max_size = max_size
+        self.level = level
+        self.hits = 0
+        self.misses = 0
+        # estimated total size of entries (``None`` until directory is
+        # scanned)
+        self._size = None
+        self._lock = threading.Lock()
+
+    def _get_path(self, key):
+        digest = hashlib.sha1(repr(key)).hexdigest()
+        return os.path.join(self.path, digest[:2], digest[2:])
+
+    def get(self, key, default=None):
+        """
+        Returns value stored for given ``key`` or ``default`` if there is no
+        such (readable) entry.
+        """
+        path = self._get_path(key)
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+            value = pickle.loads(zlib.decompress(data))
+        except IOError:
+            self.misses += 1
+            return default
+        except Exception, err:
+            log.warning('Removing broken diff cache entry %s: %s'
+                        % (path, err))
+            self._remove(path)
+            self.misses += 1
+            return default
+        try:
+            os.utime(path, None)
+        except OSError:
+            pass
+        self.hits += 1
+        return value
+
+    def set(self, key, value):
+        """
+        Stores ``value`` (which must be picklable) for given ``key``.
+        """
+        data = zlib.compress(pickle.dumps(value, pickle.HIGHEST_PROTOCOL),
+                             self.level)
+        path = self._get_path(key)
+        dir_path = os.path.dirname(path)
+        try:
+            os.makedirs(dir_path)
+        except OSError, err:
+            if err.errno != errno.EEXIST:
+                raise
+        fd, tmp_path = tempfile.mkstemp(suffix='.tmp', dir=dir_path)
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            if os.name == 'nt' and os.path.exists(path):
+                os.remove(path)
+            os.rename(tmp_path, path)
+        except:
+            self._remove(tmp_path)
+            raise
+
+        with self._lock:
+            if self._size is None:
+                self._size = sum(size for mtime, size, entry_path
+                                 in self._scan())
+            else:
+                self._size += len(data)
+            if self.max_size is not None and self._size > self.max_size:
+                self._evict()
+
+    def clear(self):
+        """
+        Removes all entries and resets counters.
+        """
+        with self._lock:
+            for mtime, size, path in self._scan():
+                self._remove(path)
+            self._size = 0
+            self.hits = 0
+            self.misses = 0
+
+    def _scan(self):
+        """
+        Returns list of tuples (mtime, size, path) of all entries.
+        """
+        entries = []
+        try:
+            dir_names = os.listdir(self.path)
+        except OSError:
+            return entries
+        for dir_name in dir_names:
+            dir_path = os.path.join(self.path, dir_name)
+            try:
+                names = os.listdir(dir_path)
+            except OSError:
+                continue
+            for name in names:
+                if name.endswith('.tmp'):
+                    continue
+                path = os.path.join(dir_path, name)
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    # removed by other process
+                    continue
+                entries.append((st.st_mtime, st.st_size, path))
+        return entries
+
+    def _evict(self):
+        # other processes add entries too, so look at what is really there
+        entries = sorted(self._scan())
+        size = sum(entry[1] for entry in entries)
+        limit = self.max_size * self.low_water_mark
+        for mtime, entry_size, path in entries:
+            if size <= limit:
+                break
+            self._remove(path)
+            size -= entry_size
+        self._size = size
+
+    def _remove(self, path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+def get_diff_cache():
+    """
+    Returns ``DiffCache`` at ``DIFF_CACHE_PATH`` (shared within the process)
+    or ``None`` if the setting is not set.
+    """
+    path = settings.DIFF_CACHE_PATH
+    if not path:
+        return None
+    with _caches_lock:
+        cache = _caches.get(path)
+        if cache is None:
+            cache = _caches[path] = DiffCache(path,
+                max_size=settings.DIFF_CACHE_SIZE)
+        return cache
@@ -3,6 +3,7 @@
 # licensed under the BSD license.
 
 import re
+import array
 import difflib
 import logging
 import itertools
@@ -12,6 +13,8 @@ from difflib import unified_diff
 from vcs.exceptions import VCSError
 from vcs.nodes import FileNode, NodeError
 from vcs.utils import safe_unicode
+from vcs.utils.diffcache import get_diff_cache
+from vcs.utils.lazy import LazyProperty
 
 
 def get_udiff(filenode_old, filenode_new, show_whitespace=True):
@@ -69,6 +72,111 @@ def get_gitdiff(filenode_old, filenode_new, ignore_whitespace=True):
     return vcs_gitdiff
 
 
+def get_diff_processor(repo, rev1, rev2, path=None, ignore_whitespace=False,
+                       context=3, differ='diff'):
+    """
+    Returns ``DiffProcessor`` of *diff* between given revisions of ``repo``
+    (see ``get_diff`` of repositories). If ``DIFF_CACHE_PATH`` is set, diff
+    parsed once is read back from the cache.
+    """
+    cache = get_diff_cache()
+    if cache is None:
+        return DiffProcessor(repo.get_diff_iter(rev1, rev2, path,
+            ignore_whitespace, context), differ=differ, format='gitdiff')
+
+    rev1, rev2 = repo._get_diff_revisions(rev1, rev2)
+    key = repo._get_diff_cache_key('parsed', rev1, rev2, path,
+                                   ignore_whitespace, context)
+    parsed = cache.get(key)
+    if parsed is not None:
+        processor = DiffProcessor([], differ=differ, format='gitdiff')
+        processor.parsed = parsed
+    else:
+        processor = DiffProcessor(repo.get_diff_iter(rev1, rev2, path,
+            ignore_whitespace, context), differ=differ, format='gitdiff')
+        cache.set(key, processor.parsed)
+    return processor
+
+
+class DiffFile(object):
+    """
+    Compact representation of single file's part of parsed diff. Instead of
+    dict per line, lines' numbers and actions are kept in parallel arrays
+    and lines' texts as offsets within single string of the whole file.
+    Line number ``0`` stands for no line and ``-1`` for context marker.
+    """
+    __slots__ = ('filename', 'old_revision', 'new_revision', 'limited',
+                 'adds', 'removes', 'old_linenos', 'new_linenos', 'actions',
+                 'chunk_starts', 'offsets', 'text', '_parts')
+
+    ACTIONS = ('unmod', 'add', 'del', 'context')
+    UNMOD, ADD, DEL, CONTEXT = range(4)
+
+    def __init__(self, filename, old_revision, new_revision):
+        self.filename = filename
+        self.old_revision = old_revision
+        self.new_revision = new_revision
+        self.limited = False
+        self.adds = 0
+        self.removes = 0
+        self.old_linenos = array.array('l')
+        self.new_linenos = array.array('l')
+        self.actions = array.array('b')
+        # index of the first line of each chunk
+        self.chunk_starts = array.array('l')
+        # end of each line's text within ``text``
+        self.offsets = array.array('l')
+        self.text = ''
+        self._parts = []
+
+    def __len__(self):
+        return len(self.actions)
+
+    def _add_chunk(self):
+        self.chunk_starts.append(len(self.actions))
+
+    def _add_line(self, old_lineno, new_lineno, action, line):
+        self.old_linenos.append(old_lineno)
+        self.new_linenos.append(new_lineno)
+        self.actions.append(action)
+        end = len(line)
+        if self.offsets:
+            end += self.offsets[-1]
+        self.offsets.append(end)
+        self._parts.append(line)
+
+    def _finish(self):
+        self.text = ''.join(self._parts)
+        self._parts = None
+
+    def _get_lineno(self, lineno):
+        if lineno > 0:
+            return lineno
+        return lineno and '...' or ''
+
+    def get_line(self, index):
+        """
+        Returns dict (with ``old_lineno``, ``new_lineno``, ``action`` and
+        ``line`` keys) of the line at given ``index``.
+        """
+        start = index and self.offsets[index - 1]
+        return {
+            'old_lineno': self._get_lineno(self.old_linenos[index]),
+            'new_lineno': self._get_lineno(self.new_linenos[index]),
+            'action':     self.ACTIONS[self.actions[index]],
+            'line':       self.text[start:self.offsets[index]],
+        }
+
+    def iter_chunks(self):
+        """
+        Yields lists of lines' dicts (see ``get_line``) of each chunk. Dicts
+        are created for one chunk at a time.
+        """
+        ends = self.chunk_starts[1:].tolist() + [len(self.actions)]
+        for start, end in itertools.izip(self.chunk_starts, ends):
+            yield [self.get_line(i) for i in xrange(start, end)]
+
+
 class DiffProcessor(object):
     """
     Give it a unified diff and it returns a list of the files that were
@@ -87,29 +195,55 @@ class DiffProcessor(object):
 
         self.__udiff = diff
         self.__format = format
+        self.__streamed = False
         self.adds = 0
         self.removes = 0
 
-        if isinstance(self.__udiff, basestring):
-            self.lines = iter(self.__udiff.splitlines(1))
-
-        elif self.__format == 'gitdiff':
-            udiff_copy = self.copy_iterator()
-            self.lines = itertools.imap(self.escaper,
-                                        self._parse_gitdiff(udiff_copy))
-        else:
-            udiff_copy = self.copy_iterator()
-            self.lines = itertools.imap(self.escaper, udiff_copy)
-
         # Select a differ.
         if differ == 'difflib':
             self.differ = self._highlight_line_difflib
         else:
             self.differ = self._highlight_line_udiff
 
+    @LazyProperty
+    def lines(self):
+        """
+        Returns iterator over escaped lines of a copy of the diff.
+        """
+        udiff_copy = self.copy_iterator()
+        if self.__format == 'gitdiff':
+            udiff_copy = self._parse_gitdiff(udiff_copy)
+        else:
+            udiff_copy = self._iter_lines(udiff_copy)
+        return itertools.imap(self.escaper, udiff_copy)
+
     def escaper(self, string):
         return string.replace('<', '&lt;').replace('>', '&gt;')
 
+    def _iter_lines(self, chunks):
+        """
+        Yields lines (with line endings) of the diff given as iterable of
+        chunks of any size. Chunks are never joined together, so only the
+        line being read is kept in memory.
+        """
+        pending = []
+        for chunk in chunks:
+            start = 0
+            end = chunk.find('\n') + 1
+            while end:
+                if pending:
+                    pending.append(chunk[start:end])
+                    yield ''.join(pending)
+                    pending = []
+                else:
+                    yield chunk[start:end]
+                start = end
+                end = chunk.find('\n', start) + 1
+            if start < len(chunk):
+                pending.append(chunk[start:])
+        if pending:
+            yield ''.join(pending)
+
     def copy_iterator(self):
         """
         make a fresh copy of generator, we should not iterate thru
@@ -144,27 +278,7 @@ class DiffProcessor(object):
         return None, None, None
 
     def _parse_gitdiff(self, diffiterator):
-        def line_decoder(l):
-            if l.startswith('+') and not l.startswith('+++'):
-                self.adds += 1
-            elif l.startswith('-') and not l.startswith('---'):
-                self.removes += 1
-            return safe_unicode(l)
-
-        output = list(diffiterator)
-        size = len(output)
-
-        if size == 2:
-            l = []
-            l.extend([output[0]])
-            l.extend(output[1].splitlines(1))
-            return map(line_decoder, l)
-        elif size == 1:
-            return  map(line_decoder, output[0].splitlines(1))
-        elif size == 0:
-            return []
-
-        raise Exception('wrong size of diff %s' % size)
+        return itertools.imap(safe_unicode, self._iter_lines(diffiterator))
 
     def _highlight_line_difflib(self, line, next):
         """
@@ -226,12 +340,15 @@ class DiffProcessor(object):
             do(line)
             do(next)
 
-    def _parse_udiff(self):
+    def _iter_files(self, lineiter, max_file_lines=None, max_lines=None):
         """
-        Parse the diff an return data for the template.
+        Parses lines of the diff and yields ``DiffFile`` objects, each as
+        soon as all of its lines are read. At most ``max_file_lines`` lines
+        are kept for each file and at most ``max_lines`` lines for all of
+        them; files with skipped lines have ``limited`` flag set.
         """
-        lineiter = self.lines
-        files = []
+        kept = 0
+        file = None
         try:
             line = lineiter.next()
             # skip first context
@@ -242,15 +359,13 @@ class DiffProcessor(object):
                     line = lineiter.next()
                     continue
 
-                chunks = []
+                if file is not None:
+                    file._finish()
+                    yield file
                 filename, old_rev, new_rev = \
                     self._extract_rev(line, lineiter.next())
-                files.append({
-                    'filename':         filename,
-                    'old_revision':     old_rev,
-                    'new_revision':     new_rev,
-                    'chunks':           chunks
-                })
+                file = DiffFile(filename, old_rev, new_rev)
+                file_kept = 0
 
                 line = lineiter.next()
                 while line:
@@ -258,8 +373,7 @@ class DiffProcessor(object):
                     if not match:
                         break
 
-                    lines = []
-                    chunks.append(lines)
+                    file._add_chunk()
 
                     old_line, old_end, new_line, new_end = \
                         [int(x or 1) for x in match.groups()[:-1]]
@@ -270,15 +384,16 @@ class DiffProcessor(object):
                     new_end += new_line
 
                     if context:
-                        if not skipfirst:
-                            lines.append({
-                                'old_lineno': '...',
-                                'new_lineno': '...',
-                                'action': 'context',
-                                'line': line,
-                            })
-                        else:
+                        if skipfirst:
                             skipfirst = False
+                        elif (max_file_lines is None or
+                                file_kept < max_file_lines) and \
+                                (max_lines is None or kept < max_lines):
+                            file._add_line(-1, -1, DiffFile.CONTEXT, line)
+                            file_kept += 1
+                            kept += 1
+                        else:
+                            file.limited = True
 
                     line = lineiter.next()
                     while old_line < old_end or new_line < new_end:
@@ -293,45 +408,103 @@ class DiffProcessor(object):
                             continue
                         elif command == '+':
                             affects_new = True
-                            action = 'add'
+                            action = DiffFile.ADD
+                            file.adds += 1
                         elif command == '-':
                             affects_old = True
-                            action = 'del'
+                            action = DiffFile.DEL
+                            file.removes += 1
                         else:
                             affects_old = affects_new = True
-                            action = 'unmod'
+                            action = DiffFile.UNMOD
 
                         old_line += affects_old
                         new_line += affects_new
-                        lines.append({
-                            'old_lineno':   affects_old and old_line or '',
-                            'new_lineno':   affects_new and new_line or '',
-                            'action':       action,
-                            'line':         line
-                        })
+                        if (max_file_lines is None or
+                                file_kept < max_file_lines) and \
+                                (max_lines is None or kept < max_lines):
+                            file._add_line(affects_old and old_line,
+                                affects_new and new_line, action, line)
+                            file_kept += 1
+                            kept += 1
+                        else:
+                            file.limited = True
                         line = lineiter.next()
 
         except StopIteration:
             pass
 
-        # highlight inline changes
-        for file in files:
-            for chunk in chunks:
-                lineiter = iter(chunk)
-                #first = True
-                try:
-                    while 1:
-                        line = lineiter.next()
-                        if line['action'] != 'unmod':
-                            nextline = lineiter.next()
-                            if nextline['action'] == 'unmod' or \
-                               nextline['action'] == line['action']:
-                                continue
-                            self.differ(line, nextline)
-                except StopIteration:
-                    pass
+        if file is not None:
+            file._finish()
+            yield file
+
+    def _iter_highlighted_chunks(self, file):
+        """
+        Yields lists of lines' dicts of each chunk of given ``DiffFile``,
+        with inline changes of adjacent lines highlighted.
+        """
+        for chunk in file.iter_chunks():
+            lineiter = iter(chunk)
+            try:
+                while 1:
+                    line = lineiter.next()
+                    if line['action'] != 'unmod':
+                        nextline = lineiter.next()
+                        if nextline['action'] == 'unmod' or \
+                           nextline['action'] == line['action']:
+                            continue
+                        self.differ(line, nextline)
+            except StopIteration:
+                pass
+            yield chunk
+
+    def _get_file_dict(self, file):
+        return {
+            'filename':         file.filename,
+            'old_revision':     file.old_revision,
+            'new_revision':     file.new_revision,
+            'chunks':           list(self._iter_highlighted_chunks(file)),
+            'limited':          file.limited,
+        }
+
+    @LazyProperty
+    def parsed(self):
+        """
+        Returns list of ``DiffFile`` objects of parsed diff.
+        """
+        return list(self._iter_files(self.lines))
+
+    def _parse_udiff(self):
+        """
+        Parse the diff an return data for the template.
+        """
+        return [self._get_file_dict(file) for file in self.parsed]
 
-        return files
+    def iter_files(self, max_file_lines=None, max_lines=None):
+        """
+        Streaming counterpart of ``prepare``: parses the diff incrementally
+        and yields dicts of files as soon as each of them is parsed, so
+        memory used doesn't depend on size of the whole diff. Diff is
+        consumed while iterating (it is not copied), so the processor
+        cannot be used to parse it again afterwards.
+
+        Memory is bounded by given budgets of kept lines: files exceeding
+        them have the ``limited`` flag set and their further lines are only
+        counted (by ``stat``), not kept.
+
+        :param max_file_lines: maximal number of lines kept for single file
+        :param max_lines: maximal number of lines kept for all files
+        """
+        if self.__format == 'gitdiff':
+            lines = self._parse_gitdiff(self.__udiff)
+        else:
+            lines = self._iter_lines(self.__udiff)
+        lines = itertools.imap(self.escaper, lines)
+        self.__streamed = True
+        for file in self._iter_files(lines, max_file_lines, max_lines):
+            self.adds += file.adds
+            self.removes += file.removes
+            yield self._get_file_dict(file)
 
     def prepare(self):
         """
@@ -386,13 +559,13 @@ class DiffProcessor(object):
                                                                 'label': label}
             else:
                 return label
-        diff_lines = self.prepare()
         _html_empty = True
         _html = []
         _html.append('''<table class="%(table_class)s">\n''' \
                                             % {'table_class': table_class})
-        for diff in diff_lines:
-            for line in diff['chunks']:
+        for diff in self.parsed:
+            filename_id = self._safe_id(diff.filename)
+            for line in self._iter_highlighted_chunks(diff):
                 _html_empty = False
                 for change in line:
                     _html.append('''<tr class="%(line_class)s %(action)s">\n''' \
@@ -401,10 +574,10 @@ class DiffProcessor(object):
                     anchor_old_id = ''
                     anchor_new_id = ''
                     anchor_old = "%(filename)s_o%(oldline_no)s" % \
-                                {'filename': self._safe_id(diff['filename']),
+                                {'filename': filename_id,
                                  'oldline_no': change['old_lineno']}
                     anchor_new = "%(filename)s_n%(oldline_no)s" % \
-                                {'filename': self._safe_id(diff['filename']),
+                                {'filename': filename_id,
                                  'oldline_no': change['new_lineno']}
                     cond_old = change['old_lineno'] != '...' and \
                                                         change['old_lineno']
@@ -455,6 +628,10 @@ class DiffProcessor(object):
 
     def stat(self):
         """
-        Returns tuple of adde,and removed lines for this instance
+        Returns tuple of added and removed lines for this instance (of files
+        yielded so far if ``iter_files`` is used)
         """
-        return self.adds, self.removes
+        if self.__streamed:
+            return self.adds, self.removes
+        return (sum(file.adds for file in self.parsed),
+                sum(file.removes for file in self.parsed))
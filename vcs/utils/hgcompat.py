@@ -8,9 +8,9 @@ from mercurial.context import memctx, memfilectx
 from mercurial.error import RepoError, RepoLookupError, Abort
 from mercurial.hgweb.common import get_contact
 from mercurial.localrepo import localrepository
-from mercurial.match import match
+from mercurial.match import match, narrowmatcher
 from mercurial.mdiff import diffopts
-from mercurial.node import hex
+from mercurial.node import hex, nullrev
 from mercurial.encoding import tolocal
 from mercurial import discovery
 from mercurial import localrepo
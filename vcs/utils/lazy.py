@@ -41,6 +41,48 @@ class LazyProperty(object):
             obj.__dict__[self.__name__] = value
         return value
 
+
+class LazySlot(LazyProperty):
+    """
+    Same as ``LazyProperty`` but for classes with ``__slots__``: calculated
+    value is kept in slot named after the property with ``_lazy_`` prefix,
+    which the class has to declare (see ``lazy_slots``). As with
+    ``LazyProperty``, value may be assigned, i.e. by code which calculated
+    it cheaper.
+    """
+
+    def __init__(self, func):
+        super(LazySlot, self).__init__(func)
+        self.slot = '_lazy_' + self.__name__
+
+    def __get__(self, obj, klass=None):
+        if obj is None:
+            return self
+        try:
+            return getattr(obj, self.slot)
+        except AttributeError:
+            value = self._func(obj)
+            setattr(obj, self.slot, value)
+            return value
+
+    def __set__(self, obj, value):
+        setattr(obj, self.slot, value)
+
+    def __delete__(self, obj):
+        try:
+            delattr(obj, self.slot)
+        except AttributeError:
+            pass
+
+
+def lazy_slots(*names):
+    """
+    Returns tuple of names of slots needed by ``LazySlot`` properties with
+    given ``names``.
+    """
+    return tuple('_lazy_' + name for name in names)
+
+
 import threading
 
 
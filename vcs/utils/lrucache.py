@@ -0,0 +1,108 @@
+"""
+Least recently used cache bounded by number of entries and total size.
+"""
+from __future__ import with_statement
+
+import threading
+
+
+class LRUCache(object):
+    """
+    Thread-safe mapping which evicts least recently used entries once
+    ``max_entries`` or ``max_size`` (sum of sizes given to ``set``) would be
+    exceeded.
+
+    Usage::
+
+      cache = LRUCache(max_entries=1000, max_size=1024 * 1024)
+      cache.set('foo', value, size=len(value))
+      cache.get('foo')
+
+    Number of lookups which found (``hits``) or did not find (``misses``)
+    value are counted.
+    """
+
+    # indexes of link fields; links are kept in a circular doubly linked list,
+    # most recently used right after the root
+    PREV, NEXT, KEY, VALUE, SIZE = range(5)
+
+    def __init__(self, max_entries=None, max_size=None):
+        self.max_entries = max_entries
+        self.max_size = max_size
+        self._lock = threading.Lock()
+        self.clear()
+
+    def __len__(self):
+        return len(self._links)
+
+    def __contains__(self, key):
+        return key in self._links
+
+    def clear(self):
+        """
+        Removes all entries and resets counters.
+        """
+        with self._lock:
+            self._links = {}
+            self._root = root = []
+            root[:] = [root, root, None, None, 0]
+            self.size = 0
+            self.hits = 0
+            self.misses = 0
+
+    def get(self, key, default=None):
+        """
+        Returns value stored for given ``key`` (marking it as most recently
+        used) or ``default`` if there is no such entry.
+        """
+        with self._lock:
+            link = self._links.get(key)
+            if link is None:
+                self.misses += 1
+                return default
+            self.hits += 1
+            self._unlink(link)
+            self._link(link)
+            return link[self.VALUE]
+
+    def set(self, key, value, size=0):
+        """
+        Stores ``value`` for given ``key``. Values bigger than ``max_size``
+        are not stored at all.
+        """
+        if self.max_size is not None and size > self.max_size:
+            return
+        with self._lock:
+            link = self._links.pop(key, None)
+            if link is not None:
+                self._unlink(link)
+                self.size -= link[self.SIZE]
+            link = [None, None, key, value, size]
+            self._links[key] = link
+            self._link(link)
+            self.size += size
+            self._evict()
+
+    def _link(self, link):
+        root = self._root
+        first = root[self.NEXT]
+        link[self.PREV] = root
+        link[self.NEXT] = first
+        first[self.PREV] = link
+        root[self.NEXT] = link
+
+    def _unlink(self, link):
+        prev, next = link[self.PREV], link[self.NEXT]
+        prev[self.NEXT] = next
+        next[self.PREV] = prev
+
+    def _evict(self):
+        root = self._root
+        while self._links and (
+                (self.max_entries is not None
+                 and len(self._links) > self.max_entries) or
+                (self.max_size is not None and self.size > self.max_size)):
+            link = root[self.PREV]
+            self._unlink(link)
+            del self._links[link[self.KEY]]
+            self.size -= link[self.SIZE]